@@ -0,0 +1,305 @@
+"""Soak test, runs the probe loop for millions of iterations and fails if the
+locker's footprint keeps growing.
+
+Usage, with sciber_yklocker installed (pip install -e .):
+    python benchmarks/soak.py [--iterations N] [--samples N]
+        [--backend sysfs|ykman|allowlist] [--removal-every N] [--output FILE]
+
+The loop runs against fake backends on a virtual clock: every iteration is
+woken right away and moves the clock by the probe delay, so an hour of
+probing takes seconds. Every --removal-every iterations the YubiKey is
+removed and put back, the lock action runs `true` through the same executor
+as the real lock commands. Log messages go through the locker's logger, on
+Linux syslog itself is left out. The metrics file is written like with -x,
+every 50 probe intervals.
+
+Traced memory, resident memory, open fds and threads are sampled --samples
+times. The first fifth of the run, and at least two removals, is warm up.
+After that traced memory may not grow by more than --tolerance bytes over the
+run and fds and threads may not grow at all. On failure the allocation sites
+that grew are printed, and the exit code is 1.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import ExitStack
+from unittest.mock import patch
+
+from sciber_yklocker.actuator import Actuator
+from sciber_yklocker.executor import ACTIONS
+from sciber_yklocker.metrics import MetricsExporter
+from sciber_yklocker.models.removaloption import RemovalOption
+from sciber_yklocker.models.yklock import YkLock
+from sciber_yklocker.probehelper import current_rss
+from sciber_yklocker.runtime import run_runtime
+from sciber_yklocker.waker import WakeReason
+
+YUBIKEY = "1-2"
+YUBIKEY_SERIAL = 12345678
+# Iterations the YubiKey stays removed, long enough to lock
+REMOVED_FOR = 20
+# Probe intervals between writes of the metrics file, on the virtual clock
+# every 15 s would be every other iteration
+METRICS_EVERY = 50
+# Bytes traced memory may grow after warm up, caches fill up slowly
+TOLERANCE = 256 * 1024
+WARM_UP = 0.2
+TOP = 15
+
+
+class VirtualClock:
+    # Replaces monotonic() in the runtime, only moves when told to
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+class FakeDevice:
+    pid = 0x0407
+    fingerprint = "/dev/hidraw0"
+
+
+class SoakActuator(Actuator):
+    # Runs a harmless command the way the lock commands are run
+    def __init__(self, removal_option: RemovalOption) -> None:
+        super().__init__(removal_option)
+        true = shutil.which("true")
+        self.argv = [true] if true else [sys.executable, "-c", ""]
+        self.actions = 0
+
+    def act(self) -> None:
+        self.actions += 1
+        result = ACTIONS.run(self.argv)
+        if not result.ok:
+            raise RuntimeError(f"The soak action failed: {result}")
+
+
+def add_yubikey(root: str) -> None:
+    device = os.path.join(root, YUBIKEY)
+    os.makedirs(device)
+    for attribute, value in (("idVendor", "1050"), ("idProduct", "0407")):
+        with open(os.path.join(device, attribute), "w") as f:
+            f.write(value + "\n")
+    with open(os.path.join(device, "devnum"), "w") as f:
+        f.write("7\n")
+
+
+def remove_yubikey(root: str) -> None:
+    shutil.rmtree(os.path.join(root, YUBIKEY))
+
+
+def open_fds() -> int:
+    for directory in ("/proc/self/fd", "/dev/fd"):
+        if os.path.isdir(directory):
+            return len(os.listdir(directory))
+    return -1
+
+
+def slope(xs: list[float], ys: list[float]) -> float:
+    # Least squares, units of y per unit of x
+    mean_x, mean_y = statistics.fmean(xs), statistics.fmean(ys)
+    spread = sum((x - mean_x) ** 2 for x in xs)
+    if spread == 0:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / spread
+
+
+class Soak:
+    def __init__(self, args, root: str) -> None:
+        self.args = args
+        self.root = root
+        self.clock = VirtualClock()
+        self.count = 0
+        self.present = True
+        self.samples: list[dict] = []
+        self.sample_every = max(1, args.iterations // args.samples)
+        # Workers start with the first action, let a couple of removals pass
+        self.warm_up = max(int(args.iterations * WARM_UP), 2 * args.removal_every)
+        self.baseline: tracemalloc.Snapshot | None = None
+        self.last: tracemalloc.Snapshot | None = None
+
+        self.yklocker = YkLock()
+        self.yklocker.set_removal_option(RemovalOption.LOCK)
+        self.actuator = SoakActuator(RemovalOption.LOCK)
+        self.yklocker.actuator = self.actuator
+        self.yklocker.set_metrics_exporter(
+            MetricsExporter(
+                self.yklocker.metrics,
+                os.path.join(root, "yklocker.prom"),
+                interval=self.yklocker.get_probe_interval() * METRICS_EVERY,
+            )
+        )
+        self.usb = os.path.join(root, "usb")
+        os.makedirs(self.usb)
+        add_yubikey(self.usb)
+        if args.backend == "ykman":
+            self.yklocker.set_sysfs_root(None)
+        else:
+            self.yklocker.set_sysfs_root(self.usb)
+        if args.backend == "allowlist":
+            self.yklocker.set_serial_allowlist({YUBIKEY_SERIAL})
+            self.yklocker.read_serials = self.read_serials
+
+    def read_serials(self) -> dict[str, int | None]:
+        fingerprints = self.yklocker.list_device_fingerprints()
+        return {fingerprint: YUBIKEY_SERIAL for fingerprint in fingerprints}
+
+    def list_all_devices(self) -> list:
+        return [FakeDevice()] if self.present else []
+
+    def set_present(self, present: bool) -> None:
+        if present == self.present:
+            return
+        self.present = present
+        if present:
+            add_yubikey(self.usb)
+        else:
+            remove_yubikey(self.usb)
+
+    def keep_running(self, yklocker: YkLock) -> bool:
+        waker = yklocker.get_waker()
+        if self.count >= self.args.iterations:
+            return False
+        self.count += 1
+        phase = self.count % self.args.removal_every
+        self.set_present(phase < self.args.removal_every - REMOVED_FOR)
+        if self.count % self.sample_every == 0:
+            self.sample()
+        # As if the probe delay had passed
+        self.clock.advance(yklocker.get_probe_interval())
+        waker.wake(WakeReason.PROBE)
+        return not waker.stopped
+
+    def sample(self) -> None:
+        traced, _ = tracemalloc.get_traced_memory()
+        self.samples.append(
+            {
+                "iteration": self.count,
+                "traced_bytes": traced,
+                "rss_bytes": current_rss(),
+                "fds": open_fds(),
+                "threads": threading.active_count(),
+            }
+        )
+        if self.count >= self.warm_up:
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                (tracemalloc.Filter(False, tracemalloc.__file__),)
+            )
+            if self.baseline is None:
+                self.baseline = snapshot
+            self.last = snapshot
+
+    def run(self) -> None:
+        # Keep the system log out of it, the logger itself still runs
+        with ExitStack() as patches:
+            patches.enter_context(
+                patch("sciber_yklocker.runtime.monotonic", self.clock)
+            )
+            patches.enter_context(
+                patch(
+                    "sciber_yklocker.models.yklock.list_all_devices",
+                    self.list_all_devices,
+                )
+            )
+            if sys.platform.startswith("linux"):
+                patches.enter_context(patch("syslog.syslog", lambda *args: None))
+            tracemalloc.start()
+            try:
+                thread = threading.Thread(
+                    target=run_runtime, args=(self.yklocker, self.keep_running)
+                )
+                thread.start()
+                thread.join()
+            finally:
+                tracemalloc.stop()
+
+    def verdict(self) -> dict:
+        after = [s for s in self.samples if s["iteration"] >= self.warm_up]
+        xs = [s["iteration"] for s in after]
+        span = self.args.iterations - self.warm_up
+        trends = {
+            name: slope(xs, [s[name] for s in after]) * span
+            for name in ("traced_bytes", "rss_bytes", "fds", "threads")
+        }
+        failures = []
+        if trends["traced_bytes"] > self.args.tolerance:
+            failures.append(f"traced memory grew {trends['traced_bytes']:.0f} bytes")
+        for name in ("fds", "threads"):
+            first, last = after[0][name], max(s[name] for s in after)
+            if last > first:
+                failures.append(f"{name} grew from {first} to {last}")
+        return {"trends": trends, "failures": failures}
+
+    def growth(self) -> list[str]:
+        if self.baseline is None or self.last is None:
+            return []
+        stats = self.last.compare_to(self.baseline, "lineno")
+        return [str(stat) for stat in stats[:TOP] if stat.size_diff > 0]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Soak test the probe loop")
+    parser.add_argument("--iterations", type=int, default=1_000_000)
+    parser.add_argument("--samples", type=int, default=50)
+    parser.add_argument(
+        "--backend", choices=("sysfs", "ykman", "allowlist"), default="sysfs"
+    )
+    parser.add_argument("--removal-every", type=int, default=500)
+    parser.add_argument("--tolerance", type=int, default=TOLERANCE)
+    parser.add_argument("--output", help="write the JSON here instead of stdout")
+    args = parser.parse_args()
+    if args.removal_every <= REMOVED_FOR:
+        parser.error(f"--removal-every must be more than {REMOVED_FOR}")
+    if args.iterations < args.samples * 5:
+        parser.error("--iterations must be at least 5 times --samples")
+    if args.iterations < args.removal_every * 4:
+        parser.error("--iterations must be at least 4 times --removal-every")
+
+    with tempfile.TemporaryDirectory() as root:
+        soak = Soak(args, root)
+        start = time.perf_counter()
+        soak.run()
+        elapsed = time.perf_counter() - start
+
+    verdict = soak.verdict()
+    result = {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "backend": args.backend,
+        "iterations": soak.count,
+        "seconds": elapsed,
+        "virtual_hours": (soak.clock.now - 1000) / 3600,
+        "actions": soak.actuator.actions,
+        "growth_over_run": verdict["trends"],
+        "failures": verdict["failures"],
+        "samples": soak.samples,
+    }
+    if verdict["failures"]:
+        result["growing_allocation_sites"] = soak.growth()
+    report = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+    for failure in verdict["failures"]:
+        print("FAIL: " + failure, file=sys.stderr)
+    return 1 if verdict["failures"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
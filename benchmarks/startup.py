@@ -0,0 +1,126 @@
+"""Startup time of the locker, printed as JSON.
+
+Usage: python benchmarks/startup.py [--runs N] [--budget SECONDS] [--top N]
+
+Measures, each in a new interpreter:
+- import_seconds: importing sciber_yklocker.main, from python -X importtime
+- first_probe_seconds: from interpreter start until the first probe returned,
+  importing main, creating a YkLock and calling is_yubikey_connected once
+The slowest imports are listed to see what to make lazy next. Exits with 1
+if the median time to the first probe is over the budget.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Seconds from starting python until the first probe returned
+FIRST_PROBE_BUDGET = 2.0
+
+FIRST_PROBE_CODE = """
+import time
+start = time.perf_counter()
+from sciber_yklocker.main import YkLock
+imported = time.perf_counter()
+YkLock().is_yubikey_connected()
+print(imported - start, time.perf_counter() - imported)
+"""
+
+
+def child_env() -> dict[str, str]:
+    # Run from a checkout without installing
+    env = dict(os.environ)
+    src = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [src, env.get("PYTHONPATH")]))
+    return env
+
+
+def parse_importtime(stderr: str) -> dict[str, tuple[int, int]]:
+    # Module -> (self, cumulative) microseconds, from lines like
+    # "import time:       331 |       7710 |     tomllib"
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:") :].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdecimal():
+            # The header line
+            continue
+        times[fields[2].strip()] = (int(fields[0]), int(fields[1]))
+    return times
+
+
+def measure_imports() -> dict[str, tuple[int, int]]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import sciber_yklocker.main"],
+        capture_output=True,
+        text=True,
+        check=True,
+        env=child_env(),
+    )
+    return parse_importtime(result.stderr)
+
+
+def measure_first_probe() -> tuple[float, float, float]:
+    # (interpreter + everything, imports, YkLock + probe) in seconds
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", FIRST_PROBE_CODE],
+        capture_output=True,
+        text=True,
+        check=True,
+        env=child_env(),
+    )
+    total = time.perf_counter() - start
+    imports, probe = (float(value) for value in result.stdout.split()[-2:])
+    return total, imports, probe
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Measure the startup time")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=FIRST_PROBE_BUDGET)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    imports = measure_imports()
+    slowest = sorted(imports.items(), key=lambda item: item[1][0], reverse=True)
+    runs = [measure_first_probe() for _ in range(args.runs)]
+    first_probe = statistics.median(run[0] for run in runs)
+
+    print(
+        json.dumps(
+            {
+                "python": sys.version.split()[0],
+                "platform": sys.platform,
+                "runs": args.runs,
+                "import_seconds": imports["sciber_yklocker.main"][1] / 1e6,
+                "ykman_loaded_at_import": "ykman" in imports,
+                "slowest_imports": [
+                    {"module": name, "self_seconds": own / 1e6}
+                    for name, (own, cumulative) in slowest[: args.top]
+                ],
+                "first_probe_seconds": first_probe,
+                "first_probe_import_seconds": statistics.median(r[1] for r in runs),
+                "first_probe_probe_seconds": statistics.median(r[2] for r in runs),
+                "budget_seconds": args.budget,
+            },
+            indent=2,
+        )
+    )
+    if first_probe > args.budget:
+        print(
+            f"Time to first probe {first_probe:.3f} s is over the budget "
+            f"of {args.budget} s",
+            file=sys.stderr,
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,314 @@
+"""Benchmarks of the locker's hot paths, printed as JSON to compare releases.
+
+Usage, with sciber_yklocker installed (pip install -e .):
+    python benchmarks/suite.py [--iterations N] [--devices N] [--output FILE]
+        [--removals N] [--only NAME ...]
+
+Probes run against a fake sysfs tree with --devices other USB devices next to
+one YubiKey, hotplug events are sent through a socketpair instead of netlink.
+The ykman probe uses whatever ykman finds on this machine and is skipped if
+ykman can not be imported. Nothing is locked, the lock action only records
+when it was called.
+
+Benchmarks:
+- probe_sysfs, probe_sysfs_allowlist, probe_ykman: seconds and CPU seconds
+  per probe
+- uevent_drain: seconds to read and filter one burst of hotplug events
+- loop_iteration: seconds and CPU seconds per probe loop iteration, waking,
+  probing, updating the presence state and dispatching
+- removal_to_lock: seconds from removing the YubiKey (and its hotplug event)
+  until the lock action was called
+- memory_per_iteration: bytes allocated and kept per loop iteration
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from sciber_yklocker.actuator import Actuator
+from sciber_yklocker.lib.uevent import UeventWatcher
+from sciber_yklocker.main import watch_hotplug
+from sciber_yklocker.models.presence import PresenceState
+from sciber_yklocker.models.removaloption import RemovalOption
+from sciber_yklocker.models.yklock import YkLock
+from sciber_yklocker.probehelper import current_rss
+from sciber_yklocker.runtime import run_runtime
+from sciber_yklocker.waker import WakeReason
+
+YUBIKEY = "1-2"
+YUBIKEY_SERIAL = 12345678
+YUBIKEY_ADD = (
+    b"add@/devices/usb1/1-2\0ACTION=add\0SUBSYSTEM=usb\0DEVTYPE=usb_device\0"
+    b"PRODUCT=1050/407/543\0"
+)
+YUBIKEY_REMOVE = YUBIKEY_ADD.replace(b"add", b"remove")
+OTHER_EVENT = b"change@/devices/platform/bat\0ACTION=change\0SUBSYSTEM=power_supply\0"
+# Seconds to wait for the loop to notice something before giving up
+SETTLE_TIMEOUT = 5
+
+
+def summarize(samples: list[float]) -> dict[str, float]:
+    samples = sorted(samples)
+    return {
+        "median": statistics.median(samples),
+        "p95": samples[min(len(samples) - 1, int(0.95 * len(samples)))],
+        "max": samples[-1],
+        "mean": statistics.fmean(samples),
+    }
+
+
+def add_usb_device(root: str, name: str, vendor_id: str, product_id: str) -> None:
+    device = os.path.join(root, name)
+    os.makedirs(device)
+    for attribute, value in (
+        ("idVendor", vendor_id),
+        ("idProduct", product_id),
+        ("devnum", "7"),
+    ):
+        with open(os.path.join(device, attribute), "w") as f:
+            f.write(value + "\n")
+    # Interfaces are listed next to the device and skipped by the probe
+    os.makedirs(os.path.join(root, f"{name}:1.0"))
+
+
+def make_usb_tree(root: str, devices: int) -> None:
+    for number in range(devices):
+        add_usb_device(root, f"3-{number + 1}", "046d", "c52b")
+    add_usb_device(root, YUBIKEY, "1050", "0407")
+
+
+def remove_yubikey(root: str) -> None:
+    shutil.rmtree(os.path.join(root, YUBIKEY))
+    shutil.rmtree(os.path.join(root, f"{YUBIKEY}:1.0"))
+
+
+def make_yklocker(root: str) -> YkLock:
+    yklocker = YkLock()
+    yklocker.set_sysfs_root(root)
+    # Keep the system log out of the numbers
+    yklocker.logger = lambda msg: None
+    return yklocker
+
+
+def time_calls(function, iterations: int) -> dict:
+    wall, cpu = [], []
+    for _ in range(iterations):
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        function()
+        cpu.append(time.process_time() - cpu_start)
+        wall.append(time.perf_counter() - wall_start)
+    return {"seconds": summarize(wall), "cpu_seconds": summarize(cpu)}
+
+
+def bench_probe_sysfs(root: str, args) -> dict:
+    return time_calls(make_yklocker(root).probe_devices, args.iterations)
+
+
+def bench_probe_sysfs_allowlist(root: str, args) -> dict:
+    # The serial is read once per insertion, later probes hit the cache
+    yklocker = make_yklocker(root)
+    yklocker.set_serial_allowlist({YUBIKEY_SERIAL})
+    fingerprint = yklocker.list_device_fingerprints()[-1]
+    yklocker.read_serials = lambda: {fingerprint: YUBIKEY_SERIAL}
+    return time_calls(yklocker.probe_devices, args.iterations)
+
+
+def bench_probe_ykman(root: str, args) -> dict:
+    try:
+        import ykman.device  # noqa: F401
+    except ImportError as e:
+        return {"skipped": f"ykman not available: {e}"}
+    yklocker = make_yklocker(root)
+    yklocker.set_sysfs_root(None)
+    # The first probe also imports ykman, see benchmarks/startup.py
+    yklocker.probe_devices()
+    return time_calls(yklocker.probe_devices, args.iterations)
+
+
+def bench_uevent_drain(root: str, args) -> dict:
+    # One YubiKey event among the noise of other devices
+    if not hasattr(socket, "AF_UNIX"):
+        return {"skipped": "no AF_UNIX socketpair"}
+    reader, writer = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    watcher = UeventWatcher(reader)
+
+    def burst() -> None:
+        for _ in range(args.devices):
+            writer.send(OTHER_EVENT)
+        writer.send(YUBIKEY_REMOVE)
+
+    wall = []
+    for _ in range(args.iterations):
+        burst()
+        start = time.perf_counter()
+        watcher.drain()
+        wall.append(time.perf_counter() - start)
+    watcher.close()
+    writer.close()
+    return {"events_per_burst": args.devices + 1, "seconds": summarize(wall)}
+
+
+class LoopRunner:
+    # Runs the probe loop on a thread, keep_running wakes it again right away
+    def __init__(self, yklocker: YkLock, iterations: int | None = None) -> None:
+        self.yklocker = yklocker
+        self.iterations = iterations
+        self.count = 0
+        self.thread = threading.Thread(
+            target=run_runtime, args=(yklocker, self.keep_running)
+        )
+
+    def keep_running(self, yklocker: YkLock) -> bool:
+        waker = yklocker.get_waker()
+        if self.iterations is not None:
+            if self.count >= self.iterations:
+                return False
+            self.count += 1
+            waker.wake(WakeReason.PROBE)
+        return not waker.stopped
+
+    def run(self) -> None:
+        self.thread.start()
+        self.thread.join()
+
+
+def bench_loop_iteration(root: str, args) -> dict:
+    yklocker = make_yklocker(root)
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    LoopRunner(yklocker, args.iterations).run()
+    return {
+        "seconds": (time.perf_counter() - wall_start) / args.iterations,
+        # Of the whole process, the loop's own threads included
+        "cpu_seconds": (time.process_time() - cpu_start) / args.iterations,
+    }
+
+
+class RecordingActuator(Actuator):
+    def __init__(self, removal_option: RemovalOption) -> None:
+        super().__init__(removal_option)
+        self.acted = threading.Event()
+        self.acted_at = 0.0
+
+    def act(self) -> None:
+        self.acted_at = time.perf_counter()
+        self.acted.set()
+
+
+def wait_for_state(yklocker: YkLock, state: PresenceState) -> None:
+    deadline = time.monotonic() + SETTLE_TIMEOUT
+    while yklocker.get_presence_state() != state:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"The loop did not reach {state}")
+        time.sleep(0.001)
+
+
+def bench_removal_to_lock(root: str, args) -> dict:
+    if not hasattr(socket, "AF_UNIX"):
+        return {"skipped": "no AF_UNIX socketpair"}
+    yklocker = make_yklocker(root)
+    yklocker.set_removal_option(RemovalOption.LOCK)
+    actuator = RecordingActuator(RemovalOption.LOCK)
+    yklocker.actuator = actuator
+    reader, writer = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    watch_hotplug(yklocker, UeventWatcher(reader))
+    # Only hotplug events wake the loop, never the poll interval
+    yklocker.set_probe_interval(3600)
+
+    runner = LoopRunner(yklocker)
+    runner.thread.start()
+    samples = []
+    try:
+        for _ in range(args.removals):
+            yklocker.get_waker().wake(WakeReason.PROBE)
+            wait_for_state(yklocker, PresenceState.PRESENT)
+            actuator.acted.clear()
+
+            removed_at = time.perf_counter()
+            remove_yubikey(root)
+            writer.send(YUBIKEY_REMOVE)
+            if not actuator.acted.wait(SETTLE_TIMEOUT):
+                raise TimeoutError("The lock action was not called")
+            samples.append(actuator.acted_at - removed_at)
+
+            add_usb_device(root, YUBIKEY, "1050", "0407")
+            writer.send(YUBIKEY_ADD)
+    finally:
+        yklocker.get_waker().stop()
+        runner.thread.join()
+        writer.close()
+    return {"seconds": summarize(samples)}
+
+
+def bench_memory_per_iteration(root: str, args) -> dict:
+    # Warm up first, caches and lazy imports are no leak
+    LoopRunner(make_yklocker(root), 10).run()
+    yklocker = make_yklocker(root)
+    rss_before = current_rss()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    LoopRunner(yklocker, args.iterations).run()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    growth = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return {
+        "traced_bytes": growth / args.iterations,
+        "rss_bytes": (current_rss() - rss_before) / args.iterations,
+    }
+
+
+BENCHMARKS = {
+    "probe_sysfs": bench_probe_sysfs,
+    "probe_sysfs_allowlist": bench_probe_sysfs_allowlist,
+    "probe_ykman": bench_probe_ykman,
+    "uevent_drain": bench_uevent_drain,
+    "loop_iteration": bench_loop_iteration,
+    "removal_to_lock": bench_removal_to_lock,
+    "memory_per_iteration": bench_memory_per_iteration,
+}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the hot paths")
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--removals", type=int, default=50)
+    parser.add_argument("--devices", type=int, default=20)
+    parser.add_argument("--output", help="write the JSON here instead of stdout")
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, default=BENCHMARKS)
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.only:
+        # A new fake tree each, removal_to_lock changes it
+        with tempfile.TemporaryDirectory() as root:
+            make_usb_tree(root, args.devices)
+            results[name] = BENCHMARKS[name](root, args)
+
+    report = json.dumps(
+        {
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "iterations": args.iterations,
+            "devices": args.devices,
+            "results": results,
+        },
+        indent=2,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,19 @@
+from sciber_yklocker.models.removaloption import RemovalOption
+
+
+class ActuatorError(Exception):
+    pass
+
+
+class Actuator:
+    # Performs one removal option. Everything it needs is looked up once by
+    # validate() at startup so act() only has to make the final call.
+    def __init__(self, removal_option: RemovalOption) -> None:
+        self.removal_option = removal_option
+
+    def validate(self) -> None:
+        # Raise ActuatorError if the action can not work on this system
+        pass
+
+    def act(self) -> None:
+        pass
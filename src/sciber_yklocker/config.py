@@ -0,0 +1,144 @@
+import os
+import tomllib
+from collections.abc import Callable
+
+from sciber_yklocker.models.escalation import is_escalation_step, parse_escalation
+from sciber_yklocker.models.removaloption import RemovalOption
+from sciber_yklocker.models.settings import Settings, merge_settings
+from sciber_yklocker.models.watchdog import StallPolicy
+
+# Config files for Linux and MacOS, Windows uses the registry
+SYSTEM_CONFIG = "/etc/sciber/yklocker.toml"
+USER_CONFIG = os.path.join("sciber", "yklocker.toml")
+
+
+class ConfigError(Exception):
+    pass
+
+
+def user_config_path() -> str:
+    config_home = os.environ.get("XDG_CONFIG_HOME") or os.path.join(
+        os.path.expanduser("~"), ".config"
+    )
+    return os.path.join(config_home, USER_CONFIG)
+
+
+def config_paths() -> list[str]:
+    # Highest precedence first, the user may override the system settings
+    return [user_config_path(), SYSTEM_CONFIG]
+
+
+def is_number(value) -> bool:
+    # bool is an int in python, but not a number of seconds
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def is_count(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool) and value > 0
+
+
+# Setting -> (check, description used in the error)
+CHECKS: dict[str, tuple[Callable, str]] = {
+    "removal_option": (
+        lambda value: value in RemovalOption.__members__.values(),
+        "one of " + ", ".join(RemovalOption),
+    ),
+    "timeout": (
+        lambda value: isinstance(value, int) and is_number(value) and value > 0,
+        "a whole number of seconds",
+    ),
+    "serials": (
+        lambda value: isinstance(value, list) and all(is_count(v) for v in value),
+        "a list of serial numbers",
+    ),
+    "probe_interval": (lambda value: is_number(value) and value > 0, "seconds > 0"),
+    "grace_period": (lambda value: is_number(value) and value >= 0, "seconds"),
+    "required_misses": (is_count, "a number > 0"),
+    "rearm_interval": (lambda value: is_number(value) and value >= 0, "seconds"),
+    "max_interval": (lambda value: is_number(value) and value > 0, "seconds > 0"),
+    "max_wakeups_per_hour": (is_count, "a number > 0"),
+    "probe_deadline": (lambda value: is_number(value) and value > 0, "seconds > 0"),
+    "stall_policy": (
+        lambda value: value in StallPolicy.__members__.values(),
+        "one of " + ", ".join(StallPolicy),
+    ),
+    "stalls_to_lock": (is_count, "a number > 0"),
+    "probe_helper": (lambda value: isinstance(value, bool), "true or false"),
+    "metrics_file": (lambda value: isinstance(value, str) and value != "", "a path"),
+    "metrics_port": (
+        lambda value: is_count(value) and value <= 65535,
+        "a port number",
+    ),
+    "journal": (lambda value: isinstance(value, bool), "true or false"),
+    "escalation": (
+        lambda value: isinstance(value, list) and all(map(is_escalation_step, value)),
+        "a list of {after = seconds, action = RemovalOption}"
+        " or {after = seconds, command = [...]}",
+    ),
+}
+
+
+def parse_config(text: str) -> Settings:
+    # Keys are the Settings names, anything unknown or invalid is an error
+    try:
+        values = tomllib.loads(text)
+    except tomllib.TOMLDecodeError as e:
+        raise ConfigError(str(e))
+
+    for key, value in values.items():
+        if key not in CHECKS:
+            raise ConfigError(f"Unknown setting {key}")
+        check, description = CHECKS[key]
+        if not check(value):
+            raise ConfigError(f"{key} must be {description}, not {value!r}")
+
+    if "removal_option" in values:
+        values["removal_option"] = RemovalOption(values["removal_option"])
+    if "stall_policy" in values:
+        values["stall_policy"] = StallPolicy(values["stall_policy"])
+    if "serials" in values:
+        values["serials"] = frozenset(values["serials"])
+    if "escalation" in values:
+        values["escalation"] = parse_escalation(values["escalation"])
+    return Settings(**values)
+
+
+def read_config(path: str) -> Settings:
+    # A missing file sets nothing
+    try:
+        with open(path, encoding="utf-8") as file:
+            text = file.read()
+    except FileNotFoundError:
+        return Settings()
+    except (OSError, UnicodeDecodeError) as e:
+        raise ConfigError(str(e))
+    return parse_config(text)
+
+
+class ConfigStore:
+    # The command line overrides the config files, in the order of paths
+    def __init__(
+        self,
+        paths: list[str],
+        logger: Callable[[str], None],
+        overrides: Settings = Settings(),
+    ) -> None:
+        self.paths = paths
+        self.logger = logger
+        self.overrides = overrides
+        self.snapshots = {path: Settings() for path in paths}
+        self.settings = overrides
+
+    def load(self) -> Settings:
+        # Read every file again, an invalid one keeps its previous snapshot
+        for path in self.paths:
+            try:
+                self.snapshots[path] = read_config(path)
+            except ConfigError as e:
+                self.logger(
+                    f"Invalid config file {path}, keeping the previous settings: {e}"
+                )
+
+        snapshots = [self.snapshots[path] for path in self.paths]
+        self.settings = merge_settings(self.overrides, *snapshots)
+        return self.settings
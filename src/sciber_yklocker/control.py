@@ -0,0 +1,210 @@
+import json
+import os
+import platform
+import socket
+import struct
+import sys
+import threading
+from datetime import datetime
+from time import monotonic
+
+from sciber_yklocker.models.myos import MyOS
+from sciber_yklocker.models.yklock import YkLock
+from sciber_yklocker.waker import WakeReason
+
+# A local control socket on Linux and MacOS. Queries are answered on the
+# server's own threads from what the locker already keeps in memory, commands
+# only set a value or wake the loop, so a client never holds up a probe.
+
+SOCKET_NAME = "yklocker.sock"
+COMMANDS = ("status", "probe", "reload", "pause", "resume")
+# Longest pause that can be asked for, in minutes
+MAX_PAUSE = 24 * 60
+# Seconds a client may take to send its command
+CLIENT_TIMEOUT = 5
+MAX_REQUEST = 1024
+
+
+class ControlError(Exception):
+    pass
+
+
+def control_socket_path() -> str | None:
+    # Per user, in a directory only the user can read
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if not runtime_dir and platform.system() == MyOS.MAC:
+        runtime_dir = os.environ.get("TMPDIR")
+    if not runtime_dir:
+        return None
+    return os.path.join(runtime_dir, SOCKET_NAME)
+
+
+def format_time(timestamp: float | None) -> str | None:
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp).astimezone().isoformat("T", "seconds")
+
+
+def status(yklocker: YkLock, now: float) -> dict:
+    metrics = yklocker.metrics
+    watchdog = yklocker.watchdog
+    last_action = None
+    if metrics.last_action is not None:
+        removal_option, acted_at = metrics.last_action
+        last_action = {"removal_option": removal_option, "at": format_time(acted_at)}
+    return {
+        "removal_option": yklocker.get_removal_option(),
+        "timeout": yklocker.get_timeout(),
+        "presence": yklocker.get_presence_state(),
+        "absent_for": round(yklocker.dispatcher.absent_for(now)),
+        "paused_for": round(yklocker.paused_for(now)),
+        "last_probe": format_time(metrics.last_probe),
+        "last_probe_duration": metrics.last_probe_duration,
+        "last_probe_error": metrics.last_probe_error,
+        "last_action": last_action,
+        "probes": metrics.probes,
+        "wakeups_last_hour": yklocker.schedule.wakeups_last_hour(),
+        # Over the last DURATION_HISTORY probes, and since the start
+        "probe_duration_median": watchdog.percentile(0.5),
+        "probe_duration_p95": watchdog.percentile(0.95),
+        "probe_duration_max": watchdog.max_duration,
+        "probe_stalls": watchdog.total_stalls,
+    }
+
+
+def handle_command(yklocker: YkLock, line: str) -> dict:
+    # One command per connection, answered with one JSON object
+    command, *args = line.split() or [""]
+    now = monotonic()
+    if command == "status" and not args:
+        return {"ok": True, **status(yklocker, now)}
+    if command == "probe" and not args:
+        yklocker.get_waker().wake(WakeReason.PROBE)
+        return {"ok": True}
+    if command == "reload" and not args:
+        yklocker.get_waker().wake(WakeReason.RELOAD)
+        return {"ok": True}
+    if command == "pause" and len(args) == 1:
+        try:
+            minutes = float(args[0])
+        except ValueError:
+            minutes = 0
+        if not 0 < minutes <= MAX_PAUSE:
+            return {"ok": False, "error": f"Pause for up to {MAX_PAUSE} minutes"}
+        yklocker.pause(minutes * 60, now)
+        yklocker.logger(f"Removal action paused for {minutes:g} minutes")
+        yklocker.record("paused", minutes=minutes)
+        return {"ok": True, "paused_for": round(yklocker.paused_for(now))}
+    if command == "resume" and not args:
+        yklocker.resume()
+        yklocker.logger("Removal action resumed")
+        yklocker.record("resumed")
+        # Act right away if the YubiKey is gone
+        yklocker.get_waker().wake(WakeReason.PROBE)
+        return {"ok": True}
+    return {"ok": False, "error": f"Unknown command {line.strip()!r}"}
+
+
+def peer_allowed(connection: socket.socket) -> bool:
+    # Only the same user, or root, may control the locker. Elsewhere the
+    # socket's directory and mode keep other users out.
+    if not hasattr(socket, "SO_PEERCRED"):
+        return True
+    credentials = connection.getsockopt(
+        socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")
+    )
+    _, uid, _ = struct.unpack("3i", credentials)
+    return uid in (0, os.getuid())
+
+
+def remove_stale_socket(path: str) -> None:
+    # A socket left behind by a locker that was killed can be replaced, one
+    # that still answers belongs to a running locker
+    if not os.path.exists(path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise ControlError(f"{path} is in use by another YubiKeyLocker")
+
+
+def serve_control(yklocker: YkLock, path: str):
+    # Only imported when the control socket is used
+    import socketserver
+
+    class ControlHandler(socketserver.StreamRequestHandler):
+        timeout = CLIENT_TIMEOUT
+
+        def handle(self) -> None:
+            if not peer_allowed(self.connection):
+                return
+            try:
+                line = self.rfile.readline(MAX_REQUEST).decode(errors="replace")
+            except OSError:
+                return
+            reply = handle_command(yklocker, line)
+            self.wfile.write(json.dumps(reply).encode() + b"\n")
+
+    remove_stale_socket(path)
+    server = socketserver.ThreadingUnixStreamServer(path, ControlHandler)
+    server.daemon_threads = True
+    os.chmod(path, 0o600)
+    threading.Thread(
+        target=server.serve_forever, name="yklocker-control", daemon=True
+    ).start()
+    return server
+
+
+def close_control(server, path: str) -> None:
+    server.shutdown()
+    server.server_close()
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def send_command(path: str, line: str) -> dict:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(CLIENT_TIMEOUT)
+        client.connect(path)
+        client.sendall(line.encode() + b"\n")
+        reply = b""
+        while not reply.endswith(b"\n"):
+            data = client.recv(4096)
+            if not data:
+                break
+            reply += data
+    return json.loads(reply)
+
+
+def run_client(argv: list[str], path: str | None = None) -> int:
+    # yubikey-locker status|probe|reload|pause MINUTES|resume [-c SOCKET]
+    if "-c" in argv[:-1]:
+        index = argv.index("-c")
+        path = argv[index + 1]
+        argv = argv[:index] + argv[index + 2 :]
+    if path is None:
+        path = control_socket_path()
+    if path is None:
+        print("No control socket, XDG_RUNTIME_DIR is not set")
+        return 1
+
+    try:
+        reply = send_command(path, " ".join(argv))
+    except (OSError, ValueError) as e:
+        print(f"YubiKeyLocker is not answering on {path}: {e}")
+        return 1
+    if not reply.pop("ok", False):
+        print(reply.get("error", "Failed"), file=sys.stderr)
+        return 1
+    for key, value in reply.items():
+        if isinstance(value, dict):
+            value = ", ".join(f"{k} {v}" for k, v in value.items())
+        print(f"{key}: {'-' if value is None else value}")
+    return 0
@@ -0,0 +1,131 @@
+import subprocess
+import threading
+from collections.abc import Callable, Sequence
+from typing import NamedTuple
+
+# Seconds a lock action may run before it is killed
+ACTION_TIMEOUT = 10
+# Seconds to wait for a killed process to exit before reaping it later
+KILL_TIMEOUT = 1
+# Lock actions running at the same time, any more wait for a free slot
+MAX_RUNNING = 2
+
+
+class ActionResult(NamedTuple):
+    argv: tuple[str, ...]
+    # None if the process was not started or did not exit in time
+    returncode: int | None = None
+    timed_out: bool = False
+    error: str = ""
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0
+
+    def __str__(self) -> str:
+        if self.error:
+            return f"{self.argv[0]}: {self.error}"
+        if self.timed_out:
+            return f"{self.argv[0]}: timed out"
+        return f"{self.argv[0]}: exit status {self.returncode}"
+
+
+class ChildProcess:
+    # A started command, wait() raises subprocess.TimeoutExpired like Popen.
+    # Windows wraps its process handles in the same interface.
+    def __init__(self, argv: Sequence[str]) -> None:
+        # No shell and no pipes, nothing is left open once it is reaped
+        self.popen = subprocess.Popen(
+            argv,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            close_fds=True,
+        )
+
+    def wait(self, timeout: float) -> int:
+        return self.popen.wait(timeout)
+
+    def poll(self) -> int | None:
+        return self.popen.poll()
+
+    def kill(self) -> None:
+        self.popen.kill()
+
+    def close(self) -> None:
+        # Popen keeps nothing open without pipes, it only has to be reaped
+        pass
+
+
+class ActionExecutor:
+    # Runs the external commands of the lock actions and always reaps them
+    def __init__(
+        self,
+        max_running: int = MAX_RUNNING,
+        timeout: float = ACTION_TIMEOUT,
+        spawn: Callable[[Sequence[str]], ChildProcess] = ChildProcess,
+    ) -> None:
+        self.timeout = timeout
+        self.spawn = spawn
+        self.slots = threading.BoundedSemaphore(max_running)
+        self.lock = threading.Lock()
+        # Killed processes that did not exit in time, reaped on the next run
+        self.orphans: list[ChildProcess] = []
+
+    def run(
+        self,
+        argv: Sequence[str],
+        timeout: float | None = None,
+        spawn: Callable[[Sequence[str]], ChildProcess] | None = None,
+    ) -> ActionResult:
+        argv = tuple(argv)
+        if timeout is None:
+            timeout = self.timeout
+        if spawn is None:
+            spawn = self.spawn
+        self.reap()
+
+        if not self.slots.acquire(timeout=timeout):
+            return ActionResult(argv, error="too many actions running")
+        try:
+            try:
+                process = spawn(argv)
+            except OSError as e:
+                return ActionResult(argv, error=str(e))
+            return self.wait(argv, process, timeout)
+        finally:
+            self.slots.release()
+
+    def wait(
+        self, argv: tuple[str, ...], process: ChildProcess, timeout: float
+    ) -> ActionResult:
+        try:
+            returncode = process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            try:
+                process.wait(KILL_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                # Keep it until it has exited, then reap it
+                with self.lock:
+                    self.orphans.append(process)
+                return ActionResult(argv, timed_out=True)
+            process.close()
+            return ActionResult(argv, timed_out=True)
+
+        process.close()
+        return ActionResult(argv, returncode)
+
+    def reap(self) -> None:
+        with self.lock:
+            orphans, self.orphans = self.orphans, []
+        for process in orphans:
+            if process.poll() is None:
+                with self.lock:
+                    self.orphans.append(process)
+            else:
+                process.close()
+
+
+# Shared by the platform lock_system implementations
+ACTIONS = ActionExecutor()
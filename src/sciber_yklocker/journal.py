@@ -0,0 +1,275 @@
+import bisect
+import json
+import os
+import re
+import threading
+import time
+from collections.abc import Callable, Iterator
+from datetime import datetime
+from typing import BinaryIO
+
+# A local journal of what the locker saw and did, one JSON object per line.
+# Events are kept in memory and written in batches from the probe loop,
+# fsync'd at most every SYNC_INTERVAL seconds. The journal is split into
+# segments named after their first event's time, each with an index of
+# "time offset" lines, one per batch, so a query seeks to where it starts.
+
+JOURNAL_DIR = os.path.join("sciber", "yklocker")
+SEGMENT_PREFIX = "events-"
+# Start a new segment at this size, and keep this many
+MAX_SEGMENT_SIZE = 1024 * 1024
+MAX_SEGMENTS = 8
+# Write once this many events are waiting, or when the oldest has waited
+# FLUSH_INTERVAL seconds
+BATCH_SIZE = 64
+FLUSH_INTERVAL = 5
+SYNC_INTERVAL = 60
+RELATIVE = re.compile(r"^(\d+(?:\.\d+)?)([smhdw])$")
+UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def journal_dir() -> str:
+    state_home = os.environ.get("XDG_STATE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".local", "state"
+    )
+    return os.path.join(state_home, JOURNAL_DIR)
+
+
+def segment_name(start: float) -> str:
+    return f"{SEGMENT_PREFIX}{int(start * 1000)}.jsonl"
+
+
+def list_segments(directory: str) -> list[tuple[float, str]]:
+    # (start time, path), oldest first
+    segments = []
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    for name in names:
+        if name.startswith(SEGMENT_PREFIX) and name.endswith(".jsonl"):
+            start = name[len(SEGMENT_PREFIX) : -len(".jsonl")]
+            if start.isdecimal():
+                segments.append((int(start) / 1000, os.path.join(directory, name)))
+    return sorted(segments)
+
+
+def index_path(segment: str) -> str:
+    return segment[: -len(".jsonl")] + ".idx"
+
+
+class Journal:
+    def __init__(
+        self,
+        directory: str,
+        clock: Callable[[], float] = time.time,
+        max_segment_size: int = MAX_SEGMENT_SIZE,
+        max_segments: int = MAX_SEGMENTS,
+    ) -> None:
+        self.directory = directory
+        self.clock = clock
+        self.max_segment_size = max_segment_size
+        self.max_segments = max_segments
+        # Recorded on the loop, the action worker and the control socket
+        self.lock = threading.Lock()
+        self.pending: list[str] = []
+        # Monotonic times, from update()
+        self.pending_since: float | None = None
+        self.last_sync: float | None = None
+        self.unsynced = False
+        self.file: BinaryIO | None = None
+        self.index: BinaryIO | None = None
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        # Continue the newest segment after a restart
+        segments = list_segments(directory)
+        if segments and os.path.getsize(segments[-1][1]) < max_segment_size:
+            self.open_segment(segments[-1][1])
+
+    def record(self, event: str, **fields) -> None:
+        line = json.dumps({"time": round(self.clock(), 3), "event": event, **fields})
+        with self.lock:
+            self.pending.append(line)
+
+    def open_segment(self, path: str) -> None:
+        self.file = open(path, "ab")
+        self.index = open(index_path(path), "ab")
+        # A line cut short by a crash must not swallow the next event
+        if self.file.tell() > 0:
+            with open(path, "rb") as file:
+                file.seek(-1, os.SEEK_END)
+                if file.read(1) != b"\n":
+                    self.file.write(b"\n")
+
+    def close_segment(self) -> None:
+        self.sync()
+        if self.file is not None:
+            self.file.close()
+        if self.index is not None:
+            self.index.close()
+        self.file = self.index = None
+
+    def rotate(self, start: float) -> None:
+        if self.file is not None:
+            self.close_segment()
+        self.open_segment(os.path.join(self.directory, segment_name(start)))
+        for _, path in list_segments(self.directory)[: -self.max_segments]:
+            os.unlink(path)
+            try:
+                os.unlink(index_path(path))
+            except FileNotFoundError:
+                pass
+
+    def flush(self) -> None:
+        with self.lock:
+            lines, self.pending = self.pending, []
+        if not lines:
+            return
+        first = json.loads(lines[0])["time"]
+        if self.file is None or self.file.tell() >= self.max_segment_size:
+            self.rotate(first)
+        assert self.file is not None and self.index is not None
+        offset = self.file.tell()
+        self.file.write(("\n".join(lines) + "\n").encode())
+        self.file.flush()
+        # Only point the index at data that was written
+        self.index.write(f"{first} {offset}\n".encode())
+        self.index.flush()
+        self.unsynced = True
+
+    def sync(self) -> None:
+        if self.unsynced and self.file is not None and self.index is not None:
+            os.fsync(self.file.fileno())
+            os.fsync(self.index.fileno())
+            self.unsynced = False
+
+    def update(self, now: float) -> None:
+        # Called every probe loop iteration with the monotonic time
+        if self.last_sync is None:
+            self.last_sync = now
+        with self.lock:
+            waiting = len(self.pending)
+        if waiting and self.pending_since is None:
+            self.pending_since = now
+        if self.pending_since is not None and (
+            waiting >= BATCH_SIZE or now - self.pending_since >= FLUSH_INTERVAL
+        ):
+            self.flush()
+            self.pending_since = None
+        if now - self.last_sync >= SYNC_INTERVAL:
+            self.sync()
+            self.last_sync = now
+
+    def close(self) -> None:
+        self.flush()
+        if self.file is not None:
+            self.close_segment()
+
+
+def seek_offset(segment: str, since: float) -> int:
+    # Where the last batch that started before since was written
+    try:
+        with open(index_path(segment)) as file:
+            lines = [line.split() for line in file]
+    except FileNotFoundError:
+        return 0
+    entries = [(float(t), int(o)) for t, o in (e for e in lines if len(e) == 2)]
+    position = bisect.bisect_right(entries, (since, float("inf")))
+    if position == 0:
+        return 0
+    return entries[position - 1][1]
+
+
+def read_events(
+    directory: str, since: float | None = None, until: float | None = None
+) -> Iterator[dict]:
+    segments = list_segments(directory)
+    if since is not None:
+        # Skip the segments that ended before since
+        starts = [start for start, _ in segments]
+        segments = segments[max(0, bisect.bisect_right(starts, since) - 1) :]
+    for position, (_, path) in enumerate(segments):
+        offset = seek_offset(path, since) if since is not None and position == 0 else 0
+        with open(path, "rb") as file:
+            file.seek(offset)
+            for line in file:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    # Cut short by a crash
+                    continue
+                if since is not None and event["time"] < since:
+                    continue
+                if until is not None and event["time"] >= until:
+                    return
+                yield event
+
+
+def parse_when(text: str, now: float) -> float:
+    # "30m", "12h", "7d", "2w" ago, or an ISO date and time
+    match = RELATIVE.match(text)
+    if match:
+        return now - float(match.group(1)) * UNITS[match.group(2)]
+    try:
+        return datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        raise ValueError(f"Invalid time {text}, e.g. 7d or 2024-05-01T08:00")
+
+
+def format_event(event: dict) -> str:
+    when = datetime.fromtimestamp(event["time"]).astimezone()
+    fields = " ".join(
+        f"{key}={value}" for key, value in event.items() if key not in ("time", "event")
+    )
+    return f"{when.isoformat('T', 'seconds')} {event['event']} {fields}".rstrip()
+
+
+def summarize(events: list[dict]) -> list[str]:
+    counts: dict[str, int] = {}
+    latencies = []
+    for event in events:
+        counts[event["event"]] = counts.get(event["event"], 0) + 1
+        if event["event"] == "action" and "latency" in event:
+            latencies.append(event["latency"])
+    lines = [f"{name}: {count}" for name, count in sorted(counts.items())]
+    if latencies:
+        latencies.sort()
+        median = latencies[len(latencies) // 2]
+        lines.append(
+            f"action latency: median {median:.3f} s, max {latencies[-1]:.3f} s"
+        )
+    return lines
+
+
+def run_query(argv: list[str], directory: str | None = None) -> int:
+    # yubikey-locker events [--since WHEN] [--until WHEN] [--event NAME] ...
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="yubikey-locker events", description="Show the locker's journal"
+    )
+    parser.add_argument("--since", help="e.g. 7d, 12h or 2024-05-01T08:00")
+    parser.add_argument("--until")
+    parser.add_argument("--event", action="append", help="only these events")
+    parser.add_argument("--summary", action="store_true", help="count them")
+    parser.add_argument("--json", action="store_true", help="one object per line")
+    parser.add_argument("--dir", default=directory or journal_dir())
+    args = parser.parse_args(argv)
+
+    now = time.time()
+    try:
+        since = parse_when(args.since, now) if args.since else None
+        until = parse_when(args.until, now) if args.until else None
+    except ValueError as e:
+        print(e)
+        return 1
+
+    events = read_events(args.dir, since, until)
+    if args.event:
+        events = (event for event in events if event["event"] in args.event)
+    if args.summary:
+        for line in summarize(list(events)):
+            print(line)
+        return 0
+    for event in events:
+        print(json.dumps(event) if args.json else format_event(event))
+    return 0
@@ -0,0 +1,483 @@
+import os
+import socket
+import struct
+from collections import deque
+from collections.abc import Callable
+from typing import Any
+from urllib.parse import unquote
+
+# Minimal D-Bus client, just enough to call methods and receive signals
+# without spawning dbus-send for every call
+
+DBUS_TIMEOUT = 5
+SYSTEM_BUS_ADDRESS = "unix:path=/var/run/dbus/system_bus_socket"
+
+BUS_NAME = "org.freedesktop.DBus"
+BUS_PATH = "/org/freedesktop/DBus"
+BUS_INTERFACE = "org.freedesktop.DBus"
+
+# Message types
+METHOD_CALL = 1
+METHOD_RETURN = 2
+ERROR = 3
+SIGNAL = 4
+
+# Header fields
+FIELD_PATH = 1
+FIELD_INTERFACE = 2
+FIELD_MEMBER = 3
+FIELD_ERROR_NAME = 4
+FIELD_REPLY_SERIAL = 5
+FIELD_DESTINATION = 6
+FIELD_SENDER = 7
+FIELD_SIGNATURE = 8
+
+FIELD_TYPES = {
+    FIELD_PATH: "o",
+    FIELD_INTERFACE: "s",
+    FIELD_MEMBER: "s",
+    FIELD_ERROR_NAME: "s",
+    FIELD_REPLY_SERIAL: "u",
+    FIELD_DESTINATION: "s",
+    FIELD_SENDER: "s",
+    FIELD_SIGNATURE: "g",
+}
+
+FIXED_FORMATS = {
+    "y": "B",
+    "b": "I",
+    "n": "h",
+    "q": "H",
+    "i": "i",
+    "u": "I",
+    "x": "q",
+    "t": "Q",
+    "d": "d",
+    "h": "I",
+}
+ALIGNMENT = {
+    "y": 1,
+    "b": 4,
+    "n": 2,
+    "q": 2,
+    "i": 4,
+    "u": 4,
+    "x": 8,
+    "t": 8,
+    "d": 8,
+    "h": 4,
+    "s": 4,
+    "o": 4,
+    "g": 1,
+    "v": 1,
+    "a": 4,
+    "(": 8,
+    "{": 8,
+}
+
+
+class DBusError(Exception):
+    def __init__(self, name: str, message: str = "") -> None:
+        super().__init__(f"{name}: {message}")
+        self.name = name
+
+
+def complete_type_end(signature: str, start: int) -> int:
+    code = signature[start]
+    if code == "a":
+        return complete_type_end(signature, start + 1)
+    if code in "({":
+        end = start + 1
+        while signature[end] not in ")}":
+            end = complete_type_end(signature, end)
+        return end + 1
+    return start + 1
+
+
+def split_signature(signature: str) -> list[str]:
+    types = []
+    start = 0
+    while start < len(signature):
+        end = complete_type_end(signature, start)
+        types.append(signature[start:end])
+        start = end
+    return types
+
+
+class Writer:
+    def __init__(self) -> None:
+        self.buf = bytearray()
+
+    def pad(self, alignment: int) -> None:
+        self.buf.extend(b"\0" * (-len(self.buf) % alignment))
+
+    def write(self, type_code: str, value) -> None:
+        code = type_code[0]
+        if code in FIXED_FORMATS:
+            self.pad(ALIGNMENT[code])
+            if code == "b":
+                value = int(bool(value))
+            self.buf.extend(struct.pack("<" + FIXED_FORMATS[code], value))
+        elif code in "so":
+            encoded = value.encode()
+            self.pad(4)
+            self.buf.extend(struct.pack("<I", len(encoded)) + encoded + b"\0")
+        elif code == "g":
+            encoded = value.encode()
+            self.buf.extend(bytes([len(encoded)]) + encoded + b"\0")
+        elif code == "v":
+            # Variants are written from a (signature, value) tuple
+            signature, inner = value
+            self.write("g", signature)
+            self.write(signature, inner)
+        elif code == "a":
+            element = type_code[1:]
+            self.pad(4)
+            length_at = len(self.buf)
+            self.buf.extend(b"\0\0\0\0")
+            self.pad(ALIGNMENT[element[0]])
+            start = len(self.buf)
+            items = value.items() if isinstance(value, dict) else value
+            for item in items:
+                self.write(element, item)
+            struct.pack_into("<I", self.buf, length_at, len(self.buf) - start)
+        elif code in "({":
+            self.pad(8)
+            for member, item in zip(split_signature(type_code[1:-1]), value):
+                self.write(member, item)
+        else:
+            raise ValueError("Unsupported D-Bus type: " + type_code)
+
+
+class Reader:
+    def __init__(self, data: bytes, endian: str = "<", offset: int = 0) -> None:
+        self.data = data
+        self.endian = endian
+        self.offset = offset
+
+    def align(self, alignment: int) -> None:
+        self.offset += -self.offset % alignment
+
+    def unpack(self, fmt: str):
+        value = struct.unpack_from(self.endian + fmt, self.data, self.offset)[0]
+        self.offset += struct.calcsize(fmt)
+        return value
+
+    def read(self, type_code: str):
+        code = type_code[0]
+        if code in FIXED_FORMATS:
+            self.align(ALIGNMENT[code])
+            value = self.unpack(FIXED_FORMATS[code])
+            return bool(value) if code == "b" else value
+        if code in "so":
+            self.align(4)
+            length = self.unpack("I")
+            value = self.data[self.offset : self.offset + length].decode()
+            self.offset += length + 1
+            return value
+        if code == "g":
+            length = self.data[self.offset]
+            value = self.data[self.offset + 1 : self.offset + 1 + length].decode()
+            self.offset += length + 2
+            return value
+        if code == "v":
+            # Variants are returned as their plain value
+            return self.read(self.read("g"))
+        if code == "a":
+            element = type_code[1:]
+            self.align(4)
+            length = self.unpack("I")
+            self.align(ALIGNMENT[element[0]])
+            end = self.offset + length
+            items = []
+            while self.offset < end:
+                items.append(self.read(element))
+            return dict(items) if element[0] == "{" else items
+        if code in "({":
+            self.align(8)
+            return tuple(
+                self.read(member) for member in split_signature(type_code[1:-1])
+            )
+        raise ValueError("Unsupported D-Bus type: " + type_code)
+
+
+class Message:
+    def __init__(
+        self,
+        message_type: int,
+        serial: int,
+        fields: dict[int, Any],
+        body: list,
+        flags: int = 0,
+    ) -> None:
+        self.message_type = message_type
+        self.serial = serial
+        self.fields = fields
+        self.body = body
+        self.flags = flags
+
+    @property
+    def signature(self) -> str:
+        return self.fields.get(FIELD_SIGNATURE, "")
+
+    @property
+    def reply_serial(self) -> int | None:
+        return self.fields.get(FIELD_REPLY_SERIAL)
+
+    @property
+    def interface(self) -> str | None:
+        return self.fields.get(FIELD_INTERFACE)
+
+    @property
+    def member(self) -> str | None:
+        return self.fields.get(FIELD_MEMBER)
+
+    @property
+    def path(self) -> str | None:
+        return self.fields.get(FIELD_PATH)
+
+    def encode(self) -> bytes:
+        body = Writer()
+        for type_code, value in zip(split_signature(self.signature), self.body):
+            body.write(type_code, value)
+
+        header = Writer()
+        header.buf.extend(
+            struct.pack(
+                "<cBBBII",
+                b"l",
+                self.message_type,
+                self.flags,
+                1,
+                len(body.buf),
+                self.serial,
+            )
+        )
+        header.write(
+            "a(yv)",
+            [(code, (FIELD_TYPES[code], value)) for code, value in self.fields.items()],
+        )
+        header.pad(8)
+        return bytes(header.buf + body.buf)
+
+
+def message_length(header: bytes) -> int:
+    # The fixed part of every message is 16 bytes, ending with the fields length
+    endian = "<" if header[0:1] == b"l" else ">"
+    body_length, _, fields_length = struct.unpack_from(endian + "III", header, 4)
+    return 16 + fields_length + (-fields_length % 8) + body_length
+
+
+def decode_message(data: bytes) -> Message:
+    endian = "<" if data[0:1] == b"l" else ">"
+    try:
+        message_type, flags, _, _, serial = struct.unpack_from(
+            endian + "BBBII", data, 1
+        )
+        reader = Reader(data, endian, 12)
+        fields = dict(reader.read("a(yv)"))
+        reader.align(8)
+        signature = fields.get(FIELD_SIGNATURE, "")
+        body = [reader.read(type_code) for type_code in split_signature(signature)]
+    except (ValueError, TypeError, IndexError, KeyError, struct.error) as e:
+        # Nothing after a broken message can be trusted, drop the connection
+        raise ConnectionError(f"Malformed D-Bus message: {e}") from e
+    return Message(message_type, serial, fields, body, flags)
+
+
+def parse_address(address: str) -> list[str | bytes]:
+    # "unix:path=/run/user/1000/bus;unix:abstract=/tmp/dbus-x,guid=..."
+    socket_paths: list[str | bytes] = []
+    for entry in address.split(";"):
+        transport, _, options = entry.partition(":")
+        if transport != "unix":
+            continue
+        values = dict(
+            option.split("=", 1) for option in options.split(",") if "=" in option
+        )
+        if "path" in values:
+            socket_paths.append(unquote(values["path"]))
+        elif "abstract" in values:
+            socket_paths.append(b"\0" + unquote(values["abstract"]).encode())
+    return socket_paths
+
+
+def session_bus_address() -> str | None:
+    address = os.environ.get("DBUS_SESSION_BUS_ADDRESS")
+    if address:
+        return address
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir and os.path.exists(os.path.join(runtime_dir, "bus")):
+        return "unix:path=" + os.path.join(runtime_dir, "bus")
+    return None
+
+
+def system_bus_address() -> str:
+    return os.environ.get("DBUS_SYSTEM_BUS_ADDRESS", SYSTEM_BUS_ADDRESS)
+
+
+class DBusConnection:
+    def __init__(self, address: str, timeout: float = DBUS_TIMEOUT) -> None:
+        self.timeout = timeout
+        self.sock = self.connect(address, timeout)
+        self.serial = 0
+        self.buffer = bytearray()
+        # Signals that arrived while waiting for a method reply
+        self.signals: deque[Message] = deque()
+        try:
+            self.authenticate()
+            self.unique_name = self.call(BUS_NAME, BUS_PATH, BUS_INTERFACE, "Hello")[0]
+        except BaseException:
+            self.close()
+            raise
+
+    def connect(self, address: str, timeout: float) -> socket.socket:
+        error: OSError = ConnectionError("No usable D-Bus address: " + address)
+        for socket_path in parse_address(address):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(timeout)
+            try:
+                sock.connect(socket_path)
+                return sock
+            except OSError as e:
+                sock.close()
+                error = e
+        raise error
+
+    def authenticate(self) -> None:
+        uid = str(os.getuid()).encode().hex().encode()
+        self.sock.sendall(b"\0AUTH EXTERNAL " + uid + b"\r\n")
+        if not self.read_line().startswith(b"OK "):
+            raise ConnectionError("D-Bus authentication failed")
+        self.sock.sendall(b"BEGIN\r\n")
+
+    def fill(self) -> None:
+        data = self.sock.recv(65536)
+        if not data:
+            raise ConnectionError("D-Bus connection closed")
+        self.buffer.extend(data)
+
+    def read_line(self) -> bytes:
+        while b"\r\n" not in self.buffer:
+            self.fill()
+        line, _, rest = bytes(self.buffer).partition(b"\r\n")
+        self.buffer = bytearray(rest)
+        return line
+
+    def send(self, message: Message) -> int:
+        self.serial += 1
+        message.serial = self.serial
+        self.sock.sendall(message.encode())
+        return self.serial
+
+    def recv_message(self) -> Message:
+        while len(self.buffer) < 16:
+            self.fill()
+        length = message_length(bytes(self.buffer[:16]))
+        while len(self.buffer) < length:
+            self.fill()
+        data = bytes(self.buffer[:length])
+        del self.buffer[:length]
+        return decode_message(data)
+
+    def send_call(
+        self,
+        destination: str,
+        path: str,
+        interface: str,
+        member: str,
+        signature: str = "",
+        body: tuple | list = (),
+    ) -> int:
+        fields: dict[int, Any] = {
+            FIELD_PATH: path,
+            FIELD_INTERFACE: interface,
+            FIELD_MEMBER: member,
+            FIELD_DESTINATION: destination,
+        }
+        if signature:
+            fields[FIELD_SIGNATURE] = signature
+        return self.send(Message(METHOD_CALL, 0, fields, list(body)))
+
+    def wait_reply(self, serial: int) -> list:
+        while True:
+            message = self.recv_message()
+            if message.reply_serial == serial:
+                if message.message_type == ERROR:
+                    text = message.body[0] if message.body else ""
+                    raise DBusError(message.fields.get(FIELD_ERROR_NAME, ""), text)
+                return message.body
+            if message.message_type == SIGNAL:
+                self.signals.append(message)
+
+    def call(self, *args, **kwargs) -> list:
+        return self.wait_reply(self.send_call(*args, **kwargs))
+
+    def add_match(self, rule: str) -> None:
+        # Subscribe to the signals matching a rule, e.g.
+        # "type='signal',interface='org.gnome.ScreenSaver'"
+        self.call(BUS_NAME, BUS_PATH, BUS_INTERFACE, "AddMatch", "s", (rule,))
+
+    def fileno(self) -> int:
+        return self.sock.fileno()
+
+    def receive_signals(self) -> list[Message]:
+        # The signals that already arrived, without blocking
+        self.sock.setblocking(False)
+        try:
+            while True:
+                self.fill()
+        except BlockingIOError:
+            pass
+        finally:
+            self.sock.settimeout(self.timeout)
+
+        while len(self.buffer) >= 16:
+            if len(self.buffer) < message_length(bytes(self.buffer[:16])):
+                break
+            message = self.recv_message()
+            if message.message_type == SIGNAL:
+                self.signals.append(message)
+        signals = list(self.signals)
+        self.signals.clear()
+        return signals
+
+    def close(self) -> None:
+        self.sock.close()
+
+
+class BusClient:
+    def __init__(self, get_address: Callable[[], str | None]) -> None:
+        # Keeps one connection open and reconnects once if it broke
+        self.get_address = get_address
+        self.connection: DBusConnection | None = None
+
+    def connect(self) -> DBusConnection:
+        if self.connection is None:
+            address = self.get_address()
+            if address is None:
+                raise ConnectionError("No D-Bus address found")
+            self.connection = DBusConnection(address)
+        return self.connection
+
+    def call(self, *args, **kwargs) -> list:
+        # Raises OSError or DBusError
+        try:
+            serial = self.connect().send_call(*args, **kwargs)
+        except OSError:
+            # Stale connection, e.g. the bus was restarted, try once more
+            self.close()
+            serial = self.connect().send_call(*args, **kwargs)
+        connection = self.connect()
+        try:
+            return connection.wait_reply(serial)
+        except OSError:
+            # The call may already have been delivered, so it is never sent
+            # twice, the next call starts on a new connection
+            self.close()
+            raise
+
+    def close(self) -> None:
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
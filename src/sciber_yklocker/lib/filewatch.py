@@ -0,0 +1,225 @@
+import ctypes
+import os
+import select
+import socket
+import struct
+import threading
+from typing import Any, cast
+
+# Watch files for changes without reading them in the loop. Each watcher has
+# a fileno() to wait on and drain() returns True if a watched file changed.
+# Directories are watched instead of the files, editors usually replace a
+# file instead of writing to it, and a missing file may be created later.
+
+# inotify(7)
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_WATCH_MASK = (
+    IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+)
+INOTIFY_EVENT = struct.Struct("iIII")
+INOTIFY_BUFFER_SIZE = 65536
+
+# Seconds between checks when nothing better than polling is available
+POLL_INTERVAL = 5
+
+# kqueue only exists on MacOS and the BSDs, checked with hasattr before use
+kqueue_select = cast(Any, select)
+
+
+def watch_targets(paths: list[str]) -> dict[str, set[str]]:
+    # Directory to watch -> names in it that matter. If a directory does not
+    # exist yet, its closest existing parent is watched for it to show up.
+    targets: dict[str, set[str]] = {}
+    for path in paths:
+        directory, name = os.path.split(os.path.abspath(path))
+        while not os.path.isdir(directory):
+            parent, name = os.path.split(directory)
+            if parent == directory:
+                break
+            directory = parent
+        targets.setdefault(directory, set()).add(name)
+    return targets
+
+
+class InotifyWatcher:
+    def __init__(self, paths: list[str]) -> None:
+        self.paths = paths
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.fd = fd
+        # Watch descriptor -> names that matter in that directory
+        self.watches: dict[int, set[str]] = {}
+        try:
+            self.watch()
+        except OSError:
+            os.close(fd)
+            raise
+
+    def watch(self) -> None:
+        for wd in self.watches:
+            self.libc.inotify_rm_watch(self.fd, wd)
+        self.watches = {}
+        for directory, names in watch_targets(self.paths).items():
+            wd = self.libc.inotify_add_watch(
+                self.fd, os.fsencode(directory), IN_WATCH_MASK
+            )
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_add_watch failed", directory)
+            self.watches[wd] = names
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def drain(self) -> bool:
+        changed = False
+        while True:
+            try:
+                data = os.read(self.fd, INOTIFY_BUFFER_SIZE)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset + INOTIFY_EVENT.size <= len(data):
+                wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                name = data[offset : offset + length].rstrip(b"\0")
+                offset += length
+                # The kernel dropped events, we can not know what we missed
+                if mask & IN_Q_OVERFLOW:
+                    changed = True
+                elif os.fsdecode(name) in self.watches.get(wd, ()):
+                    changed = True
+
+        if changed:
+            # A watched directory might have been created
+            self.watch()
+        return changed
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class KqueueWatcher:
+    # MacOS, kqueue only watches open files so the directories are opened
+    def __init__(self, paths: list[str]) -> None:
+        self.paths = paths
+        self.kqueue = kqueue_select.kqueue()
+        self.fds: list[int] = []
+        self.watch()
+
+    def watch(self) -> None:
+        self.close_fds()
+        watched = list(watch_targets(self.paths))
+        # Also the files themselves, writing to a file does not change its directory
+        watched += [path for path in self.paths if os.path.isfile(path)]
+        fflags = (
+            kqueue_select.KQ_NOTE_WRITE
+            | kqueue_select.KQ_NOTE_DELETE
+            | kqueue_select.KQ_NOTE_RENAME
+            | kqueue_select.KQ_NOTE_EXTEND
+            | kqueue_select.KQ_NOTE_ATTRIB
+        )
+        for path in watched:
+            fd = os.open(path, os.O_RDONLY | getattr(os, "O_EVTONLY", 0))
+            self.fds.append(fd)
+            event = kqueue_select.kevent(
+                fd,
+                filter=kqueue_select.KQ_FILTER_VNODE,
+                flags=kqueue_select.KQ_EV_ADD | kqueue_select.KQ_EV_CLEAR,
+                fflags=fflags,
+            )
+            self.kqueue.control([event], 0, 0)
+
+    def fileno(self) -> int:
+        return self.kqueue.fileno()
+
+    def drain(self) -> bool:
+        changed = False
+        while self.kqueue.control(None, 64, 0):
+            changed = True
+        if changed:
+            self.watch()
+        return changed
+
+    def close_fds(self) -> None:
+        for fd in self.fds:
+            os.close(fd)
+        self.fds = []
+
+    def close(self) -> None:
+        self.close_fds()
+        self.kqueue.close()
+
+
+class PollWatcher:
+    # Fallback, a thread compares the files' stat every interval seconds
+    def __init__(self, paths: list[str], interval: float = POLL_INTERVAL) -> None:
+        self.paths = paths
+        self.interval = interval
+        self.reader, self.writer = socket.socketpair()
+        self.reader.setblocking(False)
+        self.writer.setblocking(False)
+        self.stopped = threading.Event()
+        self.stats = self.stat()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stat(self) -> list[tuple[int, int, int] | None]:
+        stats: list[tuple[int, int, int] | None] = []
+        for path in self.paths:
+            try:
+                st = os.stat(path)
+                stats.append((st.st_ino, st.st_size, st.st_mtime_ns))
+            except OSError:
+                stats.append(None)
+        return stats
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.interval):
+            stats = self.stat()
+            if stats != self.stats:
+                self.stats = stats
+                try:
+                    self.writer.send(b"\0")
+                except OSError:
+                    pass
+
+    def fileno(self) -> int:
+        return self.reader.fileno()
+
+    def drain(self) -> bool:
+        changed = False
+        try:
+            while self.reader.recv(4096):
+                changed = True
+        except (BlockingIOError, OSError):
+            pass
+        return changed
+
+    def close(self) -> None:
+        self.stopped.set()
+        self.thread.join()
+        self.reader.close()
+        self.writer.close()
+
+
+def open_file_watcher(paths: list[str]):
+    # The best watcher this system has
+    try:
+        if hasattr(ctypes.CDLL(None), "inotify_init1"):
+            return InotifyWatcher(paths)
+        if hasattr(select, "kqueue"):
+            return KqueueWatcher(paths)
+    except OSError:
+        # E.g. out of inotify watches
+        pass
+    return PollWatcher(paths)
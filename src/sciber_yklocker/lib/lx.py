@@ -1,20 +1,146 @@
-import os
+import shutil
 import syslog
 
+from sciber_yklocker.actuator import Actuator, ActuatorError
+from sciber_yklocker.executor import ACTIONS
+from sciber_yklocker.lib.dbus import (
+    BUS_INTERFACE,
+    BUS_NAME,
+    BUS_PATH,
+    BusClient,
+    DBusError,
+    session_bus_address,
+    system_bus_address,
+)
 from sciber_yklocker.models.removaloption import RemovalOption
 
+# Bus connections are kept open between lock actions
+SESSION_BUS = BusClient(session_bus_address)
+SYSTEM_BUS = BusClient(system_bus_address)
+
+# D-Bus calls as (destination, path, interface, member, signature, body)
+SCREENSAVER_LOCK = (
+    "org.gnome.ScreenSaver",
+    "/org/gnome/ScreenSaver",
+    "org.gnome.ScreenSaver",
+    "Lock",
+    "",
+    (),
+)
+# Not GNOME, ask logind to lock the session we are running in
+LOGIND_LOCK = (
+    "org.freedesktop.login1",
+    "/org/freedesktop/login1/session/auto",
+    "org.freedesktop.login1.Session",
+    "Lock",
+    "",
+    (),
+)
+SESSION_LOGOUT = (
+    "org.gnome.SessionManager",
+    "/org/gnome/SessionManager",
+    "org.gnome.SessionManager",
+    "Logout",
+    "u",
+    (1,),
+)
+
+# Used if none of the D-Bus calls work
+LOCK_ARGV = (
+    "dbus-send",
+    "--type=method_call",
+    "--dest=org.gnome.ScreenSaver",
+    "/org/gnome/ScreenSaver",
+    "org.gnome.ScreenSaver.Lock",
+)
+# pkill -SIGKILL -u $(whoami)
+LOGOUT_ARGV = (
+    "dbus-send",
+    "--session",
+    "--type=method_call",
+    "--print-reply",
+    "--dest=org.gnome.SessionManager",
+    "/org/gnome/SessionManager",
+    "org.gnome.SessionManager.Logout",
+    "uint32:1",
+)
+
 
 def log_message(msg: str):
     syslog.syslog(syslog.LOG_INFO, msg)
 
 
+def open_buses() -> None:
+    # Connect at startup so the lock action does not pay for it
+    for bus in (SESSION_BUS, SYSTEM_BUS):
+        try:
+            bus.connect()
+        except OSError as e:
+            log_message("Could not connect to D-Bus, retrying when needed: " + str(e))
+
+
+def name_has_owner(bus: BusClient, name: str) -> bool:
+    try:
+        reply = bus.call(
+            BUS_NAME, BUS_PATH, BUS_INTERFACE, "NameHasOwner", "s", (name,)
+        )
+        return bool(reply and reply[0])
+    except (OSError, DBusError):
+        return False
+
+
+class LxActuator(Actuator):
+    def __init__(self, removal_option: RemovalOption) -> None:
+        super().__init__(removal_option)
+        # Tried in order, then dbus-send
+        self.calls: list[tuple[BusClient, tuple]] = []
+        self.argv: list[str] = []
+        if removal_option == RemovalOption.LOCK:
+            self.calls = [(SESSION_BUS, SCREENSAVER_LOCK), (SYSTEM_BUS, LOGIND_LOCK)]
+            self.argv = list(LOCK_ARGV)
+        elif removal_option == RemovalOption.LOGOUT:
+            self.calls = [(SESSION_BUS, SESSION_LOGOUT)]
+            self.argv = list(LOGOUT_ARGV)
+
+    def validate(self) -> None:
+        if not self.calls:
+            return
+        running = [call for call in self.calls if name_has_owner(call[0], call[1][0])]
+        dbus_send = shutil.which(self.argv[0])
+        if not running and dbus_send is None:
+            raise ActuatorError(
+                f"No D-Bus service to {self.removal_option} and no dbus-send"
+            )
+
+        # Start with the services that are running, the others stay as a
+        # fallback in case they show up later
+        self.calls = running + [call for call in self.calls if call not in running]
+        if dbus_send is not None:
+            self.argv[0] = dbus_send
+
+    def act(self) -> None:
+        for bus, call in self.calls:
+            try:
+                bus.call(*call)
+                return
+            except (OSError, DBusError):
+                pass
+
+        # Fall back to dbus-send if the native D-Bus calls failed
+        if self.argv:
+            result = ACTIONS.run(self.argv)
+            if not result.ok:
+                log_message("Lock action failed: " + str(result))
+
+
+def build_actuator(removal_option: RemovalOption) -> LxActuator:
+    return LxActuator(removal_option)
+
+
 def lock_system(removal_option: RemovalOption) -> None:
-    # Determine what type of lock-action to take
-    command = ""
-    if removal_option == RemovalOption.LOCK:
-        command = "dbus-send --type=method_call --dest=org.gnome.ScreenSaver /org/gnome/ScreenSaver org.gnome.ScreenSaver.Lock"
-    if removal_option == RemovalOption.LOGOUT:
-        # pkill -SIGKILL -u $(whoami)
-        command = "dbus-send --session --type=method_call --print-reply --dest=org.gnome.SessionManager /org/gnome/SessionManager org.gnome.SessionManager.Logout uint32:1"
-
-    os.popen(command)
+    actuator = build_actuator(removal_option)
+    try:
+        actuator.validate()
+    except ActuatorError as e:
+        log_message(str(e))
+    actuator.act()
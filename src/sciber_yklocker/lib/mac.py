@@ -1,8 +1,12 @@
+import os
 import subprocess
+from collections.abc import Callable
 from ctypes import CDLL
 
 from pyoslog import OS_LOG_DEFAULT, os_log
 
+from sciber_yklocker.actuator import Actuator, ActuatorError
+from sciber_yklocker.executor import ACTIONS
 from sciber_yklocker.models.removaloption import RemovalOption
 
 
@@ -10,17 +14,50 @@ def log_message(msg: str):
     os_log(OS_LOG_DEFAULT, msg)
 
 
+LOGIN_FRAMEWORK = (
+    "/System/Library/PrivateFrameworks/login.framework/Versions/Current/login"
+)
+LAUNCHCTL = "/bin/launchctl"
+
+
+class MacActuator(Actuator):
+    def __init__(self, removal_option: RemovalOption) -> None:
+        super().__init__(removal_option)
+        self.lock_screen: Callable[[], object] | None = None
+        self.argv: list[str] = []
+        if removal_option == RemovalOption.LOGOUT:
+            self.argv = [LAUNCHCTL, "bootout", f"user/{os.getuid()}"]
+
+    def validate(self) -> None:
+        if self.removal_option == RemovalOption.LOCK:
+            try:
+                self.lock_screen = CDLL(LOGIN_FRAMEWORK).SACLockScreenImmediate
+            except (OSError, AttributeError) as e:
+                raise ActuatorError("Can not load the login framework: " + str(e))
+        elif self.removal_option == RemovalOption.LOGOUT:
+            if not os.access(LAUNCHCTL, os.X_OK):
+                raise ActuatorError(LAUNCHCTL + " not found")
+
+    def act(self) -> None:
+        if self.lock_screen is not None:
+            self.lock_screen()
+        elif self.argv:
+            result = ACTIONS.run(self.argv)
+            if not result.ok:
+                log_message("Lock action failed: " + str(result))
+
+
+def build_actuator(removal_option: RemovalOption) -> MacActuator:
+    return MacActuator(removal_option)
+
+
 def lock_system(removal_option: RemovalOption) -> None:
-    if removal_option == RemovalOption.LOCK:
-        loginPF = CDLL(
-            "/System/Library/PrivateFrameworks/login.framework/Versions/Current/login"
-        )
-        loginPF.SACLockScreenImmediate()
-    elif removal_option == RemovalOption.LOGOUT:
-        subprocess.run(
-            "/bin/launchctl bootout user/$(/usr/bin/id -u $(/usr/bin/whoami))",
-            shell=True,
-        )
+    actuator = build_actuator(removal_option)
+    try:
+        actuator.validate()
+    except ActuatorError as e:
+        log_message(str(e))
+    actuator.act()
 
 
 # Unusued function for now
@@ -0,0 +1,130 @@
+from abc import ABC, abstractmethod
+
+from sciber_yklocker.lib.dbus import (
+    SIGNAL,
+    DBusConnection,
+    DBusError,
+    Message,
+    session_bus_address,
+    system_bus_address,
+)
+
+# Follow whether the session is locked from D-Bus signals, so the locker can
+# stop probing while there is nothing left to lock. Each watcher has a
+# fileno() to wait on and drain() returns True if its view changed.
+
+LOGIND = "org.freedesktop.login1"
+LOGIND_PATH = "/org/freedesktop/login1"
+LOGIND_MANAGER = "org.freedesktop.login1.Manager"
+LOGIND_SESSION = "org.freedesktop.login1.Session"
+PROPERTIES = "org.freedesktop.DBus.Properties"
+SCREENSAVER = "org.gnome.ScreenSaver"
+SCREENSAVER_PATH = "/org/gnome/ScreenSaver"
+
+
+class LockWatcher(ABC):
+    def __init__(self, connection: DBusConnection) -> None:
+        self.connection = connection
+        self.locked = False
+
+    def fileno(self) -> int:
+        return self.connection.fileno()
+
+    @abstractmethod
+    def locked_from(self, message: Message) -> bool | None:
+        # What a signal says about the lock, None if it is not about it
+        pass
+
+    def drain(self) -> bool:
+        changed = False
+        for message in self.connection.receive_signals():
+            locked = self.locked_from(message)
+            if locked is not None and locked != self.locked:
+                self.locked = locked
+                changed = True
+        return changed
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+class LogindLockWatcher(LockWatcher):
+    # The session's LockedHint, and the Lock/Unlock requests logind sends
+    def __init__(self, address: str | None = None) -> None:
+        super().__init__(DBusConnection(address or system_bus_address()))
+        try:
+            # The session we run in, or the user's graphical session when
+            # started as a user service
+            self.session = self.connection.call(
+                LOGIND, LOGIND_PATH, LOGIND_MANAGER, "GetSession", "s", ("auto",)
+            )[0]
+            for interface in (LOGIND_SESSION, PROPERTIES):
+                self.connection.add_match(
+                    f"type='signal',sender='{LOGIND}',"
+                    f"path='{self.session}',interface='{interface}'"
+                )
+            self.locked = self.connection.call(
+                LOGIND,
+                self.session,
+                PROPERTIES,
+                "Get",
+                "ss",
+                (LOGIND_SESSION, "LockedHint"),
+            )[0]
+        except (OSError, DBusError):
+            self.close()
+            raise
+
+    def locked_from(self, message: Message) -> bool | None:
+        if message.message_type != SIGNAL or message.path != self.session:
+            return None
+        if message.interface == LOGIND_SESSION:
+            return {"Lock": True, "Unlock": False}.get(message.member)
+        if message.interface == PROPERTIES and message.member == "PropertiesChanged":
+            interface, changed, *_ = message.body
+            if interface == LOGIND_SESSION and "LockedHint" in changed:
+                return bool(changed["LockedHint"])
+        return None
+
+
+class ScreenSaverLockWatcher(LockWatcher):
+    # GNOME's screensaver, active while the screen is locked
+    def __init__(self, address: str | None = None) -> None:
+        address = address or session_bus_address()
+        if address is None:
+            raise ConnectionError("No D-Bus session bus found")
+        super().__init__(DBusConnection(address))
+        try:
+            self.connection.add_match(
+                f"type='signal',interface='{SCREENSAVER}',member='ActiveChanged'"
+            )
+            self.locked = self.connection.call(
+                SCREENSAVER, SCREENSAVER_PATH, SCREENSAVER, "GetActive"
+            )[0]
+        except (OSError, DBusError):
+            self.close()
+            raise
+
+    def locked_from(self, message: Message) -> bool | None:
+        if (
+            message.message_type == SIGNAL
+            and message.interface == SCREENSAVER
+            and message.member == "ActiveChanged"
+        ):
+            return bool(message.body[0])
+        return None
+
+
+def open_lock_watchers() -> tuple[list[LockWatcher], list[str]]:
+    # Whichever of them are available, and why the others are not
+    watchers: list[LockWatcher] = []
+    errors = []
+    for name, watcher_class in (
+        ("logind", LogindLockWatcher),
+        ("GNOME ScreenSaver", ScreenSaverLockWatcher),
+    ):
+        try:
+            watchers.append(watcher_class())
+        except (OSError, DBusError) as e:
+            errors.append(f"{name}: {e}")
+    return watchers, errors
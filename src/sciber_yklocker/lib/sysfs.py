@@ -0,0 +1,117 @@
+import os
+import re
+
+from sciber_yklocker.lib.uevent import YUBICO_VENDOR_ID
+
+SYSFS_USB_ROOT = "/sys/bus/usb/devices"
+SYSFS_HIDRAW_ROOT = "/sys/class/hidraw"
+SYSFS_POWER_SUPPLY_ROOT = "/sys/class/power_supply"
+# udev's properties per device, named after the device number, e.g. c189:5
+UDEV_DATA_ROOT = "/run/udev/data"
+DEFAULT_SEAT = "seat0"
+
+# USB interface directories are named "<bus path>:<config>.<interface>"
+USB_INTERFACE = re.compile(r"^(\d+-[\d.]+):\d+\.\d+$")
+
+
+def read_hex_attribute(path: str) -> int | None:
+    try:
+        with open(path) as f:
+            return int(f.read().strip(), 16)
+    except (OSError, ValueError):
+        return None
+
+
+def read_attribute(path: str) -> str | None:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def list_yubico_devices(root: str = SYSFS_USB_ROOT) -> dict[str, int]:
+    # Map USB bus path (e.g. "1-2") to product id without opening any device
+    devices = {}
+    for name in os.listdir(root):
+        # Interfaces like "1-2:1.0" have no idVendor, skip them right away
+        if ":" in name:
+            continue
+        device_path = os.path.join(root, name)
+        vendor_id = read_hex_attribute(os.path.join(device_path, "idVendor"))
+        if vendor_id != YUBICO_VENDOR_ID:
+            continue
+        product_id = read_hex_attribute(os.path.join(device_path, "idProduct"))
+        if product_id is not None:
+            devices[name] = product_id
+
+    return devices
+
+
+def usb_fingerprint(name: str, root: str = SYSFS_USB_ROOT) -> str:
+    # The device number changes on every insertion, even in the same port
+    try:
+        with open(os.path.join(root, name, "devnum")) as f:
+            return f"{name}@{f.read().strip()}"
+    except OSError:
+        return name
+
+
+def udev_seat(device_path: str, udev_root: str = UDEV_DATA_ROOT) -> str | None:
+    device_number = read_attribute(os.path.join(device_path, "dev"))
+    if device_number is None:
+        return None
+    try:
+        with open(os.path.join(udev_root, "c" + device_number)) as f:
+            for line in f:
+                if line.startswith("E:ID_SEAT="):
+                    return line.strip()[len("E:ID_SEAT=") :] or None
+    except OSError:
+        pass
+    return None
+
+
+def device_seat(
+    name: str, root: str = SYSFS_USB_ROOT, udev_root: str = UDEV_DATA_ROOT
+) -> str:
+    # Seats are assigned to hubs, a device belongs to the seat of the closest
+    # device above it that has one, like logind does it
+    device_path = os.path.realpath(os.path.join(root, name))
+    while os.path.exists(os.path.join(device_path, "dev")):
+        seat = udev_seat(device_path, udev_root)
+        if seat is not None:
+            return seat
+        device_path = os.path.dirname(device_path)
+    return DEFAULT_SEAT
+
+
+def hidraw_usb_device(devnode: str, root: str = SYSFS_HIDRAW_ROOT) -> str | None:
+    # /dev/hidraw3 resolves to .../usb1/1-2/1-2:1.1/0003:1050:0407.0005/hidraw/hidraw3
+    device_path = os.path.realpath(os.path.join(root, os.path.basename(devnode)))
+    for part in reversed(device_path.split(os.sep)):
+        match = USB_INTERFACE.match(part)
+        if match:
+            return match.group(1)
+
+    return None
+
+
+def on_battery(root: str = SYSFS_POWER_SUPPLY_ROOT) -> bool:
+    # Desktops without any power supply entries are never on battery
+    try:
+        supplies = os.listdir(root)
+    except OSError:
+        return False
+
+    discharging = False
+    for name in supplies:
+        supply_type = read_attribute(os.path.join(root, name, "type"))
+        if supply_type == "Mains":
+            if read_attribute(os.path.join(root, name, "online")) == "1":
+                return False
+        elif supply_type == "Battery":
+            status = read_attribute(os.path.join(root, name, "status"))
+            if status == "Discharging":
+                discharging = True
+
+    return discharging
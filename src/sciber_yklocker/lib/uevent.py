@@ -0,0 +1,70 @@
+import errno
+import socket
+
+YUBICO_VENDOR_ID = 0x1050
+
+# Netlink protocol and multicast group the kernel publishes uevents on
+NETLINK_KOBJECT_UEVENT = 15
+UEVENT_KERNEL_GROUP = 1
+UEVENT_BUFFER_SIZE = 16384
+
+
+def parse_uevent(datagram: bytes) -> dict[str, str]:
+    # A kernel uevent is "action@devpath" followed by NUL separated KEY=VALUE pairs
+    event = {}
+    for field in datagram.split(b"\0")[1:]:
+        key, separator, value = field.partition(b"=")
+        if separator:
+            event[key.decode(errors="replace")] = value.decode(errors="replace")
+    return event
+
+
+def is_yubico_event(event: dict[str, str]) -> bool:
+    # Only whole USB devices, not every interface/hidraw node below them
+    if event.get("ACTION") not in ("add", "remove"):
+        return False
+    if event.get("SUBSYSTEM") != "usb" or event.get("DEVTYPE") != "usb_device":
+        return False
+
+    # PRODUCT is "vid/pid/bcdDevice" in hex without zero padding, e.g. 1050/407/543
+    vendor_id = event.get("PRODUCT", "").split("/")[0]
+    try:
+        return int(vendor_id, 16) == YUBICO_VENDOR_ID
+    except ValueError:
+        return False
+
+
+class UeventWatcher:
+    def __init__(self, sock: socket.socket | None = None) -> None:
+        # Tests pass one end of a socketpair instead of the kernel socket
+        if sock is None:
+            sock = socket.socket(
+                socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT
+            )
+            sock.bind((0, UEVENT_KERNEL_GROUP))
+        sock.setblocking(False)
+        self.sock = sock
+
+    def fileno(self) -> int:
+        return self.sock.fileno()
+
+    def drain(self) -> bool:
+        # Read everything queued, return True if a YubiKey was added or removed
+        yubico_event = False
+        while True:
+            try:
+                datagram = self.sock.recv(UEVENT_BUFFER_SIZE)
+            except BlockingIOError:
+                return yubico_event
+            except OSError as e:
+                if e.errno != errno.ENOBUFS:
+                    raise
+                # The kernel dropped events, we can not know what we missed
+                yubico_event = True
+                continue
+
+            if is_yubico_event(parse_uevent(datagram)):
+                yubico_event = True
+
+    def close(self) -> None:
+        self.sock.close()
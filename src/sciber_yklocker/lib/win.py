@@ -1,7 +1,11 @@
+import os
 import socket
+import subprocess
 import winreg
 
+import pywintypes
 import servicemanager
+import win32api
 import win32con
 import win32event
 import win32process
@@ -10,6 +14,8 @@ import win32service
 import win32serviceutil
 import win32ts
 
+from sciber_yklocker.actuator import Actuator, ActuatorError
+from sciber_yklocker.executor import ACTIONS, ChildProcess
 from sciber_yklocker.models.removaloption import RemovalOption
 
 REG_REMOVALOPTION = "RemovalOption"
@@ -21,32 +27,94 @@ def log_message(msg: str) -> None:
     servicemanager.LogInfoMsg(msg)
 
 
+class UserProcess(ChildProcess):
+    # Started in the desktop session of the console user, the process and
+    # thread handles are closed once it has exited
+    def __init__(self, argv) -> None:
+        try:
+            # As the service will be running as System you require a session handle to interact with the Desktop logon
+            console_session_id = win32ts.WTSGetActiveConsoleSessionId()
+            console_user_token = win32ts.WTSQueryUserToken(console_session_id)
+            startup = win32process.STARTUPINFO()
+            priority = win32con.NORMAL_PRIORITY_CLASS
+            environment = win32profile.CreateEnvironmentBlock(console_user_token, False)
+
+            try:
+                self.handle, self.thread, pid, tid = win32process.CreateProcessAsUser(
+                    console_user_token,
+                    None,
+                    subprocess.list2cmdline(argv),
+                    None,
+                    None,
+                    False,
+                    priority,
+                    environment,
+                    None,
+                    startup,
+                )
+            finally:
+                console_user_token.Close()
+        except pywintypes.error as e:
+            # Not an OSError, e.g. no user is logged on to the console
+            raise OSError(e.winerror, f"{e.funcname}: {e.strerror}") from e
+
+    def wait(self, timeout: float) -> int:
+        result = win32event.WaitForSingleObject(self.handle, int(timeout * 1000))
+        if result != win32event.WAIT_OBJECT_0:
+            raise subprocess.TimeoutExpired("", timeout)
+        return win32process.GetExitCodeProcess(self.handle)
+
+    def poll(self) -> int | None:
+        try:
+            return self.wait(0)
+        except subprocess.TimeoutExpired:
+            return None
+
+    def kill(self) -> None:
+        win32process.TerminateProcess(self.handle, 1)
+
+    def close(self) -> None:
+        win32api.CloseHandle(self.thread)
+        win32api.CloseHandle(self.handle)
+
+
+LOCK_ARGV = ("\\Windows\\system32\\rundll32.exe", "user32.dll,LockWorkStation")
+LOGOUT_ARGV = ("\\Windows\\system32\\logoff.exe",)
+
+
+class WinActuator(Actuator):
+    # The console session can change, so the user token is still looked up
+    # for every action
+    def __init__(self, removal_option: RemovalOption) -> None:
+        super().__init__(removal_option)
+        self.argv: list[str] = []
+        if removal_option == RemovalOption.LOCK:
+            self.argv = list(LOCK_ARGV)
+        elif removal_option == RemovalOption.LOGOUT:
+            self.argv = list(LOGOUT_ARGV)
+
+    def validate(self) -> None:
+        if self.argv and not os.path.isfile(self.argv[0]):
+            raise ActuatorError(self.argv[0] + " not found")
+
+    def act(self) -> None:
+        if self.argv:
+            result = ACTIONS.run(self.argv, spawn=UserProcess)
+            if not result.ok:
+                log_message("Lock action failed: " + str(result))
+
+
+def build_actuator(removal_option: RemovalOption) -> WinActuator:
+    return WinActuator(removal_option)
+
+
 def lock_system(removal_option: RemovalOption) -> None:
-    # As the service will be running as System you require a session handle to interact with the Desktop logon
-    console_session_id = win32ts.WTSGetActiveConsoleSessionId()
-    console_user_token = win32ts.WTSQueryUserToken(console_session_id)
-    startup = win32process.STARTUPINFO()
-    priority = win32con.NORMAL_PRIORITY_CLASS
-    environment = win32profile.CreateEnvironmentBlock(console_user_token, False)
-
-    command = ""
-    if removal_option == RemovalOption.LOCK:
-        command = "\\Windows\\system32\\rundll32.exe user32.dll,LockWorkStation"
-    elif removal_option == RemovalOption.LOGOUT:
-        command = "\\Windows\\system32\\logoff.exe"
-
-    handle, thread_id, pid, tid = win32process.CreateProcessAsUser(
-        console_user_token,
-        None,
-        command,
-        None,
-        None,
-        True,
-        priority,
-        environment,
-        None,
-        startup,
-    )
+    actuator = build_actuator(removal_option)
+    try:
+        actuator.validate()
+    except ActuatorError as e:
+        log_message(str(e))
+    actuator.act()
 
 
 # Windows Service Class Definition
@@ -57,11 +125,15 @@ class AppServerSvc(win32serviceutil.ServiceFramework):
     def __init__(self, args) -> None:
         win32serviceutil.ServiceFramework.__init__(self, args)
         self.hWaitStop = win32event.CreateEvent(None, 0, 0, None)
+        self.yklocker = None
         socket.setdefaulttimeout(60)
 
     def SvcStop(self) -> None:
         self.ReportServiceStatus(win32service.SERVICE_STOP_PENDING)
         win32event.SetEvent(self.hWaitStop)
+        # Interrupt the wait between probes right away
+        if self.yklocker is not None:
+            self.yklocker.get_waker().stop()
 
     def SvcDoRun(self) -> None:
         servicemanager.LogMsg(
@@ -70,19 +142,22 @@ class AppServerSvc(win32serviceutil.ServiceFramework):
             (self._svc_name_, ""),
         )
         from sciber_yklocker.main import init_yklocker, loop_code
+        from sciber_yklocker.models.settings import Settings
 
         # instantiate a yklocker-object and start running the code
-        yklocker = init_yklocker(None, None)
+        yklocker = init_yklocker(Settings())
         yklocker.set_service_object(self)
+        self.yklocker = yklocker
 
         # To handle service interruptions etc, pass the win service class instance along
         loop_code(yklocker=yklocker)
 
 
 def check_service_interruption(serviceObject: AppServerSvc) -> bool:
-    # Check if hWaitStop has been issued
+    # Check if hWaitStop has been issued, without waiting as SvcStop also
+    # interrupts the wait between probes
     if (
-        win32event.WaitForSingleObject(serviceObject.hWaitStop, 5000)
+        win32event.WaitForSingleObject(serviceObject.hWaitStop, 0)
         == win32event.WAIT_OBJECT_0
     ):  # Then stop the loop
         return False
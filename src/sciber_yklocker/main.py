@@ -1,11 +1,40 @@
 import getopt
+import math
+import os
 import platform
 import sys
-from time import sleep
 
+from sciber_yklocker.actuator import ActuatorError
+from sciber_yklocker.control import (
+    COMMANDS,
+    ControlError,
+    close_control,
+    control_socket_path,
+    run_client,
+    serve_control,
+)
+from sciber_yklocker.journal import Journal, journal_dir, run_query
+from sciber_yklocker.metrics import MetricsExporter
 from sciber_yklocker.models.myos import MyOS
 from sciber_yklocker.models.removaloption import RemovalOption
+from sciber_yklocker.models.settings import Settings
+from sciber_yklocker.models.watchdog import StallPolicy
 from sciber_yklocker.models.yklock import YkLock
+from sciber_yklocker.probehelper import (
+    HELPER_ARG,
+    ProbeHelper,
+    helper_command,
+    helper_timeout,
+    run_helper,
+)
+from sciber_yklocker.profiling import (
+    PROFILE_ENV,
+    TRACEMALLOC_ENV,
+    AllocationTracer,
+    Profiler,
+    parse_profile_spec,
+)
+from sciber_yklocker.waker import WakeReason, install_signal_handlers
 
 # Import platform specific code
 if platform.system() == MyOS.WIN:
@@ -13,72 +42,305 @@ if platform.system() == MyOS.WIN:
         check_service_interruption,
         reg_check_removal_option,
         reg_check_timeout,
-        reg_check_updates,
         win_main,
     )
+elif platform.system() == MyOS.LX:
+    from sciber_yklocker.lib.dbus import DBusError
+    from sciber_yklocker.lib.lx import open_buses
+    from sciber_yklocker.lib.session import open_lock_watchers
+    from sciber_yklocker.lib.uevent import UeventWatcher
+
+if platform.system() == MyOS.LX or platform.system() == MyOS.MAC:
+    from sciber_yklocker.config import ConfigStore, config_paths
+    from sciber_yklocker.lib.filewatch import open_file_watcher
 
 
 # Function to handle interruption signals sent to the program
 def continue_looping(yklocker: YkLock) -> bool:
-    # Only the Windows service we need to check for incoming signals
+    # Stop requested by a signal handler or the Windows service
+    if yklocker.get_waker().stopped:
+        return False
+
     if platform.system() == MyOS.WIN:
         return check_service_interruption(yklocker.get_service_object())
 
     return True
 
 
+# Let YubiKey hotplug events interrupt the wait
+def watch_hotplug(yklocker: YkLock, hotplug_watcher) -> None:
+    def handle_hotplug() -> WakeReason | None:
+        if hotplug_watcher.drain():
+            return WakeReason.HOTPLUG
+        return None
+
+    yklocker.set_hotplug_watcher(hotplug_watcher)
+    yklocker.get_waker().add_source(hotplug_watcher, handle_hotplug)
+
+
+# Suspend probing while the session is locked, probe right away on unlock
+def watch_session_lock(yklocker: YkLock, lock_watchers: list) -> None:
+    def handle_lock_change(lock_watcher) -> WakeReason | None:
+        try:
+            changed = lock_watcher.drain()
+        except (OSError, DBusError) as e:
+            # The bus went away, fall back to probing as usual
+            yklocker.get_waker().remove_source(lock_watcher)
+            lock_watchers.remove(lock_watcher)
+            yklocker.logger("Session lock signals unavailable: " + str(e))
+            changed = True
+        if not changed:
+            return None
+        locked = any(watcher.locked for watcher in lock_watchers)
+        if locked == yklocker.get_session_locked():
+            return None
+        yklocker.set_session_locked(locked)
+        yklocker.record("session_locked" if locked else "session_unlocked")
+        if locked:
+            yklocker.logger("Session locked, probing suspended")
+            return None
+        yklocker.logger("Session unlocked, probing resumed")
+        return WakeReason.PROBE
+
+    for lock_watcher in lock_watchers:
+        yklocker.get_waker().add_source(
+            lock_watcher, lambda watcher=lock_watcher: handle_lock_change(watcher)
+        )
+    yklocker.set_session_locked(any(watcher.locked for watcher in lock_watchers))
+
+
+def watch_config(yklocker: YkLock, config_watcher) -> None:
+    def handle_config_change() -> WakeReason | None:
+        if config_watcher.drain():
+            return WakeReason.RELOAD
+        return None
+
+    yklocker.get_waker().add_source(config_watcher, handle_config_change)
+
+
+# Apply what changed in the config files, on SIGHUP or a file change
+def reload_config(yklocker: YkLock) -> None:
+    config = yklocker.get_config()
+    if config is None:
+        return
+    previous = config.settings
+    settings = config.load()
+    if settings == previous:
+        return
+
+    yklocker.apply_settings(settings, previous)
+    probe_helper = yklocker.get_probe_helper()
+    if probe_helper is not None:
+        probe_helper.set_command(helper_command(yklocker.get_serial_allowlist()))
+        probe_helper.timeout = helper_timeout(yklocker.get_probe_deadline())
+    for field in ("probe_helper", "metrics_file", "metrics_port", "journal"):
+        if getattr(settings, field) != getattr(previous, field):
+            yklocker.logger(f"Restart YubiKeyLocker to change {field}")
+    changed = [
+        field
+        for field in settings._fields
+        if getattr(settings, field) != getattr(previous, field)
+    ]
+    yklocker.record(
+        "config",
+        changed=changed,
+        removal_option=yklocker.get_removal_option(),
+        timeout=yklocker.get_timeout(),
+    )
+    yklocker.logger(
+        f"Reloaded settings, RemovalOption {yklocker.get_removal_option()} after {yklocker.get_timeout()} seconds without a detected YubiKey"
+    )
+
+
 def loop_code(yklocker: YkLock) -> None:
     # Print start messages
     message1 = f"Initiated YubiKeyLocker with RemovalOption {yklocker.get_removal_option()} after {yklocker.get_timeout()} seconds without a detected YubiKey"
 
     yklocker.logger(message1)
+    yklocker.record(
+        "started",
+        removal_option=yklocker.get_removal_option(),
+        timeout=yklocker.get_timeout(),
+    )
 
-    while continue_looping(yklocker):
-        sleep(yklocker.get_timeout())
+    # The probe loop, lock actions and wakeups run as asyncio tasks. asyncio
+    # is only imported here, the -z logging test does not need it
+    from sciber_yklocker.runtime import run_runtime
 
-        if platform.system() == MyOS.WIN:
-            # Check for any timeout or RemovalOption updates from the registry
-            reg_check_updates(yklocker)
+    # Status and commands for `yubikey-locker status`
+    control_server = None
+    control_socket = yklocker.get_control_socket()
+    if control_socket is not None:
+        try:
+            control_server = serve_control(yklocker, control_socket)
+        except (OSError, ControlError) as e:
+            yklocker.logger("Control socket unavailable: " + str(e))
 
-        if not yklocker.is_yubikey_connected():
-            locking_message = (
-                f"YubiKey not found, action to take: {yklocker.get_removal_option()}"
-            )
-            yklocker.logger(locking_message)
-            yklocker.lock()
+    run_runtime(yklocker, continue_looping, reload_config)
+
+    if control_server is not None:
+        close_control(control_server, control_socket)
+
+    if yklocker.get_probe_helper() is not None:
+        yklocker.get_probe_helper().stop()
+
+    if yklocker.get_journal() is not None:
+        yklocker.record("stopped")
+        try:
+            yklocker.get_journal().close()
+        except OSError as e:
+            yklocker.logger("Could not write the journal: " + str(e))
 
+    # Write the final numbers
+    if yklocker.get_metrics_exporter() is not None:
+        try:
+            yklocker.get_metrics_exporter().close()
+        except OSError as e:
+            yklocker.logger("Could not write the metrics file: " + str(e))
+    if yklocker.get_profiler() is not None:
+        try:
+            yklocker.get_profiler().dump()
+        except OSError as e:
+            yklocker.logger("Could not write the profile: " + str(e))
+    if yklocker.get_allocation_tracer() is not None:
+        try:
+            yklocker.get_allocation_tracer().dump()
+        except OSError as e:
+            yklocker.logger("Could not write the allocations: " + str(e))
+        yklocker.get_allocation_tracer().stop()
 
-def init_yklocker(removal_option: RemovalOption, timeout: int) -> YkLock:
+
+def init_yklocker(settings: Settings) -> YkLock:
     # Used order for settings
     # 1. Windows Registry
     # 2. CommandLine Arguments
-    # 3. Defaults
+    # 3. Config files on Linux and MacOS, the user's before the system's
+    # 4. Defaults
 
     # Create YkLock object with default settings
     yklocker = YkLock()
 
-    # Override defaults with CommandLine Arguments
-    if removal_option is not None:
-        yklocker.set_removal_option(removal_option)
+    if platform.system() == MyOS.LX or platform.system() == MyOS.MAC:
+        config = ConfigStore(config_paths(), yklocker.logger, settings)
+        settings = config.load()
+        yklocker.set_config(config)
+
+    # Override defaults with CommandLine Arguments and config files
+    yklocker.apply_settings(settings)
+
+    # Probe in a helper process, started with the allowlist set above
+    if settings.probe_helper:
+        command = helper_command(yklocker.get_serial_allowlist())
+        timeout = helper_timeout(yklocker.get_probe_deadline())
+        probe_helper = ProbeHelper(command, timeout=timeout)
+        yklocker.set_probe_helper(probe_helper)
+
+    # Export metrics to a file for node-exporter and/or over HTTP on localhost
+    if settings.metrics_file is not None or settings.metrics_port is not None:
+        metrics_port = settings.metrics_port
+        try:
+            exporter = MetricsExporter(
+                yklocker.metrics, settings.metrics_file, metrics_port
+            )
+        except OSError as e:
+            yklocker.logger("Metrics endpoint unavailable: " + str(e))
+            exporter = MetricsExporter(yklocker.metrics, settings.metrics_file)
+        yklocker.set_metrics_exporter(exporter)
+
+    # Structured history for `yubikey-locker events`
+    if settings.journal:
+        try:
+            yklocker.set_journal(Journal(journal_dir()))
+        except OSError as e:
+            yklocker.logger("Journal unavailable: " + str(e))
 
-    if timeout is not None:
-        yklocker.set_timeout(timeout)
+    # Time the loop's phases, from the command line or the environment
+    profile = settings.profile or os.environ.get(PROFILE_ENV)
+    if profile:
+        try:
+            yklocker.set_profiler(Profiler(*parse_profile_spec(profile)))
+        except ValueError as e:
+            yklocker.logger("Invalid profile, not profiling: " + str(e))
+    trace_allocations = settings.trace_allocations or os.environ.get(TRACEMALLOC_ENV)
+    if trace_allocations:
+        yklocker.set_allocation_tracer(AllocationTracer(trace_allocations))
+
+    # Answer `yubikey-locker status` on a per user socket
+    if platform.system() == MyOS.LX or platform.system() == MyOS.MAC:
+        yklocker.set_control_socket(settings.control_socket or control_socket_path())
 
     # If Windows - Check registry to override settings
     if platform.system() == MyOS.WIN:
         reg_check_timeout(yklocker)
         reg_check_removal_option(yklocker)
 
+    # If Linux - Wake up on YubiKey hotplug events instead of only polling
+    # and keep D-Bus connections open for the lock action
+    if platform.system() == MyOS.LX:
+        open_buses()
+        try:
+            watch_hotplug(yklocker, UeventWatcher())
+        except OSError as e:
+            yklocker.logger("Hotplug events unavailable, polling only: " + str(e))
+        lock_watchers, errors = open_lock_watchers()
+        if lock_watchers:
+            watch_session_lock(yklocker, lock_watchers)
+        elif errors:
+            yklocker.logger("Session lock signals unavailable: " + "; ".join(errors))
+
+    # Apply config file changes right away, without reading them every probe
+    if yklocker.get_config() is not None:
+        try:
+            watch_config(yklocker, open_file_watcher(yklocker.get_config().paths))
+        except OSError as e:
+            yklocker.logger("Config file changes unavailable: " + str(e))
+
+    # Resolve the lock action now, a removal then only has to perform it
+    try:
+        yklocker.prepare_actuator()
+    except ActuatorError as e:
+        removal_option = yklocker.get_removal_option()
+        yklocker.logger(f"Lock action {removal_option} can not work: {e}")
+        raise
+
     return yklocker
 
 
-def check_arguments() -> tuple[RemovalOption, int]:
+# Parse a non-negative number of seconds, fractions allowed
+def parse_seconds(arg: str) -> float | None:
+    try:
+        seconds = float(arg)
+    except ValueError:
+        return None
+    if not math.isfinite(seconds) or seconds < 0:
+        return None
+    return seconds
+
+
+def check_arguments() -> Settings:
     # Default values
     removal_option: RemovalOption = None
     timeout: int | any = None
+    serials: frozenset[int] | None = None
+    probe_interval: float | None = None
+    grace_period: float | None = None
+    required_misses: int | None = None
+    rearm_interval: float | None = None
+    max_interval: float | None = None
+    max_wakeups_per_hour: int | None = None
+    probe_deadline: float | None = None
+    stall_policy: StallPolicy | None = None
+    stalls_to_lock: int | None = None
+    probe_helper: bool | None = None
+    metrics_file: str | None = None
+    metrics_port: int | None = None
+    profile: str | None = None
+    trace_allocations: str | None = None
+    control_socket: str | None = None
+    journal: bool | None = None
 
     # Check arguments
-    opts, args = getopt.getopt(sys.argv[1:], "l:t:z")
+    opts, args = getopt.getopt(sys.argv[1:], "l:t:s:i:g:m:r:b:w:d:f:n:ox:p:jP:T:c:z")
     for opt, arg in opts:
         if opt == "-l":
             if arg == RemovalOption.LOGOUT:
@@ -94,6 +356,76 @@ def check_arguments() -> tuple[RemovalOption, int]:
                 timeout = int(arg)
             else:
                 print("Invalid Timeout entered, defaulting to 10s")
+        elif opt == "-s":
+            values = [value.strip() for value in arg.split(",")]
+            if all(value.isdecimal() for value in values):
+                serials = frozenset(int(value) for value in values)
+            else:
+                print("Invalid serial numbers entered, allowing any YubiKey")
+        elif opt == "-i":
+            probe_interval = parse_seconds(arg)
+            if probe_interval is None or probe_interval == 0:
+                probe_interval = None
+                print("Invalid probe interval entered, defaulting to the timeout")
+        elif opt == "-g":
+            grace_period = parse_seconds(arg)
+            if grace_period is None:
+                print("Invalid grace period entered, defaulting to 0s")
+        elif opt == "-m":
+            if arg.isdecimal() and int(arg) > 0:
+                required_misses = int(arg)
+            else:
+                print("Invalid number of misses entered, defaulting to 1")
+        elif opt == "-r":
+            rearm_interval = parse_seconds(arg)
+            if rearm_interval is None:
+                print("Invalid re-lock interval entered, acting once per removal")
+        elif opt == "-b":
+            max_interval = parse_seconds(arg)
+            if max_interval is None or max_interval == 0:
+                max_interval = None
+                print("Invalid backoff interval entered, not backing off")
+        elif opt == "-w":
+            if arg.isdecimal() and int(arg) > 0:
+                max_wakeups_per_hour = int(arg)
+            else:
+                print("Invalid wakeups per hour entered, not capping wakeups")
+        elif opt == "-d":
+            probe_deadline = parse_seconds(arg)
+            if probe_deadline is None or probe_deadline == 0:
+                probe_deadline = None
+                print("Invalid probe deadline entered, defaulting to 5s")
+        elif opt == "-f":
+            if arg in StallPolicy.__members__.values():
+                stall_policy = StallPolicy(arg)
+            else:
+                print("Invalid stall policy entered, defaulting to lock")
+        elif opt == "-n":
+            if arg.isdecimal() and int(arg) > 0:
+                stalls_to_lock = int(arg)
+            else:
+                print("Invalid number of stalls entered, defaulting to 3")
+        elif opt == "-o":
+            probe_helper = True
+        elif opt == "-x":
+            metrics_file = arg
+        elif opt == "-j":
+            journal = True
+        elif opt == "-p":
+            if arg.isdecimal() and 0 < int(arg) <= 65535:
+                metrics_port = int(arg)
+            else:
+                print("Invalid metrics port entered, not serving metrics over HTTP")
+        elif opt == "-P":
+            try:
+                parse_profile_spec(arg)
+                profile = arg
+            except ValueError:
+                print("Invalid profile entered, not profiling")
+        elif opt == "-T":
+            trace_allocations = arg
+        elif opt == "-c":
+            control_socket = arg
 
         elif opt == "-z":
             # Used for execution and logging test
@@ -101,17 +433,56 @@ def check_arguments() -> tuple[RemovalOption, int]:
             yklocker.logger("YubiKeyLocker test logging")
             sys.exit(0)
 
-    return removal_option, timeout
+    return Settings(
+        removal_option=removal_option,
+        timeout=timeout,
+        serials=serials,
+        probe_interval=probe_interval,
+        grace_period=grace_period,
+        required_misses=required_misses,
+        rearm_interval=rearm_interval,
+        max_interval=max_interval,
+        max_wakeups_per_hour=max_wakeups_per_hour,
+        probe_deadline=probe_deadline,
+        stall_policy=stall_policy,
+        stalls_to_lock=stalls_to_lock,
+        probe_helper=probe_helper,
+        metrics_file=metrics_file,
+        metrics_port=metrics_port,
+        journal=journal,
+        profile=profile,
+        trace_allocations=trace_allocations,
+        control_socket=control_socket,
+    )
 
 
 def main() -> None:
+    # Started by the locker itself to probe in a separate process
+    if sys.argv[1:2] == [HELPER_ARG]:
+        run_helper(sys.argv[2:])
     # If Windows, start a service based on the class AppServerSvc
-    if platform.system() == MyOS.WIN:
+    elif platform.system() == MyOS.WIN:
         win_main()
     # If LX or MAC, check arguments then initiate yklock object and then run code
     elif platform.system() == MyOS.LX or platform.system() == MyOS.MAC:
-        removal_option, timeout = check_arguments()
-        yklocker = init_yklocker(removal_option, timeout)
+        # yubikey-locker status and the other commands talk to a running locker
+        if sys.argv[1:2] and sys.argv[1] in COMMANDS:
+            sys.exit(run_client(sys.argv[1:]))
+        # yubikey-locker events reads the journal, the locker need not run
+        if sys.argv[1:2] == ["events"]:
+            sys.exit(run_query(sys.argv[2:]))
+        # yubikey-locker system runs one locker for all sessions, as root
+        if sys.argv[1:2] == ["system"] and platform.system() == MyOS.LX:
+            from sciber_yklocker.system import run_system
+
+            sys.exit(run_system(sys.argv[2:]))
+        settings = check_arguments()
+        try:
+            yklocker = init_yklocker(settings)
+        except ActuatorError as e:
+            print(f"Lock action can not work: {e}")
+            sys.exit(1)
+        install_signal_handlers(yklocker.get_waker())
         loop_code(yklocker=yklocker)
 
 
@@ -0,0 +1,253 @@
+import bisect
+import os
+import tempfile
+import threading
+import time
+from collections.abc import Callable
+
+from sciber_yklocker.models.presence import PresenceState
+from sciber_yklocker.models.removaloption import RemovalOption
+from sciber_yklocker.probehelper import current_rss
+
+# Metrics in the Prometheus text format, for node-exporter's textfile
+# collector or scraped over HTTP from localhost. Updating one only adds to a
+# number, the text is only built when it is written or scraped.
+
+# Seconds between writes of the metrics file
+WRITE_INTERVAL = 15
+# Seconds, probes usually take milliseconds and stall at PROBE_DEADLINE
+PROBE_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+# Seconds from noticing a removal until the action returned
+ACTION_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LISTEN_ADDRESS = "127.0.0.1"
+
+
+def format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        for value in labels.values()
+    )
+    pairs = ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped))
+    return "{" + pairs + "}"
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...]) -> None:
+        self.buckets = buckets
+        # Observations per bucket, the last one is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum: float = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def render(self, name: str, labels: dict[str, str]) -> list[str]:
+        lines = []
+        total = 0
+        for bound, count in zip((*self.buckets, "+Inf"), self.counts):
+            total += count
+            bucket_labels = format_labels({**labels, "le": str(bound)})
+            lines.append(f"{name}_bucket{bucket_labels} {total}")
+        lines.append(f"{name}_sum{format_labels(labels)} {self.sum}")
+        lines.append(f"{name}_count{format_labels(labels)} {total}")
+        return lines
+
+
+class LockerMetrics:
+    # Probes are counted on the event loop and actions on the action worker,
+    # each value only has one writer so no lock is needed
+    def __init__(
+        self,
+        rss: Callable[[], int] = current_rss,
+        clock: Callable[[], float] = time.time,
+        wakeups: Callable[[], int] = lambda: 0,
+    ) -> None:
+        self.rss = rss
+        self.clock = clock
+        # Loop wakeups in the last hour, from the poll schedule
+        self.wakeups = wakeups
+        self.probes = 0
+        self.probe_duration = Histogram(PROBE_BUCKETS)
+        self.probe_errors: dict[str, int] = {"stalled": 0, "helper": 0}
+        self.presence_state = PresenceState.UNKNOWN
+        self.removals = 0
+        self.actions = {option: 0 for option in RemovalOption}
+        self.action_latency = {
+            option: Histogram(ACTION_BUCKETS) for option in RemovalOption
+        }
+        # For the control socket's status, wall clock times
+        self.last_probe: float | None = None
+        self.last_probe_duration: float | None = None
+        self.last_probe_error: str | None = None
+        self.last_action: tuple[RemovalOption, float] | None = None
+
+    def probed(self, duration: float) -> None:
+        self.probes += 1
+        self.probe_duration.observe(duration)
+        self.last_probe = self.clock()
+        self.last_probe_duration = duration
+        self.last_probe_error = None
+
+    def probe_failed(self, reason: str) -> None:
+        self.probes += 1
+        self.probe_errors[reason] = self.probe_errors.get(reason, 0) + 1
+        self.last_probe = self.clock()
+        self.last_probe_duration = None
+        self.last_probe_error = reason
+
+    def presence(self, state: PresenceState) -> None:
+        self.presence_state = state
+
+    def removed(self) -> None:
+        self.removals += 1
+
+    def acted(self, removal_option: RemovalOption, latency: float) -> None:
+        self.actions[removal_option] += 1
+        self.action_latency[removal_option].observe(latency)
+        self.last_action = (removal_option, self.clock())
+
+    def render(self) -> str:
+        lines = [
+            "# HELP yklocker_probes_total YubiKey probes, including failed ones.",
+            "# TYPE yklocker_probes_total counter",
+            f"yklocker_probes_total {self.probes}",
+            "# HELP yklocker_probe_duration_seconds Duration of completed probes.",
+            "# TYPE yklocker_probe_duration_seconds histogram",
+            *self.probe_duration.render("yklocker_probe_duration_seconds", {}),
+            "# HELP yklocker_probe_errors_total Probes that stalled or failed.",
+            "# TYPE yklocker_probe_errors_total counter",
+        ]
+        for reason, count in self.probe_errors.items():
+            labels = format_labels({"reason": reason})
+            lines.append(f"yklocker_probe_errors_total{labels} {count}")
+
+        lines += [
+            "# HELP yklocker_presence_state Current YubiKey presence state.",
+            "# TYPE yklocker_presence_state gauge",
+        ]
+        for state in PresenceState:
+            labels = format_labels({"state": state.lower()})
+            value = int(state == self.presence_state)
+            lines.append(f"yklocker_presence_state{labels} {value}")
+
+        lines += [
+            "# HELP yklocker_removals_total YubiKey removals that were acted on.",
+            "# TYPE yklocker_removals_total counter",
+            f"yklocker_removals_total {self.removals}",
+            "# HELP yklocker_actions_total Removal actions performed.",
+            "# TYPE yklocker_actions_total counter",
+        ]
+        for option, count in self.actions.items():
+            labels = format_labels({"removal_option": option})
+            lines.append(f"yklocker_actions_total{labels} {count}")
+
+        lines += [
+            "# HELP yklocker_action_latency_seconds From noticing a removal until "
+            "the action returned.",
+            "# TYPE yklocker_action_latency_seconds histogram",
+        ]
+        for option, histogram in self.action_latency.items():
+            lines += histogram.render(
+                "yklocker_action_latency_seconds", {"removal_option": option}
+            )
+
+        lines += [
+            "# HELP yklocker_resident_memory_bytes Resident memory of the locker.",
+            "# TYPE yklocker_resident_memory_bytes gauge",
+            f"yklocker_resident_memory_bytes {self.rss()}",
+            "# HELP yklocker_wakeups_last_hour Probe loop wakeups in the last hour.",
+            "# TYPE yklocker_wakeups_last_hour gauge",
+            f"yklocker_wakeups_last_hour {self.wakeups()}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+class MetricsExporter:
+    # Writes the metrics file every interval seconds, and serves them over
+    # HTTP on localhost if a port is given
+    def __init__(
+        self,
+        metrics: LockerMetrics,
+        path: str | None = None,
+        port: int | None = None,
+        interval: float = WRITE_INTERVAL,
+    ) -> None:
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.last_write: float | None = None
+        self.server = None
+        if port is not None:
+            self.server = serve_metrics(metrics, port)
+
+    def write(self, path: str) -> None:
+        # The collector must never see half a file, write a copy and rename it
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temporary = tempfile.mkstemp(dir=directory, prefix=".yklocker-")
+        try:
+            with os.fdopen(fd, "w") as file:
+                file.write(self.metrics.render())
+            os.chmod(temporary, 0o644)
+            os.replace(temporary, path)
+        except OSError:
+            os.unlink(temporary)
+            raise
+
+    def update(self, now: float) -> None:
+        # Called every probe, only writes once the interval passed
+        if self.path is None:
+            return
+        if self.last_write is not None and now - self.last_write < self.interval:
+            return
+        self.last_write = now
+        self.write(self.path)
+
+    def close(self) -> None:
+        if self.path is not None:
+            self.write(self.path)
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+def serve_metrics(metrics: LockerMetrics, port: int):
+    # Only imported when asked for, http.server is slow to import
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args) -> None:
+            # Not every scrape in the system log
+            pass
+
+    server = ThreadingHTTPServer((LISTEN_ADDRESS, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,59 @@
+from collections.abc import Callable, Iterable
+
+# Most probes to wait before reading a YubiKey without a serial again
+RETRY_BACKOFF_MAX = 32
+
+
+class DeviceCache:
+    def __init__(self) -> None:
+        # USB fingerprint -> serial, only for YubiKeys that exposed one
+        self.devices: dict[str, int] = {}
+        # USB fingerprint -> (probes left before the next read, the backoff after
+        # that), for YubiKeys whose serial could not be read yet
+        self.retries: dict[str, tuple[int, int]] = {}
+
+    def refresh(
+        self,
+        fingerprints: Iterable[str],
+        read_serials: Callable[[], dict[str, int | None]],
+    ) -> None:
+        present = set(fingerprints)
+
+        # Evict YubiKeys that have been removed
+        for fingerprint in list(self.devices):
+            if fingerprint not in present:
+                del self.devices[fingerprint]
+        for fingerprint in list(self.retries):
+            if fingerprint not in present:
+                del self.retries[fingerprint]
+
+        # Only open devices when a new YubiKey has been inserted, or a failed
+        # read is due to be retried
+        due = set()
+        for fingerprint in present - self.devices.keys():
+            wait, backoff = self.retries.get(fingerprint, (0, 0))
+            if wait > 0:
+                self.retries[fingerprint] = (wait - 1, backoff)
+            else:
+                due.add(fingerprint)
+        if due:
+            serials = read_serials()
+            for fingerprint in due:
+                serial = serials.get(fingerprint)
+                if serial is not None:
+                    self.devices[fingerprint] = serial
+                    self.retries.pop(fingerprint, None)
+                else:
+                    # Read again on the next probe, then back off
+                    _, backoff = self.retries.get(fingerprint, (0, 0))
+                    self.retries[fingerprint] = (
+                        backoff,
+                        min(max(backoff * 2, 1), RETRY_BACKOFF_MAX),
+                    )
+
+    def serials(self) -> set[int]:
+        return set(self.devices.values())
+
+    def clear(self) -> None:
+        self.devices.clear()
+        self.retries.clear()
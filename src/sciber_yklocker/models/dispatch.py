@@ -0,0 +1,63 @@
+from enum import StrEnum  # StrEnum is python 3.11+
+
+from sciber_yklocker.models.presence import PresenceState
+
+# How often to log a summary while the YubiKey stays missing
+ABSENT_SUMMARY_INTERVAL = 300
+
+
+class DispatchEvent(StrEnum):
+    NONE = "None"
+    REMOVED = "Removed"
+    REARMED = "Rearmed"
+    STILL_ABSENT = "StillAbsent"
+    RETURNED = "Returned"
+
+
+class ActionDispatcher:
+    def __init__(self, rearm_interval: float = 0) -> None:
+        # Seconds before the action is repeated while still absent, 0 is never
+        self.rearm_interval = rearm_interval
+        self.absent_since: float | None = None
+        # Only used while absent_since is set
+        self.last_action: float = 0
+        self.last_summary: float = 0
+        # How long the last completed removal lasted
+        self.last_absence: float = 0
+
+    def absent_for(self, now: float) -> float:
+        if self.absent_since is None:
+            return 0
+        return now - self.absent_since
+
+    def update(self, state: PresenceState, now: float) -> DispatchEvent:
+        if state != PresenceState.ABSENT:
+            # Suspect keeps the removal going, it might just be a hub reset
+            if state == PresenceState.PRESENT and self.absent_since is not None:
+                self.last_absence = now - self.absent_since
+                self.reset()
+                return DispatchEvent.RETURNED
+            return DispatchEvent.NONE
+
+        # Only the edge into absent fires the action
+        if self.absent_since is None:
+            self.absent_since = now
+            self.last_action = now
+            self.last_summary = now
+            return DispatchEvent.REMOVED
+
+        if self.rearm_interval > 0 and now - self.last_action >= self.rearm_interval:
+            self.last_action = now
+            self.last_summary = now
+            return DispatchEvent.REARMED
+
+        if now - self.last_summary >= ABSENT_SUMMARY_INTERVAL:
+            self.last_summary = now
+            return DispatchEvent.STILL_ABSENT
+
+        return DispatchEvent.NONE
+
+    def reset(self) -> None:
+        self.absent_since = None
+        self.last_action = 0
+        self.last_summary = 0
@@ -0,0 +1,47 @@
+from typing import NamedTuple
+
+from sciber_yklocker.models.removaloption import RemovalOption
+
+
+# One step of an escalation chain, either a removal option or a command,
+# after the YubiKey has been missing for after seconds
+class EscalationStep(NamedTuple):
+    after: float
+    removal_option: RemovalOption | None = None
+    command: tuple[str, ...] | None = None
+
+    def describe(self) -> str:
+        if self.removal_option is not None:
+            return f"{self.removal_option} after {self.after:g} s"
+        return f"{' '.join(self.command or ())} after {self.after:g} s"
+
+
+def is_escalation_step(value) -> bool:
+    # {after = 5, action = "Lock"} or {after = 3600, command = ["notify"]}
+    if not isinstance(value, dict) or not set(value) <= {"after", "action", "command"}:
+        return False
+    after = value.get("after")
+    if isinstance(after, bool) or not isinstance(after, (int, float)) or after < 0:
+        return False
+    if ("action" in value) == ("command" in value):
+        return False
+    if "action" in value:
+        return value["action"] in RemovalOption.__members__.values()
+    command = value["command"]
+    return (
+        isinstance(command, list)
+        and len(command) > 0
+        and all(isinstance(arg, str) and arg != "" for arg in command)
+    )
+
+
+def parse_escalation(steps: list[dict]) -> tuple[EscalationStep, ...]:
+    parsed = [
+        EscalationStep(
+            step["after"],
+            RemovalOption(step["action"]) if "action" in step else None,
+            tuple(step["command"]) if "command" in step else None,
+        )
+        for step in steps
+    ]
+    return tuple(sorted(parsed, key=lambda step: step.after))
@@ -0,0 +1,43 @@
+from enum import StrEnum  # StrEnum is python 3.11+
+
+# Probe interval while a possible removal is being confirmed
+CONFIRM_INTERVAL = 0.25
+
+
+class PresenceState(StrEnum):
+    UNKNOWN = "Unknown"
+    PRESENT = "Present"
+    SUSPECT = "Suspect"
+    ABSENT = "Absent"
+
+
+class PresenceTracker:
+    def __init__(self, grace_period: float = 0, required_misses: int = 1) -> None:
+        # A removal is only confirmed after required_misses probes in a row
+        # that together span at least grace_period seconds
+        self.grace_period = grace_period
+        self.required_misses = required_misses
+        self.state = PresenceState.UNKNOWN
+        self.misses = 0
+        self.missing_since: float | None = None
+
+    def update(self, connected: bool, now: float) -> PresenceState:
+        if connected:
+            self.state = PresenceState.PRESENT
+            self.misses = 0
+            self.missing_since = None
+            return self.state
+
+        self.misses += 1
+        if self.missing_since is None:
+            self.missing_since = now
+
+        if (
+            self.misses >= self.required_misses
+            and now - self.missing_since >= self.grace_period
+        ):
+            self.state = PresenceState.ABSENT
+        elif self.state != PresenceState.ABSENT:
+            self.state = PresenceState.SUSPECT
+
+        return self.state
@@ -0,0 +1,80 @@
+import math
+from collections import deque
+from collections.abc import Callable
+
+from sciber_yklocker.models.presence import PresenceState
+
+# On battery a stable YubiKey is probed at most this much less often
+BATTERY_FACTOR = 2
+# How long the power source reading is reused
+POWER_CHECK_INTERVAL = 60
+# Longer delays end on a whole multiple of this, so wakeups coalesce with
+# other timers on the system instead of being spread out
+COALESCE_GRANULARITY = 1.0
+COALESCE_MIN_DELAY = 5
+
+
+class PollSchedule:
+    def __init__(
+        self,
+        max_interval: float | None = None,
+        max_wakeups_per_hour: int | None = None,
+        on_battery: Callable[[], bool] = lambda: False,
+    ) -> None:
+        # None keeps probing every interval, otherwise back off up to max_interval
+        self.max_interval = max_interval
+        self.max_wakeups_per_hour = max_wakeups_per_hour
+        self.on_battery = on_battery
+        self.backoff = 1
+        self.last_state: PresenceState | None = None
+        self.battery: bool = False
+        self.battery_expires: float = -math.inf
+        self.wakeups: deque[float] = deque()
+
+    def note_activity(self) -> None:
+        # Something happened, probe fast again
+        self.backoff = 1
+
+    def note_wakeup(self, now: float) -> None:
+        self.wakeups.append(now)
+        while self.wakeups and now - self.wakeups[0] > 3600:
+            self.wakeups.popleft()
+
+    def wakeups_last_hour(self) -> int:
+        return len(self.wakeups)
+
+    def is_on_battery(self, now: float) -> bool:
+        if now >= self.battery_expires:
+            self.battery = self.on_battery()
+            self.battery_expires = now + POWER_CHECK_INTERVAL
+        return self.battery
+
+    def next_delay(self, interval: float, state: PresenceState, now: float) -> float:
+        if state != self.last_state:
+            self.note_activity()
+            self.last_state = state
+
+        # Confirming a removal is short lived, never delay it
+        if state == PresenceState.SUSPECT:
+            return interval
+
+        delay = interval
+        if state == PresenceState.PRESENT:
+            # Without max_interval only the battery lets the delay grow
+            ceiling = interval if self.max_interval is None else self.max_interval
+            if self.is_on_battery(now):
+                ceiling *= BATTERY_FACTOR
+            delay = min(interval * self.backoff, max(ceiling, interval))
+            if delay < ceiling:
+                self.backoff *= 2
+
+        if self.max_wakeups_per_hour:
+            delay = max(delay, 3600 / self.max_wakeups_per_hour)
+
+        return self.align(delay, now)
+
+    def align(self, delay: float, now: float) -> float:
+        if delay < COALESCE_MIN_DELAY:
+            return delay
+        deadline = math.ceil((now + delay) / COALESCE_GRANULARITY)
+        return deadline * COALESCE_GRANULARITY - now
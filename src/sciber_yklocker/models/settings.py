@@ -0,0 +1,70 @@
+from typing import NamedTuple
+
+from sciber_yklocker.models.escalation import EscalationStep
+from sciber_yklocker.models.removaloption import RemovalOption
+from sciber_yklocker.models.watchdog import PROBE_DEADLINE, STALLS_TO_LOCK, StallPolicy
+
+
+# Settings from the command line or a config file, None means not set
+class Settings(NamedTuple):
+    removal_option: RemovalOption | None = None
+    timeout: int | None = None
+    serials: frozenset[int] | None = None
+    probe_interval: float | None = None
+    grace_period: float | None = None
+    required_misses: int | None = None
+    rearm_interval: float | None = None
+    max_interval: float | None = None
+    max_wakeups_per_hour: int | None = None
+    probe_deadline: float | None = None
+    stall_policy: StallPolicy | None = None
+    stalls_to_lock: int | None = None
+    probe_helper: bool | None = None
+    metrics_file: str | None = None
+    metrics_port: int | None = None
+    journal: bool | None = None
+    # Steps instead of the single removal option, see models.escalation
+    escalation: tuple[EscalationStep, ...] | None = None
+    # Command line or environment only, see profiling.parse_profile_spec
+    profile: str | None = None
+    # Command line or environment only, file to write allocation sites to
+    trace_allocations: str | None = None
+    # Command line only, defaults to control.control_socket_path()
+    control_socket: str | None = None
+
+
+# What an unset setting falls back to, None here means off
+DEFAULT_SETTINGS = Settings(
+    removal_option=RemovalOption.NOTHING,
+    timeout=10,
+    serials=frozenset(),
+    probe_interval=None,
+    grace_period=0,
+    required_misses=1,
+    rearm_interval=0,
+    max_interval=None,
+    max_wakeups_per_hour=None,
+    probe_deadline=PROBE_DEADLINE,
+    stall_policy=StallPolicy.LOCK,
+    stalls_to_lock=STALLS_TO_LOCK,
+    probe_helper=False,
+    metrics_file=None,
+    metrics_port=None,
+    journal=False,
+    escalation=(),
+    profile=None,
+    trace_allocations=None,
+    control_socket=None,
+)
+
+
+def merge_settings(*snapshots: Settings) -> Settings:
+    # The first snapshot that sets a value wins
+    values = {}
+    for field in Settings._fields:
+        for snapshot in snapshots:
+            value = getattr(snapshot, field)
+            if value is not None:
+                values[field] = value
+                break
+    return Settings(**values)
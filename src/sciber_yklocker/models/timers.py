@@ -0,0 +1,57 @@
+import heapq
+import itertools
+
+
+class Timer:
+    __slots__ = ("deadline", "payload", "cancelled")
+
+    def __init__(self, deadline: float, payload) -> None:
+        self.deadline = deadline
+        self.payload = payload
+        self.cancelled = False
+
+
+class TimerHeap:
+    # Deadlines on the loop's monotonic clock. Cancelling only marks the
+    # timer, it is dropped once it reaches the top, so the loop only ever
+    # looks at the next deadline however many are pending.
+    def __init__(self) -> None:
+        self.heap: list[tuple[float, int, Timer]] = []
+        # Keeps timers with the same deadline in the order they were added
+        self.counter = itertools.count()
+        self.pending = 0
+
+    def __len__(self) -> int:
+        return self.pending
+
+    def schedule(self, deadline: float, payload) -> Timer:
+        timer = Timer(deadline, payload)
+        heapq.heappush(self.heap, (deadline, next(self.counter), timer))
+        self.pending += 1
+        return timer
+
+    def cancel(self, timer: Timer) -> None:
+        if not timer.cancelled:
+            timer.cancelled = True
+            self.pending -= 1
+
+    def drop_cancelled(self) -> None:
+        while self.heap and self.heap[0][2].cancelled:
+            heapq.heappop(self.heap)
+
+    def next_deadline(self) -> float | None:
+        self.drop_cancelled()
+        if not self.heap:
+            return None
+        return self.heap[0][0]
+
+    def pop_due(self, now: float) -> list:
+        due = []
+        self.drop_cancelled()
+        while self.heap and self.heap[0][0] <= now:
+            _, _, timer = heapq.heappop(self.heap)
+            timer.cancelled = True
+            self.pending -= 1
+            due.append(timer.payload)
+            self.drop_cancelled()
+        return due
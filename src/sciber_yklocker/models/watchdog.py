@@ -0,0 +1,54 @@
+from collections import deque
+from enum import StrEnum  # StrEnum is python 3.11+
+
+# Seconds a probe may take before it counts as stalled
+PROBE_DEADLINE = 5
+# Stalls in a row before the LOCK policy treats the YubiKey as absent
+STALLS_TO_LOCK = 3
+# Probe durations kept for statistics
+DURATION_HISTORY = 100
+
+
+class StallPolicy(StrEnum):
+    ABSENT = "absent"
+    PRESENT = "present"
+    LOCK = "lock"
+
+
+class ProbeWatchdog:
+    def __init__(
+        self,
+        deadline: float = PROBE_DEADLINE,
+        policy: StallPolicy = StallPolicy.LOCK,
+        stalls_to_lock: int = STALLS_TO_LOCK,
+    ) -> None:
+        self.deadline = deadline
+        self.policy = policy
+        self.stalls_to_lock = stalls_to_lock
+        # Stalls since the last probe that finished in time
+        self.stalls = 0
+        self.total_stalls = 0
+        self.durations: deque[float] = deque(maxlen=DURATION_HISTORY)
+        self.max_duration: float = 0
+
+    def completed(self, duration: float) -> None:
+        self.stalls = 0
+        self.durations.append(duration)
+        self.max_duration = max(self.max_duration, duration)
+
+    def stalled(self) -> bool:
+        # Returns whether to treat the YubiKey as connected
+        self.stalls += 1
+        self.total_stalls += 1
+        if self.policy == StallPolicy.ABSENT:
+            return False
+        if self.policy == StallPolicy.PRESENT:
+            return True
+        return self.stalls < self.stalls_to_lock
+
+    def percentile(self, fraction: float) -> float:
+        if not self.durations:
+            return 0
+        # Read from the control socket's threads, copying is atomic
+        durations = sorted(self.durations.copy())
+        return durations[min(len(durations) - 1, int(fraction * len(durations)))]
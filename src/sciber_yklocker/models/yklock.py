@@ -1,28 +1,127 @@
+import os
 import platform
 
-# Yubikey imports
-from ykman.device import list_all_devices  # , scan_devices
-
+from sciber_yklocker.actuator import Actuator, ActuatorError
+from sciber_yklocker.lib.sysfs import (
+    SYSFS_USB_ROOT,
+    hidraw_usb_device,
+    list_yubico_devices,
+    on_battery,
+    usb_fingerprint,
+)
+from sciber_yklocker.metrics import LockerMetrics
+from sciber_yklocker.models.devicecache import DeviceCache
+from sciber_yklocker.models.dispatch import ActionDispatcher, DispatchEvent
+from sciber_yklocker.models.escalation import EscalationStep
 from sciber_yklocker.models.myos import MyOS
+from sciber_yklocker.models.presence import PresenceState, PresenceTracker
 from sciber_yklocker.models.removaloption import RemovalOption
+from sciber_yklocker.models.schedule import PollSchedule
+from sciber_yklocker.models.settings import DEFAULT_SETTINGS, Settings
+from sciber_yklocker.models.timers import Timer, TimerHeap
+from sciber_yklocker.models.watchdog import ProbeWatchdog, StallPolicy
+from sciber_yklocker.waker import Waker
 
 # Import platform specific code
 if platform.system() == MyOS.WIN:
-    from sciber_yklocker.lib.win import lock_system, log_message
+    from sciber_yklocker.lib.win import build_actuator, log_message
 
 elif platform.system() == MyOS.LX:
-    from sciber_yklocker.lib.lx import lock_system, log_message
+    from sciber_yklocker.lib.lx import build_actuator, log_message
 
 elif platform.system() == MyOS.MAC:
-    from sciber_yklocker.lib.mac import lock_system, log_message
+    from sciber_yklocker.lib.mac import build_actuator, log_message
+
+
+# ykman and its dependencies are slow to import, they are only loaded once
+# the first probe needs them so starting the locker stays fast
+def list_all_devices():
+    import ykman.device
+
+    return ykman.device.list_all_devices()
+
+
+def list_ctap_devices():
+    import ykman.hid
+
+    return ykman.hid.list_ctap_devices()
+
+
+def read_info(connection, pid):
+    import yubikit.support
+
+    return yubikit.support.read_info(connection, pid)
+
+
+# Setting -> YkLock setter, the probe helper and metrics exporter are set
+# up by init_yklocker
+SETTERS = {
+    "removal_option": "set_removal_option",
+    "timeout": "set_timeout",
+    "serials": "set_serial_allowlist",
+    "probe_interval": "set_probe_interval",
+    "grace_period": "set_grace_period",
+    "required_misses": "set_required_misses",
+    "rearm_interval": "set_rearm_interval",
+    "max_interval": "set_max_interval",
+    "max_wakeups_per_hour": "set_max_wakeups_per_hour",
+    "probe_deadline": "set_probe_deadline",
+    "stall_policy": "set_stall_policy",
+    "stalls_to_lock": "set_stalls_to_lock",
+    "escalation": "set_escalation",
+}
 
 
 class YkLock:
     def __init__(self) -> None:
         # Set default values
         self.timeout: int = 10
+        # None means probe every timeout seconds
+        self.probe_interval: float | None = None
+        self.presence = PresenceTracker()
+        self.dispatcher = ActionDispatcher()
+        # Monotonic time until which removals are not acted on, set from the
+        # control socket
+        self.paused_until: float | None = None
+        # Steps taken one after the other while the YubiKey stays missing,
+        # instead of the removal option. The loop sleeps until the next one.
+        self.escalation: tuple[EscalationStep, ...] = ()
+        self.timers = TimerHeap()
+        self.escalation_timers: list[Timer] = []
+        self.escalation_actuators: dict[RemovalOption, Actuator] = {}
+        self.schedule = PollSchedule()
+        self.watchdog = ProbeWatchdog()
         self.removal_option: RemovalOption = RemovalOption.NOTHING
+        # Built for the current removal option by prepare_actuator()
+        self.actuator: Actuator | None = None
         self.service_object = None
+        self.hotplug_watcher = None
+        # Set from D-Bus signals, probing is suspended while it is locked
+        self.session_locked = False
+        self.waker: Waker | None = None
+        # sysfs is only available on Linux, other platforms always ask ykman
+        self.sysfs_root: str | None = None
+        if platform.system() == MyOS.LX:
+            self.sysfs_root = SYSFS_USB_ROOT
+            self.schedule.on_battery = on_battery
+        # If set, only YubiKeys with these serial numbers count as connected
+        self.serial_allowlist: frozenset[int] = frozenset()
+        self.device_cache = DeviceCache()
+        # If set, devices are probed in a helper process instead
+        self.probe_helper = None
+        # Config files on Linux and MacOS, see config.ConfigStore
+        self.config = None
+        # Always counted, only exported if a metrics file or port is set
+        self.metrics = LockerMetrics(wakeups=self.schedule.wakeups_last_hour)
+        self.metrics_exporter = None
+        # Set with -P or YKLOCKER_PROFILE, see profiling.Profiler
+        self.profiler = None
+        # Set with -T or YKLOCKER_TRACEMALLOC, see profiling.AllocationTracer
+        self.allocation_tracer = None
+        # Linux and MacOS, see control.serve_control
+        self.control_socket: str | None = None
+        # Set with -j or journal = true, see journal.Journal
+        self.journal = None
 
     def get_timeout(self) -> int:
         return self.timeout
@@ -32,6 +131,158 @@ class YkLock:
             if timeout > 0:
                 self.timeout = timeout
 
+    def get_probe_interval(self) -> float:
+        if self.probe_interval is None:
+            return self.get_timeout()
+        return self.probe_interval
+
+    def set_probe_interval(self, probe_interval: float | None) -> None:
+        # None probes every timeout seconds again
+        if probe_interval is None:
+            self.probe_interval = None
+        elif isinstance(probe_interval, (int, float)):
+            if probe_interval > 0:
+                self.probe_interval = probe_interval
+
+    def get_grace_period(self) -> float:
+        return self.presence.grace_period
+
+    def set_grace_period(self, grace_period: float) -> None:
+        if isinstance(grace_period, (int, float)):
+            if grace_period >= 0:
+                self.presence.grace_period = grace_period
+
+    def get_required_misses(self) -> int:
+        return self.presence.required_misses
+
+    def set_required_misses(self, required_misses: int) -> None:
+        if isinstance(required_misses, int):
+            if required_misses > 0:
+                self.presence.required_misses = required_misses
+
+    def get_presence_state(self) -> PresenceState:
+        return self.presence.state
+
+    def update_presence(self, connected: bool, now: float) -> PresenceState:
+        state = self.presence.update(connected, now)
+        self.metrics.presence(state)
+        return state
+
+    def get_rearm_interval(self) -> float:
+        return self.dispatcher.rearm_interval
+
+    def set_rearm_interval(self, rearm_interval: float) -> None:
+        if isinstance(rearm_interval, (int, float)):
+            if rearm_interval >= 0:
+                self.dispatcher.rearm_interval = rearm_interval
+
+    def get_max_interval(self) -> float | None:
+        return self.schedule.max_interval
+
+    def set_max_interval(self, max_interval: float | None) -> None:
+        if max_interval is None:
+            self.schedule.max_interval = None
+        elif isinstance(max_interval, (int, float)):
+            if max_interval > 0:
+                self.schedule.max_interval = max_interval
+
+    def get_max_wakeups_per_hour(self) -> int | None:
+        return self.schedule.max_wakeups_per_hour
+
+    def set_max_wakeups_per_hour(self, max_wakeups_per_hour: int | None) -> None:
+        if max_wakeups_per_hour is None:
+            self.schedule.max_wakeups_per_hour = None
+        elif isinstance(max_wakeups_per_hour, int):
+            if max_wakeups_per_hour > 0:
+                self.schedule.max_wakeups_per_hour = max_wakeups_per_hour
+
+    def get_probe_deadline(self) -> float:
+        return self.watchdog.deadline
+
+    def set_probe_deadline(self, probe_deadline: float) -> None:
+        if isinstance(probe_deadline, (int, float)):
+            if probe_deadline > 0:
+                self.watchdog.deadline = probe_deadline
+
+    def get_stall_policy(self) -> StallPolicy:
+        return self.watchdog.policy
+
+    def set_stall_policy(self, stall_policy: StallPolicy) -> None:
+        if stall_policy in StallPolicy.__members__.values():
+            self.watchdog.policy = StallPolicy(stall_policy)
+
+    def get_stalls_to_lock(self) -> int:
+        return self.watchdog.stalls_to_lock
+
+    def set_stalls_to_lock(self, stalls_to_lock: int) -> None:
+        if isinstance(stalls_to_lock, int):
+            if stalls_to_lock > 0:
+                self.watchdog.stalls_to_lock = stalls_to_lock
+
+    def apply_settings(
+        self, settings: Settings, previous: Settings | None = None
+    ) -> None:
+        # Apply what is set, or with a previous snapshot, what changed since.
+        # A setting that was removed goes back to its default.
+        for field, setter in SETTERS.items():
+            value = getattr(settings, field)
+            if previous is not None:
+                if value == getattr(previous, field):
+                    continue
+                if value is None:
+                    value = getattr(DEFAULT_SETTINGS, field)
+            elif value is None:
+                continue
+            getattr(self, setter)(value)
+
+    def dispatch(self, state: PresenceState, now: float) -> DispatchEvent:
+        paused_until = self.paused_until
+        if paused_until is not None:
+            if now < paused_until:
+                # Start over when the pause ends, a YubiKey that is still
+                # missing then is a new removal
+                self.dispatcher.reset()
+                self.cancel_escalation()
+                return DispatchEvent.NONE
+            self.paused_until = None
+        event = self.dispatcher.update(state, now)
+        if event == DispatchEvent.REMOVED and self.escalation:
+            self.start_escalation(now)
+        elif event == DispatchEvent.RETURNED:
+            self.cancel_escalation()
+        return event
+
+    def get_escalation(self) -> tuple[EscalationStep, ...]:
+        return self.escalation
+
+    def set_escalation(self, escalation) -> None:
+        # Applies from the next removal on
+        self.escalation = tuple(escalation)
+
+    def start_escalation(self, now: float) -> None:
+        self.cancel_escalation()
+        self.escalation_timers = [
+            self.timers.schedule(now + step.after, step) for step in self.escalation
+        ]
+
+    def cancel_escalation(self) -> None:
+        for timer in self.escalation_timers:
+            self.timers.cancel(timer)
+        self.escalation_timers = []
+
+    def pause(self, seconds: float, now: float) -> None:
+        # Only sets the time, the loop resets the dispatcher itself
+        self.paused_until = now + seconds
+
+    def resume(self) -> None:
+        self.paused_until = None
+
+    def paused_for(self, now: float) -> float:
+        paused_until = self.paused_until
+        if paused_until is None:
+            return 0
+        return max(0, paused_until - now)
+
     def get_removal_option(self) -> RemovalOption:
         return self.removal_option
 
@@ -45,14 +296,177 @@ class YkLock:
     def set_service_object(self, service_object) -> None:
         self.service_object = service_object
 
+    def get_waker(self) -> Waker:
+        # Created on first use, anything that should interrupt a wait uses it
+        if self.waker is None:
+            self.waker = Waker()
+        return self.waker
+
+    def get_hotplug_watcher(self):
+        return self.hotplug_watcher
+
+    def set_hotplug_watcher(self, hotplug_watcher) -> None:
+        self.hotplug_watcher = hotplug_watcher
+
+    def get_session_locked(self) -> bool:
+        return self.session_locked
+
+    def set_session_locked(self, session_locked: bool) -> None:
+        self.session_locked = session_locked
+
+    def get_sysfs_root(self) -> str | None:
+        return self.sysfs_root
+
+    def set_sysfs_root(self, sysfs_root: str | None) -> None:
+        self.sysfs_root = sysfs_root
+
+    def get_serial_allowlist(self) -> frozenset[int]:
+        return self.serial_allowlist
+
+    def set_serial_allowlist(self, serials) -> None:
+        if all(isinstance(serial, int) for serial in serials):
+            self.serial_allowlist = frozenset(serials)
+
+    def get_config(self):
+        return self.config
+
+    def set_config(self, config) -> None:
+        self.config = config
+
+    def get_probe_helper(self):
+        return self.probe_helper
+
+    def set_probe_helper(self, probe_helper) -> None:
+        self.probe_helper = probe_helper
+
+    def get_metrics_exporter(self):
+        return self.metrics_exporter
+
+    def set_metrics_exporter(self, metrics_exporter) -> None:
+        self.metrics_exporter = metrics_exporter
+
+    def get_profiler(self):
+        return self.profiler
+
+    def set_profiler(self, profiler) -> None:
+        self.profiler = profiler
+
+    def get_allocation_tracer(self):
+        return self.allocation_tracer
+
+    def set_allocation_tracer(self, allocation_tracer) -> None:
+        self.allocation_tracer = allocation_tracer
+
+    def get_control_socket(self) -> str | None:
+        return self.control_socket
+
+    def set_control_socket(self, control_socket: str | None) -> None:
+        self.control_socket = control_socket
+
+    def get_journal(self):
+        return self.journal
+
+    def set_journal(self, journal) -> None:
+        self.journal = journal
+
+    def record(self, event: str, **fields) -> None:
+        # Structured history next to the log messages, if journaling
+        if self.journal is not None:
+            self.journal.record(event, **fields)
+
+    def has_sysfs(self) -> bool:
+        return self.sysfs_root is not None and os.path.isdir(self.sysfs_root)
+
+    def prepare_actuator(self) -> Actuator:
+        # Resolve everything the removal option needs, raises ActuatorError
+        # if it can not work
+        actuator = build_actuator(self.get_removal_option())
+        actuator.validate()
+        self.actuator = actuator
+        return actuator
+
+    def get_actuator(self) -> Actuator:
+        actuator = self.actuator
+        if actuator is None or actuator.removal_option != self.get_removal_option():
+            # The removal option changed since startup
+            try:
+                actuator = self.prepare_actuator()
+            except ActuatorError as e:
+                self.logger(f"Lock action {self.get_removal_option()} may fail: {e}")
+                actuator = build_actuator(self.get_removal_option())
+                self.actuator = actuator
+        return actuator
+
     def lock(self) -> None:
         if self.get_removal_option() != RemovalOption.NOTHING:
-            lock_system(self.get_removal_option())
+            self.get_actuator().act()
+
+    def act_on(self, removal_option: RemovalOption) -> None:
+        # An escalation step, its actuator is kept for the next removal
+        if removal_option == RemovalOption.NOTHING:
+            return
+        actuator = self.escalation_actuators.get(removal_option)
+        if actuator is None:
+            actuator = build_actuator(removal_option)
+            try:
+                actuator.validate()
+            except ActuatorError as e:
+                self.logger(f"Lock action {removal_option} may fail: {e}")
+            self.escalation_actuators[removal_option] = actuator
+        actuator.act()
 
     def logger(self, msg: str) -> None:
         log_message(msg)
 
+    def list_device_fingerprints(self) -> list[str]:
+        # Neither sysfs nor listing HID descriptors opens a device
+        if self.has_sysfs():
+            return [
+                usb_fingerprint(name, self.sysfs_root)
+                for name in list_yubico_devices(self.sysfs_root)
+            ]
+        return [device.fingerprint for device in list_ctap_devices()]
+
+    def read_serials(self) -> dict[str, int | None]:
+        serials = {}
+        # Only FIDO HID is opened so CCID, and with it gpg, is never touched
+        for device in list_ctap_devices():
+            fingerprint = device.fingerprint
+            if self.has_sysfs():
+                # Key the device by its USB bus path, the same as the sysfs probe
+                name = hidraw_usb_device(fingerprint)
+                if name is None:
+                    continue
+                fingerprint = usb_fingerprint(name, self.sysfs_root)
+
+            from yubikit.core.fido import FidoConnection
+
+            try:
+                with device.open_connection(FidoConnection) as connection:
+                    serials[fingerprint] = read_info(connection, device.pid).serial
+            except Exception as e:
+                self.logger("Error when attempting to read a YubiKey serial: " + str(e))
+
+        return serials
+
     def is_yubikey_connected(self) -> bool:
+        # Ask the helper process if there is one, it raises ProbeHelperError
+        if self.probe_helper is not None:
+            return self.probe_helper.probe()
+        return self.probe_devices()
+
+    def probe_devices(self) -> bool:
+        # Only allowed YubiKeys count, identities are read once per insertion
+        if self.serial_allowlist:
+            fingerprints = self.list_device_fingerprints()
+            self.device_cache.refresh(fingerprints, self.read_serials)
+            return not self.serial_allowlist.isdisjoint(self.device_cache.serials())
+
+        # Cheap first tier, only reads USB ids and never opens a device
+        if self.has_sysfs():
+            return len(list_yubico_devices(self.sysfs_root)) > 0
+
+        # Fall back to ykman which opens every YubiKey interface
         devices = list_all_devices()
         if len(devices) == 0:
             return False
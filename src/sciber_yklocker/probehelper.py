@@ -0,0 +1,236 @@
+import getopt
+import json
+import os
+import platform
+import queue
+import signal
+import struct
+import subprocess
+import sys
+import threading
+
+from sciber_yklocker.models.myos import MyOS
+from sciber_yklocker.models.watchdog import PROBE_DEADLINE
+
+# Probing in a separate process, so a leak, crash or hang in ykman and the
+# USB/smartcard stack below it can not take the locker down with it.
+# Messages are JSON objects, each prefixed with its length (4 bytes, big endian).
+
+HELPER_ARG = "--probe-helper"
+# Restart the helper after this many probes ...
+HELPER_MAX_PROBES = 1000
+# ... or once it uses more memory than this (bytes)
+HELPER_MAX_RSS = 100 * 1024 * 1024
+# Seconds to wait for the helper to exit on its own before killing it
+HELPER_EXIT_TIMEOUT = 1
+# The helper gives up this long before the probe deadline, so a hung probe
+# is reported once by the helper instead of also stalling the loop
+HELPER_TIMEOUT_MARGIN = 0.5
+
+HEADER = struct.Struct(">I")
+MAX_MESSAGE_SIZE = 65536
+
+
+class ProbeHelperError(Exception):
+    pass
+
+
+def read_exactly(stream, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def write_message(stream, message: dict) -> None:
+    data = json.dumps(message).encode()
+    stream.write(HEADER.pack(len(data)) + data)
+    stream.flush()
+
+
+def read_message(stream) -> dict | None:
+    # None means the other side closed the pipe
+    header = read_exactly(stream, HEADER.size)
+    if len(header) < HEADER.size:
+        return None
+    (length,) = HEADER.unpack(header)
+    if length > MAX_MESSAGE_SIZE:
+        raise ProbeHelperError(f"Message of {length} bytes is too large")
+    data = read_exactly(stream, length)
+    if len(data) < length:
+        return None
+    return json.loads(data)
+
+
+def current_rss() -> int:
+    # Resident memory in bytes, 0 if unknown
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    # Peak instead of current memory, in bytes on MacOS and KiB elsewhere
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if platform.system() == MyOS.MAC else max_rss * 1024
+
+
+def helper_command(serials=frozenset()) -> list[str]:
+    # A PyInstaller binary starts itself, otherwise run this module
+    if getattr(sys, "frozen", False):
+        command = [sys.executable, HELPER_ARG]
+    else:
+        command = [sys.executable, "-m", "sciber_yklocker.probehelper"]
+    if serials:
+        command += ["-s", ",".join(str(serial) for serial in sorted(serials))]
+    return command
+
+
+def run_helper(argv: list[str], stdin=None, stdout=None) -> None:
+    from sciber_yklocker.models.yklock import YkLock
+
+    stdin = stdin or sys.stdin.buffer
+    stdout = stdout or sys.stdout.buffer
+    # Ctrl-C reaches the whole process group, the locker decides when to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    yklocker = YkLock()
+    opts, args = getopt.getopt(argv, "s:")
+    for opt, arg in opts:
+        if opt == "-s":
+            yklocker.set_serial_allowlist({int(value) for value in arg.split(",")})
+
+    while True:
+        request = read_message(stdin)
+        if request is None:
+            # The locker exited
+            return
+        if request.get("op") == "probe":
+            try:
+                reply = {"connected": yklocker.probe_devices()}
+            except Exception as e:
+                reply = {"error": f"{type(e).__name__}: {e}"}
+        else:
+            reply = {"error": "Unknown request"}
+        reply["rss"] = current_rss()
+        write_message(stdout, reply)
+
+
+def helper_timeout(deadline: float) -> float:
+    # Seconds to wait for an answer, a little less than the probe deadline
+    return deadline - min(HELPER_TIMEOUT_MARGIN, deadline / 10)
+
+
+class ProbeHelper:
+    # Runs the probes in a helper process, restarted whenever it fails
+    def __init__(
+        self,
+        command: list[str],
+        timeout: float = helper_timeout(PROBE_DEADLINE),
+        max_probes: int = HELPER_MAX_PROBES,
+        max_rss: int = HELPER_MAX_RSS,
+    ) -> None:
+        self.command = command
+        self.timeout = timeout
+        self.max_probes = max_probes
+        self.max_rss = max_rss
+        self.process: subprocess.Popen | None = None
+        self.replies: queue.Queue[dict | None] = queue.Queue()
+        # Probes answered by the running helper
+        self.probes = 0
+        self.starts = 0
+        # The running helper was started with an older command
+        self.outdated = False
+
+    def set_command(self, command: list[str]) -> None:
+        # Used from the next helper on, replaced by the next probe
+        if command != self.command:
+            self.command = command
+            self.outdated = True
+
+    def start(self) -> None:
+        self.process = subprocess.Popen(
+            self.command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            close_fds=True,
+        )
+        # Read on a thread, pipes can not be waited on with a timeout everywhere
+        self.replies = queue.Queue()
+        threading.Thread(
+            target=self.read_replies,
+            args=(self.process.stdout, self.replies),
+            daemon=True,
+        ).start()
+        self.probes = 0
+        self.starts += 1
+
+    @staticmethod
+    def read_replies(stdout, replies: queue.Queue) -> None:
+        try:
+            while (reply := read_message(stdout)) is not None:
+                replies.put(reply)
+        except (OSError, ValueError, ProbeHelperError):
+            pass
+        replies.put(None)
+
+    def stop(self, hung: bool = False) -> None:
+        process, self.process = self.process, None
+        if process is None:
+            return
+        # Closing stdin asks the helper to exit, a hung one would never see it
+        if hung:
+            process.kill()
+        if process.stdin is not None:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+        try:
+            process.wait(HELPER_EXIT_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        if process.stdout is not None:
+            process.stdout.close()
+
+    def probe(self) -> bool:
+        if self.outdated:
+            self.outdated = False
+            self.stop()
+        if self.process is None:
+            self.start()
+
+        try:
+            assert self.process is not None and self.process.stdin is not None
+            write_message(self.process.stdin, {"op": "probe"})
+            reply = self.replies.get(timeout=self.timeout)
+        except OSError as e:
+            self.stop()
+            raise ProbeHelperError("Probe helper exited: " + str(e))
+        except queue.Empty:
+            self.stop(hung=True)
+            raise ProbeHelperError(f"Probe helper did not answer in {self.timeout} s")
+        if reply is None:
+            self.stop()
+            raise ProbeHelperError("Probe helper exited")
+
+        # Bound the memory growth of the helper, the next probe starts a new one
+        self.probes += 1
+        if self.probes >= self.max_probes or reply.get("rss", 0) > self.max_rss:
+            self.stop()
+
+        if "error" in reply:
+            raise ProbeHelperError("Probe helper failed: " + reply["error"])
+        return bool(reply["connected"])
+
+
+if __name__ == "__main__":
+    run_helper(sys.argv[1:])
@@ -0,0 +1,324 @@
+import functools
+import io
+import os
+import sys
+import threading
+from collections import Counter
+from collections.abc import Callable
+from enum import StrEnum  # StrEnum is python 3.11+
+from time import perf_counter
+from types import FrameType
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import cProfile
+    import tracemalloc
+
+# Opt-in profiling of the probe loop, -P or YKLOCKER_PROFILE. The loop's
+# phases are timed by wrapping them when profiling starts, without profiling
+# nothing is wrapped so it costs nothing. Allocations are only traced with
+# -T or YKLOCKER_TRACEMALLOC. The summaries are written on SIGUSR1 and when
+# the locker stops.
+
+PROFILE_ENV = "YKLOCKER_PROFILE"
+TRACEMALLOC_ENV = "YKLOCKER_TRACEMALLOC"
+# Frames kept per allocation, more find the caller but cost memory
+TRACEMALLOC_FRAMES = 1
+# Loop iterations to run cProfile or the sampler for
+PROFILE_ITERATIONS = 100
+# Seconds between samples of every thread's stack
+SAMPLE_INTERVAL = 0.005
+SAMPLE_DEPTH = 20
+# Entries in the summary
+SUMMARY_TOP = 30
+
+
+class ProfileMode(StrEnum):
+    # Only the phase timers
+    TIMERS = "timers"
+    # cProfile of the probes and actions
+    CPROFILE = "cprofile"
+    # Samples the stacks of all threads, the loop itself included
+    SAMPLE = "sample"
+
+
+def parse_profile_spec(spec: str) -> tuple[str, ProfileMode, int]:
+    # "path[:mode[:iterations]]", e.g. /tmp/yklocker.prof:sample:500
+    path, mode, iterations = spec, ProfileMode.TIMERS, PROFILE_ITERATIONS
+    parts = spec.rsplit(":", 2)
+    if len(parts) == 3 and parts[1] in ProfileMode.__members__.values():
+        if not parts[2].isdecimal() or int(parts[2]) == 0:
+            raise ValueError(f"Invalid number of iterations {parts[2]}")
+        path, mode, iterations = parts[0], ProfileMode(parts[1]), int(parts[2])
+    elif len(parts) >= 2 and parts[-1] in ProfileMode.__members__.values():
+        path, mode = spec.rsplit(":", 1)[0], ProfileMode(parts[-1])
+    if not path:
+        raise ValueError("No file to write the profile to")
+    return path, mode, iterations
+
+
+class PhaseTimer:
+    def __init__(self) -> None:
+        self.count = 0
+        self.total: float = 0
+        self.max: float = 0
+
+    def add(self, duration: float) -> None:
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+
+
+class Sampler:
+    # Counts the stacks every thread is in, a few times per millisecond
+    def __init__(self, interval: float = SAMPLE_INTERVAL) -> None:
+        self.interval = interval
+        self.stacks: Counter[str] = Counter()
+        self.samples = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(
+            target=self.run, name="yklocker-sampler", daemon=True
+        )
+
+    def run(self) -> None:
+        own = threading.get_ident()
+        names: dict[int | None, str] = {}
+        while not self.stopped.wait(self.interval):
+            stacks = []
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                if ident not in names:
+                    threads = threading.enumerate()
+                    names = {thread.ident: thread.name for thread in threads}
+                stack: list[str] = []
+                caller: FrameType | None = frame
+                while caller is not None and len(stack) < SAMPLE_DEPTH:
+                    code = caller.f_code
+                    filename = os.path.basename(code.co_filename)
+                    stack.append(f"{filename}:{code.co_name}:{caller.f_lineno}")
+                    caller = caller.f_back
+                # Outermost first, the way flame graph tools want it
+                thread_name = names.get(ident, str(ident))
+                stacks.append(";".join([thread_name, *reversed(stack)]))
+            with self.lock:
+                self.samples += 1
+                self.stacks.update(stacks)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.thread.join()
+
+
+class Profiler:
+    def __init__(
+        self,
+        path: str,
+        mode: ProfileMode = ProfileMode.TIMERS,
+        iterations: int = PROFILE_ITERATIONS,
+    ) -> None:
+        self.path = path
+        self.mode = mode
+        self.iterations = iterations
+        self.started = perf_counter()
+        self.phases: dict[str, PhaseTimer] = {}
+        # Phases are timed on the loop and on the worker threads
+        self.lock = threading.Lock()
+        self.iteration = 0
+        # cProfile collects while profiling is set
+        self.profile: "cProfile.Profile | None" = None
+        self.profiling = False
+        # Only one thread at a time may run under cProfile
+        self.profile_lock = threading.Lock()
+        self.sampler: Sampler | None = None
+
+    def record(self, phase: str, duration: float) -> None:
+        with self.lock:
+            timer = self.phases.get(phase)
+            if timer is None:
+                timer = self.phases[phase] = PhaseTimer()
+            timer.add(duration)
+
+    def timed(self, phase: str, function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.record(phase, perf_counter() - start)
+
+        return wrapper
+
+    def timed_async(self, phase: str, function: Callable) -> Callable:
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                self.record(phase, perf_counter() - start)
+
+        return wrapper
+
+    def profiled(self, function: Callable) -> Callable:
+        # Runs function under cProfile during the profiled iterations
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            profile = self.profile
+            if (
+                not self.profiling
+                or profile is None
+                or not self.profile_lock.acquire(blocking=False)
+            ):
+                return function(*args, **kwargs)
+            try:
+                return profile.runcall(function, *args, **kwargs)
+            finally:
+                self.profile_lock.release()
+
+        return wrapper
+
+    def next_iteration(self) -> None:
+        # Start profiling with the first iteration and stop after the last
+        self.iteration += 1
+        if self.iteration == 1:
+            if self.mode == ProfileMode.CPROFILE:
+                import cProfile
+
+                self.profile = cProfile.Profile()
+                self.profiling = True
+            elif self.mode == ProfileMode.SAMPLE:
+                self.sampler = Sampler()
+                self.sampler.start()
+        elif self.iteration == self.iterations + 1:
+            self.stop()
+
+    def stop(self) -> None:
+        # Keep what was collected, but stop collecting more
+        self.profiling = False
+        if self.sampler is not None and not self.sampler.stopped.is_set():
+            self.sampler.stop()
+
+    def instrument(self, runtime) -> None:
+        # Time the phases of the loop, see runtime.Runtime
+        yklocker = runtime.yklocker
+        wait = self.timed_async("wait", runtime.wait_for_next_probe)
+
+        async def wait_for_next_probe(state):
+            self.next_iteration()
+            return await wait(state)
+
+        runtime.wait_for_next_probe = wait_for_next_probe
+        runtime.probe = self.timed_async("probe", runtime.probe)
+        runtime.check_registry = self.timed_async("registry", runtime.check_registry)
+        runtime.act = self.timed("action", self.profiled(runtime.act))
+        runtime.escalate = self.timed("action", self.profiled(runtime.escalate))
+        if runtime.reload is not None:
+            runtime.reload = self.timed("config", runtime.reload)
+        yklocker.is_yubikey_connected = self.profiled(yklocker.is_yubikey_connected)
+        yklocker.logger = self.timed("logging", yklocker.logger)
+
+    def summary(self) -> str:
+        elapsed = perf_counter() - self.started
+        lines = [
+            f"YubiKeyLocker profile after {elapsed:.1f} s, {self.iteration} iterations",
+            "Phases nest, e.g. logging is also part of the phase it happened in",
+            "",
+            "phase         count    total s    mean ms     max ms",
+        ]
+        with self.lock:
+            phases = sorted(self.phases.items(), key=lambda item: -item[1].total)
+            for name, timer in phases:
+                mean = timer.total / timer.count * 1000
+                lines.append(
+                    f"{name:<10} {timer.count:>8} {timer.total:>10.3f} "
+                    f"{mean:>10.3f} {timer.max * 1000:>10.3f}"
+                )
+
+        if self.profile is not None:
+            import pstats
+
+            lines += [
+                "",
+                f"cProfile of probes and actions, first {self.iterations} iterations",
+            ]
+            output = io.StringIO()
+            # Not while a probe is profiled, unless it is stuck
+            if self.profile_lock.acquire(timeout=1):
+                try:
+                    stats = pstats.Stats(self.profile, stream=output)
+                    stats.sort_stats("cumulative").print_stats(SUMMARY_TOP)
+                except TypeError:
+                    # Nothing profiled yet leaves no stats to print
+                    pass
+                finally:
+                    self.profile_lock.release()
+            else:
+                output.write("Busy, a profiled probe or action is still running")
+            lines.append(output.getvalue().strip())
+
+        if self.sampler is not None:
+            sampler = self.sampler
+            lines += [
+                "",
+                f"{sampler.samples} samples every {sampler.interval * 1000:g} ms, "
+                f"first {self.iterations} iterations, stacks outermost first",
+            ]
+            with sampler.lock:
+                for stack, count in sampler.stacks.most_common(SUMMARY_TOP):
+                    lines.append(f"{count} {stack}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self) -> None:
+        with open(self.path, "w") as file:
+            file.write(self.summary())
+
+
+class AllocationTracer:
+    # Where the live locker allocated its memory, and what grew since the
+    # previous dump
+    def __init__(self, path: str, frames: int = TRACEMALLOC_FRAMES) -> None:
+        self.path = path
+        self.started = perf_counter()
+        self.previous: "tracemalloc.Snapshot | None" = None
+        import tracemalloc
+
+        tracemalloc.start(frames)
+
+    def summary(self) -> str:
+        import tracemalloc
+
+        # The tracer's own allocations are no leak
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            (tracemalloc.Filter(False, tracemalloc.__file__),)
+        )
+        current, peak = tracemalloc.get_traced_memory()
+        elapsed = perf_counter() - self.started
+        lines = [
+            f"YubiKeyLocker allocations after {elapsed:.1f} s, "
+            f"{current} bytes traced, peak {peak} bytes",
+            "",
+            "Largest allocation sites",
+        ]
+        lines += [str(stat) for stat in snapshot.statistics("lineno")[:SUMMARY_TOP]]
+        if self.previous is not None:
+            lines += ["", "Growth since the previous dump"]
+            growth = snapshot.compare_to(self.previous, "lineno")[:SUMMARY_TOP]
+            lines += [str(stat) for stat in growth]
+        self.previous = snapshot
+        return "\n".join(lines) + "\n"
+
+    def dump(self) -> None:
+        summary = self.summary()
+        with open(self.path, "w") as file:
+            file.write(summary)
+
+    def stop(self) -> None:
+        import tracemalloc
+
+        tracemalloc.stop()
@@ -0,0 +1,382 @@
+import asyncio
+import platform
+import queue
+import threading
+from collections.abc import Callable
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from time import monotonic
+
+from sciber_yklocker.executor import ACTIONS
+from sciber_yklocker.models.dispatch import DispatchEvent
+from sciber_yklocker.models.escalation import EscalationStep
+from sciber_yklocker.models.myos import MyOS
+from sciber_yklocker.models.presence import CONFIRM_INTERVAL, PresenceState
+from sciber_yklocker.models.removaloption import RemovalOption
+from sciber_yklocker.models.yklock import YkLock
+from sciber_yklocker.probehelper import ProbeHelperError
+from sciber_yklocker.waker import WakeReason
+
+# Import platform specific code
+if platform.system() == MyOS.WIN:
+    from sciber_yklocker.lib.win import reg_check_updates
+
+# With hotplug events a removal wakes the loop, polling is only a safety net
+HOTPLUG_SAFETY_INTERVAL = 60
+# While the session is locked there is nothing to lock, only check now and
+# then in case a signal was missed
+LOCKED_INTERVAL = 300
+
+
+# Seconds until the next probe from the probe interval and what the last probe
+# saw, shared with the system locker
+def state_interval(probe_interval: float, state: PresenceState, hotplug: bool) -> float:
+    if state == PresenceState.SUSPECT:
+        # Confirm or dismiss a possible removal quickly
+        return min(probe_interval, CONFIRM_INTERVAL)
+    if state == PresenceState.PRESENT and hotplug:
+        return max(probe_interval, HOTPLUG_SAFETY_INTERVAL)
+    return probe_interval
+
+
+def next_probe_interval(yklocker: YkLock, state: PresenceState) -> float:
+    probe_interval = yklocker.get_probe_interval()
+    if state != PresenceState.SUSPECT and yklocker.get_session_locked():
+        return max(probe_interval, LOCKED_INTERVAL)
+    hotplug = yklocker.get_hotplug_watcher() is not None
+    return state_interval(probe_interval, state, hotplug)
+
+
+# Seconds until the next probe, with the backoff and wakeup limits applied
+def probe_delay(yklocker: YkLock, state: PresenceState, now: float) -> float:
+    interval = next_probe_interval(yklocker, state)
+    delay = yklocker.schedule.next_delay(interval, state, now)
+    # Wake up right when the next escalation step is due
+    deadline = yklocker.timers.next_deadline()
+    if deadline is not None:
+        delay = min(delay, max(0, deadline - now))
+    return delay
+
+
+# Act once per removal and log a summary instead of every probe
+def handle_dispatch_event(yklocker: YkLock, event: DispatchEvent, now: float) -> None:
+    absent_for = round(yklocker.dispatcher.absent_for(now))
+    escalation = yklocker.get_escalation()
+    if event == DispatchEvent.REMOVED and escalation:
+        steps = ", ".join(step.describe() for step in escalation)
+        yklocker.logger(f"YubiKey not found, escalating: {steps}")
+        yklocker.metrics.removed()
+        yklocker.record("removed")
+    elif event == DispatchEvent.REMOVED:
+        locking_message = (
+            f"YubiKey not found, action to take: {yklocker.get_removal_option()}"
+        )
+        yklocker.logger(locking_message)
+        yklocker.metrics.removed()
+        yklocker.record("removed")
+        yklocker.lock()
+        acted(yklocker, yklocker.get_removal_option(), monotonic() - now)
+    elif event == DispatchEvent.REARMED and not escalation:
+        yklocker.logger(
+            f"YubiKey still absent for {absent_for} s, repeating action: {yklocker.get_removal_option()}"
+        )
+        yklocker.lock()
+        acted(yklocker, yklocker.get_removal_option(), monotonic() - now, repeated=True)
+    elif event == DispatchEvent.STILL_ABSENT:
+        yklocker.logger(f"YubiKey still absent for {absent_for} s")
+    elif event == DispatchEvent.RETURNED:
+        absent_for = round(yklocker.dispatcher.last_absence)
+        yklocker.logger(f"YubiKey found again after {absent_for} s")
+        yklocker.record("returned", absent_for=absent_for)
+
+
+def acted(
+    yklocker: YkLock, removal_option: RemovalOption, latency: float, **fields
+) -> None:
+    yklocker.metrics.acted(removal_option, latency)
+    yklocker.record(
+        "action",
+        removal_option=removal_option,
+        latency=round(latency, 3),
+        repeated=fields.pop("repeated", False),
+        **fields,
+    )
+
+
+# The next step of an escalation chain is due
+def handle_escalation_step(yklocker: YkLock, step: EscalationStep, now: float) -> None:
+    yklocker.logger(f"YubiKey still absent, escalating: {step.describe()}")
+    if step.removal_option is not None:
+        yklocker.act_on(step.removal_option)
+        acted(yklocker, step.removal_option, monotonic() - now, after=step.after)
+        return
+    result = ACTIONS.run(step.command)
+    if not result.ok:
+        yklocker.logger("Escalation command failed: " + str(result))
+    yklocker.record("command", command=list(step.command), ok=result.ok)
+
+
+class DaemonExecutor(Executor):
+    # One worker like ThreadPoolExecutor(1), but a daemon thread that is never
+    # joined, a probe stuck in the USB stack must not keep the process alive
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.work: queue.SimpleQueue[tuple | None] = queue.SimpleQueue()
+        self.thread: threading.Thread | None = None
+        self.lock = threading.Lock()
+        self.stopped = False
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        future: Future = Future()
+        with self.lock:
+            if self.stopped:
+                raise RuntimeError("cannot schedule new futures after shutdown")
+            self.work.put((future, fn, args, kwargs))
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name=self.name, daemon=True
+                )
+                self.thread.start()
+        return future
+
+    def run(self) -> None:
+        while (item := self.work.get()) is not None:
+            future, fn, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False) -> None:
+        with self.lock:
+            self.stopped = True
+            if cancel_futures:
+                while True:
+                    try:
+                        item = self.work.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not None:
+                        item[0].cancel()
+            self.work.put(None)
+            thread = self.thread
+        if wait and thread is not None:
+            thread.join()
+
+
+class Runtime:
+    def __init__(
+        self,
+        yklocker: YkLock,
+        keep_running: Callable[[YkLock], bool],
+        reload: Callable[[YkLock], None] | None = None,
+    ) -> None:
+        self.yklocker = yklocker
+        self.keep_running = keep_running
+        # Called on SIGHUP or when a config file changed
+        self.reload = reload
+        # ykman and the lock actions block, each gets a single worker so a
+        # slow action never delays the next probe and probes never overlap
+        self.probe_executor = DaemonExecutor("yklocker-probe")
+        self.action_executor = ThreadPoolExecutor(1, "yklocker-action")
+        # (act or escalate, event or step, monotonic time)
+        self.actions: asyncio.Queue[tuple | None]
+        self.wakeup: asyncio.Event
+        # A probe that missed its deadline and is still running
+        self.pending_probe: asyncio.Future | None = None
+        self.probe_started: float = 0
+        # Only with profiling on, the phases are wrapped with timers
+        if yklocker.get_profiler() is not None:
+            yklocker.get_profiler().instrument(self)
+
+    def on_readable(self, key) -> None:
+        waker = self.yklocker.get_waker()
+        waker.handle(key)
+        if key.fileobj not in waker.selector.get_map():
+            # The handler dropped its source, e.g. the connection closed
+            asyncio.get_running_loop().remove_reader(key.fileobj)
+        if waker.pending:
+            self.wakeup.set()
+
+    async def wait(self, timeout: float) -> set[WakeReason]:
+        # The same as Waker.wait, but without blocking the event loop
+        waker = self.yklocker.get_waker()
+        if not waker.pending:
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except TimeoutError:
+                pass
+        return waker.take_pending()
+
+    # Wait until the next probe is due, or something wakes us up earlier
+    async def wait_for_next_probe(self, state: PresenceState) -> set[WakeReason]:
+        schedule = self.yklocker.schedule
+        reasons = await self.wait(probe_delay(self.yklocker, state, monotonic()))
+        if WakeReason.HOTPLUG in reasons:
+            # A YubiKey was plugged or unplugged, stop backing off
+            schedule.note_activity()
+
+        schedule.note_wakeup(monotonic())
+        return reasons
+
+    def stalled(self, message: str) -> bool:
+        watchdog = self.yklocker.watchdog
+        connected = watchdog.stalled()
+        treated_as = "present" if connected else "absent"
+        self.yklocker.logger(
+            f"{message}, {watchdog.stalls} in a row, treating the YubiKey as {treated_as}"
+        )
+        return connected
+
+    async def probe(self) -> bool:
+        # Probe on the worker thread, a hung probe must not freeze the loop
+        loop = asyncio.get_running_loop()
+        yklocker = self.yklocker
+        watchdog = yklocker.watchdog
+        if self.pending_probe is None:
+            # Never queue a probe behind one that is still stuck
+            self.probe_started = monotonic()
+            self.pending_probe = loop.run_in_executor(
+                self.probe_executor, yklocker.is_yubikey_connected
+            )
+
+        try:
+            connected = await asyncio.wait_for(
+                asyncio.shield(self.pending_probe), watchdog.deadline
+            )
+        except TimeoutError:
+            yklocker.metrics.probe_failed("stalled")
+            stalled_for = round(monotonic() - self.probe_started)
+            yklocker.record("probe_error", reason="stalled", seconds=stalled_for)
+            return self.stalled(f"YubiKey probe stalled for {stalled_for} s")
+        except ProbeHelperError as e:
+            # The helper process crashed or hung, it is restarted next probe
+            self.pending_probe = None
+            yklocker.metrics.probe_failed("helper")
+            yklocker.record("probe_error", reason="helper", error=str(e))
+            return self.stalled(f"YubiKey probe failed, {e}")
+
+        self.pending_probe = None
+        duration = monotonic() - self.probe_started
+        watchdog.completed(duration)
+        yklocker.metrics.probed(duration)
+        return connected
+
+    def export_metrics(self, now: float) -> None:
+        exporter = self.yklocker.get_metrics_exporter()
+        if exporter is None:
+            return
+        try:
+            exporter.update(now)
+        except OSError as e:
+            self.yklocker.logger("Could not write the metrics file: " + str(e))
+
+    def write_journal(self, now: float) -> None:
+        journal = self.yklocker.get_journal()
+        if journal is None:
+            return
+        try:
+            journal.update(now)
+        except OSError as e:
+            self.yklocker.logger("Could not write the journal: " + str(e))
+
+    def dump(self) -> None:
+        # Write the diagnostics asked for on SIGUSR1
+        for diagnostics, name in (
+            (self.yklocker.get_profiler(), "profile"),
+            (self.yklocker.get_allocation_tracer(), "allocations"),
+        ):
+            if diagnostics is None:
+                continue
+            try:
+                diagnostics.dump()
+            except OSError as e:
+                self.yklocker.logger(f"Could not write the {name}: {e}")
+
+    async def check_registry(self) -> None:
+        # Check for any timeout or RemovalOption updates from the registry,
+        # not on the probe worker in case a probe is stuck
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, reg_check_updates, self.yklocker)
+
+    def act(self, event: DispatchEvent, now: float) -> None:
+        handle_dispatch_event(self.yklocker, event, now)
+
+    def escalate(self, step: EscalationStep, now: float) -> None:
+        handle_escalation_step(self.yklocker, step, now)
+
+    async def probe_loop(self) -> None:
+        yklocker = self.yklocker
+        while self.keep_running(yklocker):
+            reasons = await self.wait_for_next_probe(yklocker.get_presence_state())
+            if WakeReason.STOP in reasons:
+                yklocker.logger("Stopped YubiKeyLocker")
+                break
+            if WakeReason.RELOAD in reasons and self.reload is not None:
+                self.reload(yklocker)
+            if WakeReason.DUMP in reasons:
+                self.dump()
+
+            if platform.system() == MyOS.WIN:
+                await self.check_registry()
+
+            connected = await self.probe()
+            now = monotonic()
+            state = yklocker.update_presence(connected, now)
+            event = yklocker.dispatch(state, now)
+            if event != DispatchEvent.NONE:
+                self.actions.put_nowait((self.act, event, now))
+            # After dispatching, a YubiKey that returned cancelled its steps
+            for step in yklocker.timers.pop_due(now):
+                self.actions.put_nowait((self.escalate, step, now))
+            self.export_metrics(now)
+            self.write_journal(now)
+
+    async def action_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self.actions.get()
+            if item is None:
+                break
+            function, *args = item
+            try:
+                await loop.run_in_executor(self.action_executor, function, *args)
+            except Exception as e:
+                # Keep acting on the next removal, whatever went wrong here
+                self.yklocker.logger(f"Lock action failed: {e!r}")
+                self.yklocker.record("action_error", error=repr(e))
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        self.actions = asyncio.Queue()
+        self.wakeup = asyncio.Event()
+
+        keys = self.yklocker.get_waker().keys()
+        for key in keys:
+            loop.add_reader(key.fileobj, self.on_readable, key)
+
+        action_task = asyncio.create_task(self.action_loop())
+        try:
+            await self.probe_loop()
+        finally:
+            # Let already dispatched actions finish before stopping
+            self.actions.put_nowait(None)
+            await action_task
+            for key in keys:
+                loop.remove_reader(key.fileobj)
+            self.probe_executor.shutdown(wait=False, cancel_futures=True)
+            self.action_executor.shutdown(wait=False, cancel_futures=True)
+
+
+def run_runtime(
+    yklocker: YkLock,
+    keep_running: Callable[[YkLock], bool],
+    reload: Callable[[YkLock], None] | None = None,
+) -> None:
+    # add_reader needs a selector based event loop, also on Windows
+    with asyncio.Runner(loop_factory=asyncio.SelectorEventLoop) as runner:
+        runner.run(Runtime(yklocker, keep_running, reload).run())
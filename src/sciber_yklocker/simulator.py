@@ -0,0 +1,431 @@
+import argparse
+import bisect
+import json
+import math
+import random
+import statistics
+import sys
+from enum import StrEnum  # StrEnum is python 3.11+
+from time import perf_counter
+from typing import NamedTuple
+
+from sciber_yklocker.config import ConfigError, parse_config
+from sciber_yklocker.models.dispatch import DispatchEvent
+from sciber_yklocker.models.removaloption import RemovalOption
+from sciber_yklocker.models.settings import Settings
+from sciber_yklocker.models.yklock import YkLock
+from sciber_yklocker.runtime import handle_dispatch_event, probe_delay
+
+# Runs the locker's presence tracking, schedule and dispatching against a
+# scripted timeline on a virtual clock, to tune the settings offline.
+# python -m sciber_yklocker.simulator --hours 8 --policy grace_period=2,hotplug=true
+
+# Seconds simulated by default
+SIMULATED_HOURS = 8
+SEED = 1
+
+
+class TraceKind(StrEnum):
+    # The user plugs in or removes the YubiKey
+    INSERT = "insert"
+    REMOVE = "remove"
+    # The YubiKey disappears for duration seconds without being removed,
+    # e.g. a hub reset or a bad contact
+    GLITCH = "glitch"
+    # The computer sleeps for duration seconds
+    SUSPEND = "suspend"
+
+
+class TraceEvent(NamedTuple):
+    time: float
+    kind: TraceKind
+    duration: float = 0
+
+
+class Trace(NamedTuple):
+    name: str
+    duration: float
+    events: tuple[TraceEvent, ...]
+
+
+class Policy(NamedTuple):
+    name: str
+    settings: Settings = Settings()
+    # Wake up on hotplug events like the uevent watcher on Linux
+    hotplug: bool = False
+
+
+class SimulationResult(NamedTuple):
+    trace: str
+    policy: str
+    probes: int
+    locks: int
+    # Locks while the YubiKey was not removed
+    false_locks: int
+    # Escalation steps taken, each lock among them also counts as a lock
+    escalations: int
+    removals: int
+    # Removals the computer was awake for that were never locked
+    missed_removals: int
+    # Seconds the computer was awake between each removal and its lock
+    latencies: tuple[float, ...]
+
+
+class Timeline:
+    # When the YubiKey is visible to a probe and when the computer sleeps
+    def __init__(self, trace: Trace) -> None:
+        events = sorted(trace.events)
+        self.duration = trace.duration
+        self.suspends = [
+            (event.time, event.time + event.duration)
+            for event in events
+            if event.kind == TraceKind.SUSPEND
+        ]
+        glitches = [
+            (event.time, event.time + event.duration)
+            for event in events
+            if event.kind == TraceKind.GLITCH
+        ]
+
+        # (start, end) of every removal, the end is inf if it never returned
+        self.removals: list[tuple[float, float]] = []
+        inserted: list[tuple[float, bool]] = [(-math.inf, False)]
+        for event in events:
+            if event.kind == TraceKind.INSERT and not inserted[-1][1]:
+                inserted.append((event.time, True))
+                if self.removals and self.removals[-1][1] == math.inf:
+                    self.removals[-1] = (self.removals[-1][0], event.time)
+            elif event.kind == TraceKind.REMOVE and inserted[-1][1]:
+                inserted.append((event.time, False))
+                self.removals.append((event.time, math.inf))
+        self.removal_starts = [start for start, end in self.removals]
+
+        def visible_at(time: float) -> bool:
+            index = bisect.bisect_right(inserted, (time, True)) - 1
+            if not inserted[index][1]:
+                return False
+            return not any(start <= time < end for start, end in glitches)
+
+        # Times the visibility changed, and what it changed to
+        boundaries = sorted({event.time for event in events} | {e for s, e in glitches})
+        self.changes: list[float] = []
+        self.visibility: list[bool] = [False]
+        for time in boundaries:
+            if visible_at(time) != self.visibility[-1]:
+                self.changes.append(time)
+                self.visibility.append(visible_at(time))
+
+    def visible(self, time: float) -> bool:
+        return self.visibility[bisect.bisect_right(self.changes, time)]
+
+    def removal_at(self, time: float) -> int | None:
+        # The removal in progress at time, if any
+        index = bisect.bisect_right(self.removal_starts, time) - 1
+        if index >= 0 and time < self.removals[index][1]:
+            return index
+        return None
+
+    def to_monotonic(self, wall: float) -> float:
+        # The monotonic clock stops while the computer sleeps
+        monotonic = wall
+        for start, end in self.suspends:
+            if wall >= end:
+                monotonic -= end - start
+            elif wall > start:
+                monotonic -= wall - start
+        return monotonic
+
+    def to_wall(self, monotonic: float) -> float:
+        # When a timer due at monotonic fires, after any sleep on the way
+        wall = monotonic
+        for start, end in self.suspends:
+            if wall > start:
+                wall += end - start
+        return wall
+
+    def awake(self, wall: float) -> float:
+        # Events during a sleep are delivered once the computer wakes up
+        for start, end in self.suspends:
+            if start < wall < end:
+                return end
+        return wall
+
+
+def simulate(trace: Trace, policy: Policy) -> SimulationResult:
+    timeline = Timeline(trace)
+    yklocker = YkLock()
+    yklocker.apply_settings(policy.settings)
+    yklocker.schedule.on_battery = lambda: False
+    yklocker.logger = lambda msg: None
+    if policy.hotplug:
+        # Only checked for being set, the events come from the timeline
+        yklocker.set_hotplug_watcher(timeline)
+
+    now = 0.0
+    probes = locks = false_locks = escalations = 0
+    detected: dict[int, float] = {}
+    # Removals the locker saw, or that happened while it was still locked
+    # from an earlier one it never saw end
+    handled: set[int] = set()
+
+    def lock() -> None:
+        nonlocal locks, false_locks
+        locks += 1
+        removal = timeline.removal_at(now)
+        if removal is None:
+            false_locks += 1
+        elif removal not in detected:
+            start = timeline.removals[removal][0]
+            latency = timeline.to_monotonic(now) - timeline.to_monotonic(start)
+            detected[removal] = round(latency, 6)
+
+    yklocker.lock = lock
+    # Index of the next visibility change a hotplug event is sent for
+    next_change = 0
+    state = yklocker.get_presence_state()
+    while True:
+        monotonic = timeline.to_monotonic(now)
+        due = monotonic + probe_delay(yklocker, state, monotonic)
+        wake = timeline.to_wall(due)
+        hotplug = False
+        if policy.hotplug and next_change < len(timeline.changes):
+            event_at = timeline.awake(timeline.changes[next_change])
+            if event_at <= wake:
+                wake, hotplug = event_at, True
+        if wake > timeline.duration:
+            break
+
+        now = wake
+        while (
+            next_change < len(timeline.changes)
+            and timeline.awake(timeline.changes[next_change]) <= now
+        ):
+            next_change += 1
+        monotonic = timeline.to_monotonic(now)
+        if not hotplug:
+            # Converting to wall time and back may round just short of it,
+            # an escalation step due then would never be popped
+            monotonic = max(monotonic, due)
+        if hotplug:
+            yklocker.schedule.note_activity()
+        yklocker.schedule.note_wakeup(monotonic)
+
+        probes += 1
+        state = yklocker.update_presence(timeline.visible(now), monotonic)
+        event = yklocker.dispatch(state, monotonic)
+        if event != DispatchEvent.NONE:
+            handle_dispatch_event(yklocker, event, monotonic)
+        # After dispatching, a YubiKey that returned cancelled its steps
+        for step in yklocker.timers.pop_due(monotonic):
+            escalations += 1
+            if step.removal_option not in (None, RemovalOption.NOTHING):
+                lock()
+        removal = timeline.removal_at(now)
+        if removal is not None and yklocker.dispatcher.absent_since is not None:
+            handled.add(removal)
+
+    removals = [
+        (index, start, end)
+        for index, (start, end) in enumerate(timeline.removals)
+        if start < trace.duration
+    ]
+    # Not missed if the computer slept through all of it
+    missed = [
+        index
+        for index, start, end in removals
+        if index not in handled and timeline.awake(start) < end
+    ]
+    return SimulationResult(
+        trace=trace.name,
+        policy=policy.name,
+        probes=probes,
+        locks=locks,
+        false_locks=false_locks,
+        escalations=escalations,
+        removals=len(removals),
+        missed_removals=len(missed),
+        latencies=tuple(detected[index] for index in sorted(detected)),
+    )
+
+
+def steady_trace(hours: float, rng: random.Random) -> Trace:
+    # Plugged in all day, what it costs to watch a YubiKey that stays
+    return Trace("steady", hours * 3600, (TraceEvent(0, TraceKind.INSERT),))
+
+
+def removal_trace(hours: float, rng: random.Random) -> Trace:
+    # Taken out every half hour or so, back after a few minutes
+    events = [TraceEvent(0, TraceKind.INSERT)]
+    time = rng.uniform(600, 2400)
+    while time < hours * 3600 - 600:
+        events.append(TraceEvent(time, TraceKind.REMOVE))
+        time += rng.uniform(60, 600)
+        events.append(TraceEvent(time, TraceKind.INSERT))
+        time += rng.uniform(600, 2400)
+    return Trace("removal", hours * 3600, tuple(events))
+
+
+def flap_trace(hours: float, rng: random.Random) -> Trace:
+    # A loose contact, a few very short dropouts in a row
+    events = [TraceEvent(0, TraceKind.INSERT)]
+    time = rng.uniform(60, 1200)
+    while time < hours * 3600:
+        for _ in range(rng.randint(2, 5)):
+            duration = rng.uniform(0.05, 0.3)
+            events.append(TraceEvent(time, TraceKind.GLITCH, duration))
+            time += duration + rng.uniform(0.1, 0.5)
+        time += rng.uniform(60, 1200)
+    return Trace("flap", hours * 3600, tuple(events))
+
+
+def hub_reset_trace(hours: float, rng: random.Random) -> Trace:
+    # The hub or dock re-enumerates its devices, gone for a second or two
+    events = [TraceEvent(0, TraceKind.INSERT)]
+    time = rng.uniform(300, 2400)
+    while time < hours * 3600:
+        events.append(TraceEvent(time, TraceKind.GLITCH, rng.uniform(0.5, 3)))
+        time += rng.uniform(300, 2400)
+    return Trace("hub_reset", hours * 3600, tuple(events))
+
+
+def suspend_trace(hours: float, rng: random.Random) -> Trace:
+    # Sleeps every hour or so, half the time the YubiKey is taken out
+    # meanwhile and only put back a while after waking up
+    events = [TraceEvent(0, TraceKind.INSERT)]
+    time = rng.uniform(1200, 3600)
+    while time < hours * 3600 - 1800:
+        duration = rng.uniform(300, 1800)
+        events.append(TraceEvent(time, TraceKind.SUSPEND, duration))
+        if rng.random() < 0.5:
+            events.append(TraceEvent(time + duration / 2, TraceKind.REMOVE))
+            events.append(TraceEvent(time + duration + 600, TraceKind.INSERT))
+            duration += 600
+        time += duration + rng.uniform(1200, 3600)
+    return Trace("suspend", hours * 3600, tuple(events))
+
+
+def mixed_trace(hours: float, rng: random.Random) -> Trace:
+    # A day with a bit of everything
+    events = [TraceEvent(0, TraceKind.INSERT)]
+    for build in (removal_trace, flap_trace, hub_reset_trace, suspend_trace):
+        events += build(hours, rng).events[1:]
+    return Trace("mixed", hours * 3600, tuple(events))
+
+
+TRACES = {
+    "steady": steady_trace,
+    "removal": removal_trace,
+    "flap": flap_trace,
+    "hub_reset": hub_reset_trace,
+    "suspend": suspend_trace,
+    "mixed": mixed_trace,
+}
+
+DEFAULT_POLICIES = (
+    "default",
+    "grace_period=2,required_misses=2",
+    "hotplug=true",
+    "hotplug=true,grace_period=2,required_misses=2",
+)
+
+
+def parse_policy(spec: str) -> Policy:
+    # "key=value,..." with the config file names, plus hotplug=true
+    hotplug = False
+    lines = []
+    for item in spec.split(","):
+        key, separator, value = item.partition("=")
+        if not separator:
+            if item.strip() == "default":
+                continue
+            raise ConfigError(f"Expected key=value, not {item!r}")
+        if key.strip() == "hotplug":
+            hotplug = value.strip() == "true"
+        else:
+            lines.append(f"{key.strip()} = {value.strip()}")
+    return Policy(spec, parse_config("\n".join(lines)), hotplug)
+
+
+def summarize(latencies: list[float]) -> dict[str, float | None]:
+    if not latencies:
+        return {"median": None, "p95": None, "max": None}
+    latencies = sorted(latencies)
+    return {
+        "median": statistics.median(latencies),
+        "p95": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))],
+        "max": latencies[-1],
+    }
+
+
+def report(results: list[SimulationResult]) -> dict:
+    # Per policy, the totals over all traces and each trace on its own
+    policies: dict[str, dict] = {}
+    for result in results:
+        fields = result._asdict()
+        fields.pop("policy")
+        fields.pop("trace")
+        fields["latency"] = summarize(list(fields.pop("latencies")))
+        policy = policies.setdefault(result.policy, {"traces": {}})
+        policy["traces"][result.trace] = fields
+
+    for name, policy in policies.items():
+        own = [result for result in results if result.policy == name]
+        totals = {
+            field: sum(getattr(result, field) for result in own)
+            for field in (
+                "probes",
+                "locks",
+                "false_locks",
+                "escalations",
+                "removals",
+                "missed_removals",
+            )
+        }
+        latencies = [latency for result in own for latency in result.latencies]
+        totals["latency"] = summarize(latencies)
+        policy["total"] = totals
+    return policies
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m sciber_yklocker.simulator",
+        description="Simulate presence timelines to compare settings",
+    )
+    parser.add_argument("--hours", type=float, default=SIMULATED_HOURS)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--trace", nargs="+", choices=TRACES, default=list(TRACES))
+    parser.add_argument(
+        "--policy",
+        action="append",
+        help="e.g. probe_interval=5,grace_period=2,hotplug=true, may be repeated",
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        policies = [parse_policy(spec) for spec in args.policy or DEFAULT_POLICIES]
+    except ConfigError as e:
+        parser.error(f"Invalid policy: {e}")
+
+    start = perf_counter()
+    results = []
+    for name in args.trace:
+        # The same timeline for every policy
+        trace = TRACES[name](args.hours, random.Random(f"{args.seed}-{name}"))
+        results += [simulate(trace, policy) for policy in policies]
+
+    json.dump(
+        {
+            "hours": args.hours,
+            "seed": args.seed,
+            "seconds": perf_counter() - start,
+            "policies": report(results),
+        },
+        sys.stdout,
+        indent=2,
+    )
+    print()
+
+
+if __name__ == "__main__":
+    main()
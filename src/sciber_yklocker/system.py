@@ -0,0 +1,399 @@
+import os
+import pwd
+import stat
+import sys
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+from typing import NamedTuple
+
+from sciber_yklocker.config import (
+    SYSTEM_CONFIG,
+    USER_CONFIG,
+    ConfigError,
+    parse_config,
+    read_config,
+)
+from sciber_yklocker.lib.dbus import (
+    SIGNAL,
+    BusClient,
+    DBusConnection,
+    DBusError,
+    Message,
+    system_bus_address,
+)
+from sciber_yklocker.lib.lx import log_message
+from sciber_yklocker.lib.session import (
+    LOGIND,
+    LOGIND_MANAGER,
+    LOGIND_PATH,
+    LOGIND_SESSION,
+    PROPERTIES,
+)
+from sciber_yklocker.lib.sysfs import (
+    SYSFS_USB_ROOT,
+    UDEV_DATA_ROOT,
+    device_seat,
+    list_yubico_devices,
+    usb_fingerprint,
+)
+from sciber_yklocker.lib.uevent import UeventWatcher
+from sciber_yklocker.models.dispatch import ActionDispatcher, DispatchEvent
+from sciber_yklocker.models.presence import PresenceState, PresenceTracker
+from sciber_yklocker.models.removaloption import RemovalOption
+from sciber_yklocker.models.settings import DEFAULT_SETTINGS, Settings, merge_settings
+from sciber_yklocker.runtime import state_interval
+from sciber_yklocker.waker import Waker, WakeReason, install_signal_handlers
+
+# One locker for every session on the host, run as root by
+# yubikey-locker-system.service. USB devices are listed once per probe and
+# mapped to seats, presence is tracked per seat, and a removal is acted on
+# in the seat's active session through logind. Sessions only cost their
+# user's removal option, read when the session starts.
+
+LOGIND_SEAT = "org.freedesktop.login1.Seat"
+# logind's method for each removal option
+SESSION_METHODS = {RemovalOption.LOCK: "Lock", RemovalOption.LOGOUT: "Terminate"}
+# Largest user config file that is read
+MAX_USER_CONFIG = 64 * 1024
+
+
+class SessionPolicy(NamedTuple):
+    session_id: str
+    uid: int
+    user: str
+    seat: str
+    path: str
+    removal_option: RemovalOption
+
+
+class SeatState:
+    # Whoever is logged in on the seat, the YubiKey is in one of its ports
+    def __init__(self, settings: Settings) -> None:
+        self.presence = PresenceTracker(settings.grace_period, settings.required_misses)
+        self.dispatcher = ActionDispatcher(settings.rearm_interval)
+
+
+def seat_path(seat_id: str) -> str:
+    return f"{LOGIND_PATH}/seat/{seat_id}"
+
+
+def read_user_config(path: str, uid: int) -> Settings:
+    # Read as root from the user's home, so only a regular file the user
+    # owns counts, not a link to someone else's file
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_NOFOLLOW | os.O_NONBLOCK)
+    except FileNotFoundError:
+        return Settings()
+    except OSError as e:
+        raise ConfigError(str(e))
+    with os.fdopen(fd, "rb") as file:
+        info = os.fstat(file.fileno())
+        if not stat.S_ISREG(info.st_mode) or info.st_uid != uid:
+            raise ConfigError(f"{path} is not a file owned by uid {uid}")
+        data = file.read(MAX_USER_CONFIG + 1)
+    if len(data) > MAX_USER_CONFIG:
+        raise ConfigError(f"{path} is larger than {MAX_USER_CONFIG} bytes")
+    try:
+        return parse_config(data.decode("utf-8"))
+    except UnicodeDecodeError as e:
+        raise ConfigError(str(e))
+
+
+def user_config_path(uid: int) -> str | None:
+    try:
+        home = pwd.getpwuid(uid).pw_dir
+    except KeyError:
+        return None
+    return os.path.join(home, ".config", USER_CONFIG)
+
+
+class SystemLocker:
+    def __init__(
+        self,
+        connection: DBusConnection,
+        actions: BusClient,
+        system_config: str = SYSTEM_CONFIG,
+        sysfs_root: str = SYSFS_USB_ROOT,
+        udev_root: str = UDEV_DATA_ROOT,
+        user_config: Callable[[int], str | None] = user_config_path,
+    ) -> None:
+        # Sessions are listed and signals received on connection, from the
+        # loop. Lock actions are sent on actions, from the action worker.
+        self.connection = connection
+        self.actions = actions
+        self.system_config = system_config
+        self.sysfs_root = sysfs_root
+        self.udev_root = udev_root
+        self.user_config = user_config
+        self.settings = DEFAULT_SETTINGS
+        self.sessions: dict[str, SessionPolicy] = {}
+        self.seats: dict[str, SeatState] = {}
+        # USB fingerprint -> seat, looked up once per insertion
+        self.device_seats: dict[str, str] = {}
+        self.hotplug_watcher: UeventWatcher | None = None
+        self.waker = Waker()
+        self.action_executor = ThreadPoolExecutor(1, "yklocker-action")
+
+    def logger(self, msg: str) -> None:
+        log_message(msg)
+
+    def load_settings(self) -> None:
+        try:
+            settings = read_config(self.system_config)
+        except ConfigError as e:
+            self.logger(
+                f"Invalid config file {self.system_config}, keeping the previous"
+                f" settings: {e}"
+            )
+            return
+        self.settings = merge_settings(settings, DEFAULT_SETTINGS)
+
+    def removal_option_for(self, uid: int) -> RemovalOption:
+        # The user's own file may only choose the removal option
+        path = self.user_config(uid)
+        user_settings = Settings()
+        if path is not None:
+            try:
+                user_settings = read_user_config(path, uid)
+            except ConfigError as e:
+                self.logger(f"Invalid config file {path}, ignoring it: {e}")
+        return user_settings.removal_option or self.settings.removal_option
+
+    def session_class(self, path: str) -> str:
+        return self.connection.call(
+            LOGIND, path, PROPERTIES, "Get", "ss", (LOGIND_SESSION, "Class")
+        )[0]
+
+    def refresh_sessions(self) -> None:
+        # Called at startup, when logind announces a session or one ends,
+        # and on SIGHUP
+        sessions = {}
+        [listed] = self.connection.call(
+            LOGIND, LOGIND_PATH, LOGIND_MANAGER, "ListSessions"
+        )
+        for session_id, uid, user, seat, path in listed:
+            # Remote sessions have no seat, and no YubiKey in our USB ports
+            if not seat:
+                continue
+            # Only user sessions, not the greeter
+            known = session_id in self.sessions
+            if not known and self.session_class(path) != "user":
+                continue
+            policy = SessionPolicy(
+                session_id, uid, user, seat, path, self.removal_option_for(uid)
+            )
+            if self.sessions.get(session_id) != policy:
+                self.logger(
+                    f"Session {session_id} of {user} on {seat}, RemovalOption"
+                    f" {policy.removal_option}"
+                )
+            sessions[session_id] = policy
+        self.sessions = sessions
+
+        seats = {policy.seat for policy in sessions.values()}
+        for seat in seats - self.seats.keys():
+            self.seats[seat] = SeatState(self.settings)
+        for seat in self.seats.keys() - seats:
+            del self.seats[seat]
+
+    def reload(self) -> None:
+        self.load_settings()
+        for seat in self.seats.values():
+            seat.presence.grace_period = self.settings.grace_period
+            seat.presence.required_misses = self.settings.required_misses
+            seat.dispatcher.rearm_interval = self.settings.rearm_interval
+        self.refresh_sessions()
+
+    def present_seats(self) -> set[str]:
+        # One listing of the USB bus for every session on the host
+        fingerprints = {
+            usb_fingerprint(name, self.sysfs_root): name
+            for name in list_yubico_devices(self.sysfs_root)
+        }
+        self.device_seats = {
+            fingerprint: self.device_seats.get(fingerprint)
+            or device_seat(name, self.sysfs_root, self.udev_root)
+            for fingerprint, name in fingerprints.items()
+        }
+        return set(self.device_seats.values())
+
+    def probe(self, now: float) -> None:
+        present = self.present_seats()
+        for seat_id, seat in self.seats.items():
+            state = seat.presence.update(seat_id in present, now)
+            event = seat.dispatcher.update(state, now)
+            if event != DispatchEvent.NONE:
+                self.handle_event(seat_id, seat, event, now)
+
+    def active_session(self, seat_id: str) -> SessionPolicy | None:
+        session_id, _ = self.connection.call(
+            LOGIND,
+            seat_path(seat_id),
+            PROPERTIES,
+            "Get",
+            "ss",
+            (LOGIND_SEAT, "ActiveSession"),
+        )[0]
+        return self.sessions.get(session_id)
+
+    def handle_event(
+        self, seat_id: str, seat: SeatState, event: DispatchEvent, now: float
+    ) -> None:
+        if event == DispatchEvent.RETURNED:
+            absent_for = round(seat.dispatcher.last_absence)
+            self.logger(f"YubiKey found again on {seat_id} after {absent_for} s")
+            return
+        if event == DispatchEvent.STILL_ABSENT:
+            absent_for = round(seat.dispatcher.absent_for(now))
+            self.logger(f"YubiKey still absent on {seat_id} for {absent_for} s")
+            return
+
+        # Removed or rearmed, only the session in front of the seat is acted on
+        try:
+            policy = self.active_session(seat_id)
+        except (OSError, DBusError) as e:
+            self.logger(f"Could not find the active session on {seat_id}: {e}")
+            return
+        if policy is None or policy.removal_option not in SESSION_METHODS:
+            return
+        self.logger(
+            f"YubiKey not found on {seat_id}, action to take for {policy.user}:"
+            f" {policy.removal_option}"
+        )
+        self.action_executor.submit(self.act, policy)
+
+    def act(self, policy: SessionPolicy) -> None:
+        method = SESSION_METHODS[policy.removal_option]
+        try:
+            self.actions.call(LOGIND, policy.path, LOGIND_SESSION, method)
+        except (OSError, DBusError) as e:
+            self.logger(f"Lock action failed for session {policy.session_id}: {e}")
+
+    def switched_seat(self, message: Message) -> str | None:
+        # The seat whose active session changed, None for any other signal
+        if message.interface != PROPERTIES or message.member != "PropertiesChanged":
+            return None
+        interface, changed, invalidated = message.body
+        if interface != LOGIND_SEAT:
+            return None
+        if "ActiveSession" not in changed and "ActiveSession" not in invalidated:
+            return None
+        for seat_id in self.seats:
+            if message.path == seat_path(seat_id):
+                return seat_id
+        return None
+
+    def handle_signals(self) -> WakeReason | None:
+        # Sessions came or went, list them again before the next probe
+        try:
+            signals = self.connection.receive_signals()
+        except OSError as e:
+            self.logger("Lost the connection to logind: " + str(e))
+            self.waker.stop()
+            return None
+        reason = None
+        for message in signals:
+            if message.message_type != SIGNAL:
+                continue
+            if message.interface == LOGIND_MANAGER:
+                reason = WakeReason.RELOAD
+                continue
+            seat_id = self.switched_seat(message)
+            if seat_id is None:
+                continue
+            seat = self.seats[seat_id]
+            # Another user switched to the seat while its YubiKey is missing,
+            # the next probe acts on the new session as on a fresh removal
+            if seat.presence.state != PresenceState.PRESENT:
+                self.logger(f"Active session changed on {seat_id} without a YubiKey")
+                seat.dispatcher.reset()
+                reason = reason or WakeReason.PROBE
+        return reason
+
+    def watch(self) -> None:
+        for member in ("SessionNew", "SessionRemoved"):
+            self.connection.add_match(
+                f"type='signal',sender='{LOGIND}',interface='{LOGIND_MANAGER}',"
+                f"member='{member}'"
+            )
+        # Fast user switching changes a seat's ActiveSession
+        self.connection.add_match(
+            f"type='signal',sender='{LOGIND}',interface='{PROPERTIES}',"
+            f"member='PropertiesChanged',arg0='{LOGIND_SEAT}'"
+        )
+        self.waker.add_source(self.connection, self.handle_signals)
+        try:
+            hotplug_watcher = UeventWatcher()
+        except OSError as e:
+            self.logger("Hotplug events unavailable, polling only: " + str(e))
+            return
+
+        def handle_hotplug() -> WakeReason | None:
+            if hotplug_watcher.drain():
+                return WakeReason.HOTPLUG
+            return None
+
+        self.hotplug_watcher = hotplug_watcher
+        self.waker.add_source(hotplug_watcher, handle_hotplug)
+
+    def next_interval(self) -> float:
+        interval = self.settings.probe_interval or self.settings.timeout
+        states = [seat.presence.state for seat in self.seats.values()]
+        # The seat that needs the soonest probe decides
+        if PresenceState.SUSPECT in states:
+            state = PresenceState.SUSPECT
+        elif all(state == PresenceState.PRESENT for state in states):
+            state = PresenceState.PRESENT
+        else:
+            state = PresenceState.ABSENT
+        return state_interval(interval, state, self.hotplug_watcher is not None)
+
+    def run(self, keep_running: Callable[[], bool] = lambda: True) -> None:
+        self.reload()
+        self.logger(
+            f"Initiated YubiKeyLocker for all sessions, {len(self.sessions)} on"
+            f" {len(self.seats)} seats"
+        )
+        while keep_running():
+            reasons = self.waker.wait(self.next_interval())
+            if WakeReason.STOP in reasons:
+                self.logger("Stopped YubiKeyLocker")
+                break
+            if WakeReason.RELOAD in reasons:
+                try:
+                    self.reload()
+                except (OSError, DBusError) as e:
+                    self.logger("Could not list the sessions: " + str(e))
+            self.probe(monotonic())
+        # Let a lock action that already started finish
+        self.action_executor.shutdown(wait=True)
+
+
+def run_system(argv: list[str]) -> int:
+    # yubikey-locker system, started by yubikey-locker-system.service
+    if argv:
+        print("Usage: yubikey-locker system")
+        return 1
+    if os.geteuid() != 0:
+        print("yubikey-locker system acts on other users' sessions, run it as root")
+        return 1
+    try:
+        connection = DBusConnection(system_bus_address())
+    except OSError as e:
+        print(f"Could not connect to the system bus: {e}")
+        return 1
+
+    locker = SystemLocker(connection, BusClient(system_bus_address))
+    install_signal_handlers(locker.waker)
+    try:
+        locker.watch()
+        locker.run()
+    except (OSError, DBusError) as e:
+        log_message("Could not talk to logind: " + str(e))
+        print(f"Could not talk to logind: {e}", file=sys.stderr)
+        return 1
+    finally:
+        connection.close()
+        locker.actions.close()
+    return 0
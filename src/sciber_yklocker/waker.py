@@ -0,0 +1,110 @@
+import selectors
+import signal
+import socket
+from collections.abc import Callable
+from enum import StrEnum  # StrEnum is python 3.11+
+from time import monotonic
+
+
+class WakeReason(StrEnum):
+    STOP = "Stop"
+    HOTPLUG = "Hotplug"
+    RELOAD = "Reload"
+    PROBE = "Probe"
+    # Write diagnostics, e.g. the profile
+    DUMP = "Dump"
+
+
+class Waker:
+    def __init__(self) -> None:
+        # Self-pipe, a socketpair so it also works with select() on Windows
+        self.reader, self.writer = socket.socketpair()
+        self.reader.setblocking(False)
+        self.writer.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.reader, selectors.EVENT_READ)
+        # No lock, wake() is called from signal handlers
+        self.pending: set[WakeReason] = set()
+        self.stopped = False
+
+    def add_source(self, fileobj, handler: Callable[[], WakeReason | None]) -> None:
+        # The handler reads the source and returns why, if at all, to wake up
+        self.selector.register(fileobj, selectors.EVENT_READ, handler)
+
+    def remove_source(self, fileobj) -> None:
+        self.selector.unregister(fileobj)
+
+    def wake(self, reason: WakeReason) -> None:
+        # Safe to call from other threads and signal handlers
+        self.pending.add(reason)
+        try:
+            self.writer.send(b"\0")
+        except (BlockingIOError, OSError):
+            # Already woken or closed
+            pass
+
+    def stop(self) -> None:
+        self.stopped = True
+        self.wake(WakeReason.STOP)
+
+    def take_pending(self) -> set[WakeReason]:
+        reasons = set()
+        while self.pending:
+            reasons.add(self.pending.pop())
+        return reasons
+
+    def wait(self, timeout: float) -> set[WakeReason]:
+        # Block until woken or the timeout passes, an empty set means timeout
+        deadline = monotonic() + timeout
+        while not self.pending:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                break
+            for key, _ in self.selector.select(remaining):
+                self.handle(key)
+
+        return self.take_pending()
+
+    def keys(self) -> list[selectors.SelectorKey]:
+        # Everything to watch when an event loop does the waiting instead
+        return list(self.selector.get_map().values())
+
+    def handle(self, key: selectors.SelectorKey) -> None:
+        if key.fileobj is self.reader:
+            self.drain()
+        else:
+            reason = key.data()
+            if reason is not None:
+                self.pending.add(reason)
+
+    def drain(self) -> None:
+        try:
+            while self.reader.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+    def close(self) -> None:
+        self.selector.close()
+        self.reader.close()
+        self.writer.close()
+
+
+def install_signal_handlers(waker: Waker) -> None:
+    # Stop right away on service stop or Ctrl-C, SIGHUP triggers a reload
+    # and SIGUSR1 writes diagnostics
+    def handle_stop(signum, frame) -> None:
+        waker.stop()
+
+    def handle_reload(signum, frame) -> None:
+        waker.wake(WakeReason.RELOAD)
+
+    def handle_dump(signum, frame) -> None:
+        waker.wake(WakeReason.DUMP)
+
+    signal.signal(signal.SIGTERM, handle_stop)
+    signal.signal(signal.SIGINT, handle_stop)
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, handle_reload)
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, handle_dump)
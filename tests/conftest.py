@@ -0,0 +1,149 @@
+import os
+import platform
+import socket
+import threading
+
+import pytest
+
+from sciber_yklocker.models.myos import MyOS
+
+
+@pytest.fixture(autouse=True)
+def no_control_socket(monkeypatch):
+    # Keep the tests away from the control socket of a locker the user runs
+    monkeypatch.delenv("XDG_RUNTIME_DIR", raising=False)
+    if platform.system() == MyOS.MAC:
+        monkeypatch.delenv("TMPDIR", raising=False)
+
+
+class StandInBus:
+    # A tiny local D-Bus daemon stand-in, records calls and answers them
+    def __init__(self, socket_path: str) -> None:
+        from sciber_yklocker.lib import dbus
+
+        self.dbus = dbus
+        self.address = "unix:path=" + socket_path
+        self.calls: list = []
+        # (interface, member) -> function(message) returning (signature, body)
+        self.handlers: dict = {}
+        self.errors: dict = {}
+        self.clients: list[socket.socket] = []
+        self.serial = 0
+        self.lock = threading.Lock()
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(socket_path)
+        self.server.listen()
+        self.thread = threading.Thread(target=self.accept_loop, daemon=True)
+        self.thread.start()
+
+    def accept_loop(self) -> None:
+        while True:
+            try:
+                client, _ = self.server.accept()
+            except OSError:
+                return
+            self.clients.append(client)
+            threading.Thread(target=self.serve, args=(client,), daemon=True).start()
+
+    def send(self, client: socket.socket, message) -> None:
+        with self.lock:
+            self.serial += 1
+            message.serial = self.serial
+            client.sendall(message.encode())
+
+    def serve(self, client: socket.socket) -> None:
+        dbus = self.dbus
+        buffer = b""
+        authenticated = False
+        try:
+            while b"BEGIN\r\n" not in buffer:
+                data = client.recv(4096)
+                if not data:
+                    return
+                buffer += data
+                if b"AUTH EXTERNAL" in buffer and not authenticated:
+                    client.sendall(b"OK 0123456789abcdef0123456789abcdef\r\n")
+                    authenticated = True
+            buffer = buffer.split(b"BEGIN\r\n", 1)[1]
+
+            while True:
+                while len(buffer) < 16 or len(buffer) < dbus.message_length(buffer):
+                    data = client.recv(65536)
+                    if not data:
+                        return
+                    buffer += data
+                length = dbus.message_length(buffer)
+                message = dbus.decode_message(buffer[:length])
+                buffer = buffer[length:]
+                self.reply(client, message)
+        except OSError:
+            return
+
+    def reply(self, client: socket.socket, message) -> None:
+        dbus = self.dbus
+        key = (message.interface, message.member)
+        fields = {
+            dbus.FIELD_REPLY_SERIAL: message.serial,
+            dbus.FIELD_DESTINATION: ":1.1",
+        }
+        if key == (dbus.BUS_INTERFACE, "Hello"):
+            fields[dbus.FIELD_SIGNATURE] = "s"
+            self.send(client, dbus.Message(dbus.METHOD_RETURN, 0, fields, [":1.1"]))
+            return
+
+        self.calls.append(message)
+        if key in self.errors:
+            fields[dbus.FIELD_ERROR_NAME] = self.errors[key]
+            fields[dbus.FIELD_SIGNATURE] = "s"
+            self.send(client, dbus.Message(dbus.ERROR, 0, fields, ["Failed"]))
+            return
+
+        signature, body = "", []
+        if key in self.handlers:
+            signature, body = self.handlers[key](message)
+        if signature:
+            fields[dbus.FIELD_SIGNATURE] = signature
+        self.send(client, dbus.Message(dbus.METHOD_RETURN, 0, fields, body))
+
+    def emit(self, path: str, interface: str, member: str, signature="", body=()):
+        dbus = self.dbus
+        fields = {
+            dbus.FIELD_PATH: path,
+            dbus.FIELD_INTERFACE: interface,
+            dbus.FIELD_MEMBER: member,
+            dbus.FIELD_SENDER: ":1.0",
+        }
+        if signature:
+            fields[dbus.FIELD_SIGNATURE] = signature
+        for client in list(self.clients):
+            try:
+                self.send(client, dbus.Message(dbus.SIGNAL, 0, fields, list(body)))
+            except OSError:
+                pass
+
+    def members(self) -> list[str]:
+        return [message.member for message in self.calls]
+
+    def disconnect_clients(self) -> None:
+        for client in self.clients:
+            client.shutdown(socket.SHUT_RDWR)
+            client.close()
+        self.clients.clear()
+
+    def close(self) -> None:
+        self.server.close()
+        self.disconnect_clients()
+
+
+@pytest.fixture
+def stand_in_bus(tmp_path):
+    if platform.system() == MyOS.WIN:
+        pytest.skip("D-Bus is not used on Windows")
+    # Keep the socket path short, AF_UNIX paths are limited to ~100 bytes
+    socket_dir = tmp_path if len(str(tmp_path)) < 80 else "/tmp"
+    socket_path = os.path.join(socket_dir, f"bus-{os.getpid()}-{id(tmp_path)}")
+    bus = StandInBus(socket_path)
+    yield bus
+    bus.close()
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
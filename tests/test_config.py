@@ -0,0 +1,149 @@
+import os
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from sciber_yklocker.config import (
+    SYSTEM_CONFIG,
+    ConfigError,
+    ConfigStore,
+    config_paths,
+    parse_config,
+    read_config,
+)
+from sciber_yklocker.models.escalation import EscalationStep
+from sciber_yklocker.models.removaloption import RemovalOption
+from sciber_yklocker.models.settings import Settings
+from sciber_yklocker.models.watchdog import StallPolicy
+
+
+def test_config_paths() -> None:
+    with patch.dict(os.environ, {"XDG_CONFIG_HOME": "/home/user/.cfg"}):
+        assert config_paths() == ["/home/user/.cfg/sciber/yklocker.toml", SYSTEM_CONFIG]
+
+
+def test_parse_config() -> None:
+    text = """
+removal_option = "Lock"
+timeout = 20
+serials = [12345678, 23456789]
+probe_interval = 0.25
+grace_period = 2
+required_misses = 3
+rearm_interval = 60
+max_interval = 120
+max_wakeups_per_hour = 60
+probe_deadline = 2.5
+stall_policy = "present"
+stalls_to_lock = 4
+probe_helper = true
+metrics_file = "/var/lib/node_exporter/yklocker.prom"
+metrics_port = 9435
+journal = true
+escalation = [
+    {after = 600, action = "Logout"},
+    {after = 5, action = "Lock"},
+    {after = 3600, command = ["/usr/local/bin/notify", "--page"]},
+]
+"""
+    assert parse_config(text) == Settings(
+        removal_option=RemovalOption.LOCK,
+        timeout=20,
+        serials=frozenset({12345678, 23456789}),
+        probe_interval=0.25,
+        grace_period=2,
+        required_misses=3,
+        rearm_interval=60,
+        max_interval=120,
+        max_wakeups_per_hour=60,
+        probe_deadline=2.5,
+        stall_policy=StallPolicy.PRESENT,
+        stalls_to_lock=4,
+        probe_helper=True,
+        metrics_file="/var/lib/node_exporter/yklocker.prom",
+        metrics_port=9435,
+        journal=True,
+        escalation=(
+            EscalationStep(5, removal_option=RemovalOption.LOCK),
+            EscalationStep(600, removal_option=RemovalOption.LOGOUT),
+            EscalationStep(3600, command=("/usr/local/bin/notify", "--page")),
+        ),
+    )
+    assert parse_config("") == Settings()
+
+
+@pytest.mark.parametrize(
+    "text, message",
+    [
+        ('removal_option = "Reboot"', "removal_option must be one of"),
+        ('timeout = "10"', "timeout must be"),
+        ("timeout = true", "timeout must be"),
+        ("timeout = 1.5", "timeout must be"),
+        ("timeout = 0", "timeout must be a whole number of seconds"),
+        ("timeout = -5", "timeout must be a whole number of seconds"),
+        ('serials = ["abc"]', "serials must be"),
+        ("probe_interval = 0", "probe_interval must be"),
+        ("grace_period = -1", "grace_period must be"),
+        ("required_misses = 0", "required_misses must be"),
+        ('stall_policy = "panic"', "stall_policy must be"),
+        ('probe_helper = "yes"', "probe_helper must be"),
+        ('metrics_file = ""', "metrics_file must be"),
+        ("metrics_port = 70000", "metrics_port must be"),
+        ("journal = 1", "journal must be"),
+        ('escalation = [{after = 5, action = "Reboot"}]', "escalation must be"),
+        ("escalation = [{after = -1, command = ['true']}]", "escalation must be"),
+        ('escalation = [{after = 5, action = "Lock", command = ["x"]}]', "escalation"),
+        ("escalation = [{after = 5, command = []}]", "escalation must be"),
+        ("colour = 1", "Unknown setting colour"),
+        ("timeout = ", "Invalid value"),
+    ],
+)
+def test_parse_config_invalid(text: str, message: str) -> None:
+    with pytest.raises(ConfigError, match=message):
+        parse_config(text)
+
+
+def test_read_config(tmp_path) -> None:
+    assert read_config(str(tmp_path / "missing.toml")) == Settings()
+
+    path = tmp_path / "yklocker.toml"
+    path.write_text("timeout = 30\n")
+    assert read_config(str(path)) == Settings(timeout=30)
+
+    path.write_bytes(b"\xff\xfe")
+    with pytest.raises(ConfigError):
+        read_config(str(path))
+
+
+def test_config_store(tmp_path) -> None:
+    user = tmp_path / "user.toml"
+    system = tmp_path / "system.toml"
+    user.write_text("timeout = 20\n")
+    system.write_text('timeout = 30\nremoval_option = "Lock"\ngrace_period = 1\n')
+
+    logger = MagicMock()
+    store = ConfigStore([str(user), str(system)], logger, Settings(grace_period=5))
+    # Command line, then the user's file, then the system's
+    assert store.load() == Settings(
+        removal_option=RemovalOption.LOCK, timeout=20, grace_period=5
+    )
+    assert store.settings == store.load()
+    logger.assert_not_called()
+
+
+def test_config_store_keeps_previous(tmp_path) -> None:
+    path = tmp_path / "yklocker.toml"
+    path.write_text("timeout = 20\n")
+    logger = MagicMock()
+    store = ConfigStore([str(path)], logger)
+    assert store.load() == Settings(timeout=20)
+
+    # A broken edit is logged and ignored
+    path.write_text("timeout = twenty\n")
+    assert store.load() == Settings(timeout=20)
+    assert "Invalid config file" in logger.call_args[0][0]
+    assert "keeping the previous settings" in logger.call_args[0][0]
+
+    # Removing the file removes its settings
+    path.unlink()
+    assert store.load() == Settings()
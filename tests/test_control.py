@@ -0,0 +1,188 @@
+import os
+import platform
+import socket
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from sciber_yklocker.control import (
+    MAX_PAUSE,
+    ControlError,
+    close_control,
+    control_socket_path,
+    handle_command,
+    remove_stale_socket,
+    run_client,
+    send_command,
+    serve_control,
+    status,
+)
+from sciber_yklocker.metrics import LockerMetrics
+from sciber_yklocker.models.dispatch import DispatchEvent
+from sciber_yklocker.models.myos import MyOS
+from sciber_yklocker.models.presence import PresenceState
+from sciber_yklocker.models.removaloption import RemovalOption
+from sciber_yklocker.models.yklock import YkLock
+from sciber_yklocker.runtime import run_runtime
+from sciber_yklocker.waker import WakeReason
+
+
+@pytest.fixture
+def control_path(tmp_path):
+    if platform.system() == MyOS.WIN:
+        pytest.skip("No control socket on Windows")
+    # AF_UNIX paths are limited to ~100 bytes
+    socket_dir = tmp_path if len(str(tmp_path)) < 80 else "/tmp"
+    path = os.path.join(socket_dir, f"yk-{os.getpid()}-{id(tmp_path)}.sock")
+    yield path
+    if os.path.exists(path):
+        os.unlink(path)
+
+
+def make_yklocker() -> YkLock:
+    yklocker = YkLock()
+    yklocker.logger = MagicMock()
+    yklocker.set_removal_option(RemovalOption.LOCK)
+    yklocker.metrics = LockerMetrics(rss=lambda: 0, clock=lambda: 1700000000.0)
+    return yklocker
+
+
+def test_control_socket_path() -> None:
+    with patch.dict("os.environ", {"XDG_RUNTIME_DIR": "/run/user/1000"}):
+        assert control_socket_path() == "/run/user/1000/yklocker.sock"
+    with patch("platform.system", MagicMock(return_value=MyOS.LX)):
+        assert control_socket_path() is None
+
+
+def test_status() -> None:
+    yklocker = make_yklocker()
+    assert status(yklocker, 100)["last_probe"] is None
+
+    yklocker.metrics.probed(0.004)
+    yklocker.metrics.acted(RemovalOption.LOCK, 0.05)
+    yklocker.update_presence(False, 100)
+    yklocker.dispatch(PresenceState.ABSENT, 100)
+    result = status(yklocker, 130)
+
+    assert result["removal_option"] == RemovalOption.LOCK
+    assert result["timeout"] == 10
+    assert result["absent_for"] == 30
+    assert result["last_probe_duration"] == 0.004
+    assert result["last_probe"].startswith("2023-11-1")
+    assert result["last_action"]["removal_option"] == RemovalOption.LOCK
+    assert result["probes"] == 1
+    yklocker.schedule.note_wakeup(120)
+    assert status(yklocker, 130)["wakeups_last_hour"] == 1
+
+    yklocker.metrics.probe_failed("stalled")
+    assert status(yklocker, 130)["last_probe_error"] == "stalled"
+
+    # The watchdog's view of recent probes
+    for duration in (0.01, 0.02, 0.5):
+        yklocker.watchdog.completed(duration)
+    yklocker.watchdog.stalled()
+    result = status(yklocker, 130)
+    assert result["probe_duration_median"] == 0.02
+    assert result["probe_duration_p95"] == 0.5
+    assert result["probe_duration_max"] == 0.5
+    assert result["probe_stalls"] == 1
+
+
+def test_handle_command() -> None:
+    yklocker = make_yklocker()
+    waker = yklocker.get_waker()
+
+    assert handle_command(yklocker, "probe\n") == {"ok": True}
+    assert handle_command(yklocker, "reload") == {"ok": True}
+    assert waker.take_pending() == {WakeReason.PROBE, WakeReason.RELOAD}
+
+    assert handle_command(yklocker, "pause 10")["paused_for"] == 600
+    assert "paused for 10 minutes" in yklocker.logger.call_args[0][0]
+    assert handle_command(yklocker, "status")["paused_for"] > 0
+    assert handle_command(yklocker, "resume") == {"ok": True}
+    assert yklocker.paused_until is None
+
+    for line in ("pause", "pause 0", f"pause {MAX_PAUSE + 1}", "pause x", "", "halt"):
+        assert not handle_command(yklocker, line)["ok"]
+
+
+def test_pause_skips_removals() -> None:
+    yklocker = make_yklocker()
+    assert yklocker.dispatch(PresenceState.PRESENT, 0) == DispatchEvent.NONE
+
+    yklocker.pause(60, 0)
+    assert yklocker.paused_for(30) == 30
+    assert yklocker.dispatch(PresenceState.ABSENT, 10) == DispatchEvent.NONE
+    assert yklocker.dispatch(PresenceState.ABSENT, 50) == DispatchEvent.NONE
+
+    # Still missing when the pause ends, acted on like a new removal
+    assert yklocker.dispatch(PresenceState.ABSENT, 61) == DispatchEvent.REMOVED
+    assert yklocker.paused_for(61) == 0
+    assert yklocker.paused_until is None
+
+
+def test_serve_control(control_path, capsys) -> None:
+    yklocker = make_yklocker()
+    server = serve_control(yklocker, control_path)
+    try:
+        assert os.stat(control_path).st_mode & 0o777 == 0o600
+        assert send_command(control_path, "status")["removal_option"] == "Lock"
+
+        assert run_client(["status", "-c", control_path]) == 0
+        output = capsys.readouterr().out
+        assert "removal_option: Lock" in output
+        assert "last_probe: -" in output
+
+        assert run_client(["pause", "5"], control_path) == 0
+        assert yklocker.paused_for(0) > 0
+        assert run_client(["pause", "-5"], control_path) == 1
+
+        # A second locker must not take over the socket
+        with pytest.raises(ControlError):
+            serve_control(make_yklocker(), control_path)
+    finally:
+        close_control(server, control_path)
+    assert not os.path.exists(control_path)
+
+    assert run_client(["status"], control_path) == 1
+    assert "not answering" in capsys.readouterr().out
+
+
+def test_remove_stale_socket(control_path) -> None:
+    # Left behind by a locker that was killed
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(control_path)
+    stale.close()
+
+    remove_stale_socket(control_path)
+    assert not os.path.exists(control_path)
+
+
+def test_client_never_blocks_the_loop(control_path) -> None:
+    yklocker = make_yklocker()
+    yklocker.is_yubikey_connected = MagicMock(return_value=True)
+    server = serve_control(yklocker, control_path)
+    # Connected, but never sends a command
+    idle = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    idle.connect(control_path)
+    count = 0
+
+    def keep_running(yklocker: YkLock) -> bool:
+        nonlocal count
+        count += 1
+        yklocker.get_waker().wake(WakeReason.PROBE)
+        return count <= 5
+
+    try:
+        thread = threading.Thread(target=run_runtime, args=(yklocker, keep_running))
+        with patch("platform.system", MagicMock(return_value=MyOS.LX)):
+            thread.start()
+            thread.join(5)
+        assert not thread.is_alive()
+        assert yklocker.is_yubikey_connected.call_count == 5
+        # And other clients are still answered
+        assert send_command(control_path, "status")["probes"] == 5
+    finally:
+        idle.close()
+        close_control(server, control_path)
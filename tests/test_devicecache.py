@@ -0,0 +1,66 @@
+from unittest.mock import MagicMock
+
+from sciber_yklocker.models.devicecache import DeviceCache
+
+
+def test_devicecache_fill_on_insertion() -> None:
+    cache = DeviceCache()
+    read_serials = MagicMock(return_value={"1-2@5": 12345678})
+
+    cache.refresh(["1-2@5"], read_serials)
+    assert cache.serials() == {12345678}
+    read_serials.assert_called_once()
+
+    # Steady state is a cache lookup
+    cache.refresh(["1-2@5"], read_serials)
+    cache.refresh(["1-2@5"], read_serials)
+    read_serials.assert_called_once()
+
+
+def test_devicecache_retry_failed_read() -> None:
+    cache = DeviceCache()
+    read_serials = MagicMock(side_effect=[{}, {"1-2@5": 12345678}])
+
+    # The first read failed, it is not cached and read again on the next probe
+    cache.refresh(["1-2@5"], read_serials)
+    assert cache.serials() == set()
+    cache.refresh(["1-2@5"], read_serials)
+    assert cache.serials() == {12345678}
+    assert read_serials.call_count == 2
+
+    cache.refresh(["1-2@5"], read_serials)
+    assert read_serials.call_count == 2
+
+
+def test_devicecache_retry_backoff() -> None:
+    cache = DeviceCache()
+    read_serials = MagicMock(return_value={"1-3@6": None})
+
+    # A YubiKey without a serial is retried less and less often
+    reads = []
+    for _ in range(8):
+        cache.refresh(["1-3@6"], read_serials)
+        reads.append(read_serials.call_count)
+    assert reads == [1, 2, 2, 3, 3, 3, 4, 4]
+
+    # Removal forgets the backoff
+    cache.refresh([], read_serials)
+    assert cache.retries == {}
+
+
+def test_devicecache_evict_on_removal() -> None:
+    cache = DeviceCache()
+    cache.refresh(["1-2@5"], lambda: {"1-2@5": 12345678})
+
+    # Removal never opens a device
+    read_serials = MagicMock()
+    cache.refresh([], read_serials)
+    assert cache.serials() == set()
+    read_serials.assert_not_called()
+
+    # A re-insertion is read again
+    cache.refresh(["1-2@7"], lambda: {"1-2@7": 23456789})
+    assert cache.serials() == {23456789}
+
+    cache.clear()
+    assert cache.devices == {}
@@ -0,0 +1,50 @@
+from sciber_yklocker.models.dispatch import (
+    ABSENT_SUMMARY_INTERVAL,
+    ActionDispatcher,
+    DispatchEvent,
+)
+from sciber_yklocker.models.presence import PresenceState
+
+
+def test_dispatch_once_per_removal() -> None:
+    dispatcher = ActionDispatcher()
+    assert dispatcher.update(PresenceState.PRESENT, 0) == DispatchEvent.NONE
+    assert dispatcher.update(PresenceState.SUSPECT, 1) == DispatchEvent.NONE
+    assert dispatcher.update(PresenceState.ABSENT, 2) == DispatchEvent.REMOVED
+
+    # No repeated actions or log lines while the YubiKey stays away
+    for now in range(3, ABSENT_SUMMARY_INTERVAL):
+        assert dispatcher.update(PresenceState.ABSENT, now) == DispatchEvent.NONE
+    assert dispatcher.absent_for(12) == 10
+
+    assert dispatcher.update(PresenceState.PRESENT, 32) == DispatchEvent.RETURNED
+    assert dispatcher.last_absence == 30
+    assert dispatcher.absent_for(33) == 0
+
+    # The next removal is a new edge
+    assert dispatcher.update(PresenceState.ABSENT, 40) == DispatchEvent.REMOVED
+
+
+def test_dispatch_summary() -> None:
+    dispatcher = ActionDispatcher()
+    dispatcher.update(PresenceState.ABSENT, 0)
+    event = dispatcher.update(PresenceState.ABSENT, ABSENT_SUMMARY_INTERVAL)
+    assert event == DispatchEvent.STILL_ABSENT
+    event = dispatcher.update(PresenceState.ABSENT, ABSENT_SUMMARY_INTERVAL + 1)
+    assert event == DispatchEvent.NONE
+
+
+def test_dispatch_rearm() -> None:
+    dispatcher = ActionDispatcher(rearm_interval=60)
+    assert dispatcher.update(PresenceState.ABSENT, 0) == DispatchEvent.REMOVED
+    assert dispatcher.update(PresenceState.ABSENT, 30) == DispatchEvent.NONE
+    assert dispatcher.update(PresenceState.ABSENT, 60) == DispatchEvent.REARMED
+    assert dispatcher.update(PresenceState.ABSENT, 90) == DispatchEvent.NONE
+    assert dispatcher.update(PresenceState.ABSENT, 125) == DispatchEvent.REARMED
+
+
+def test_dispatch_suspect_does_not_end_removal() -> None:
+    dispatcher = ActionDispatcher()
+    dispatcher.update(PresenceState.ABSENT, 0)
+    assert dispatcher.update(PresenceState.SUSPECT, 1) == DispatchEvent.NONE
+    assert dispatcher.update(PresenceState.ABSENT, 2) == DispatchEvent.NONE
@@ -0,0 +1,140 @@
+from time import monotonic
+from unittest.mock import MagicMock, patch
+
+from sciber_yklocker.executor import ActionResult
+from sciber_yklocker.models.dispatch import DispatchEvent
+from sciber_yklocker.models.escalation import (
+    EscalationStep,
+    is_escalation_step,
+    parse_escalation,
+)
+from sciber_yklocker.models.myos import MyOS
+from sciber_yklocker.models.presence import PresenceState
+from sciber_yklocker.models.removaloption import RemovalOption
+from sciber_yklocker.models.yklock import YkLock
+from sciber_yklocker.runtime import (
+    handle_dispatch_event,
+    handle_escalation_step,
+    probe_delay,
+    run_runtime,
+)
+from sciber_yklocker.waker import WakeReason
+
+ESCALATION = (
+    EscalationStep(5, removal_option=RemovalOption.LOCK),
+    EscalationStep(600, removal_option=RemovalOption.LOGOUT),
+    EscalationStep(3600, command=("notify", "--page")),
+)
+
+
+def make_yklocker() -> YkLock:
+    yklocker = YkLock()
+    yklocker.logger = MagicMock()
+    yklocker.lock = MagicMock()
+    yklocker.act_on = MagicMock()
+    yklocker.set_escalation(ESCALATION)
+    return yklocker
+
+
+def test_is_escalation_step() -> None:
+    assert is_escalation_step({"after": 5, "action": "Lock"})
+    assert is_escalation_step({"after": 0.5, "command": ["notify", "--page"]})
+    assert not is_escalation_step({"after": 5})
+    assert not is_escalation_step({"after": True, "action": "Lock"})
+    assert not is_escalation_step({"after": 5, "action": "Lock", "when": "now"})
+    assert not is_escalation_step({"after": 5, "command": ["notify", ""]})
+    assert not is_escalation_step(["after", 5])
+
+    steps = parse_escalation(
+        [{"after": 60, "command": ["a"]}, {"after": 1, "action": "Logout"}]
+    )
+    assert steps == (
+        EscalationStep(1, removal_option=RemovalOption.LOGOUT),
+        EscalationStep(60, command=("a",)),
+    )
+    assert [step.describe() for step in steps] == ["Logout after 1 s", "a after 60 s"]
+
+
+def test_dispatch_schedules_steps() -> None:
+    yklocker = make_yklocker()
+    yklocker.dispatch(PresenceState.PRESENT, 0)
+    assert yklocker.dispatch(PresenceState.ABSENT, 100) == DispatchEvent.REMOVED
+    assert len(yklocker.timers) == 3
+    assert yklocker.timers.next_deadline() == 105
+
+    # The loop sleeps until the next step, not the next probe
+    yklocker.schedule.next_delay = MagicMock(return_value=10)
+    assert probe_delay(yklocker, PresenceState.ABSENT, 102) == 3
+    assert yklocker.timers.pop_due(105) == [ESCALATION[0]]
+    assert probe_delay(yklocker, PresenceState.ABSENT, 105) == 10
+
+    # Back before the rest was due
+    assert yklocker.dispatch(PresenceState.PRESENT, 200) == DispatchEvent.RETURNED
+    assert len(yklocker.timers) == 0
+    assert yklocker.timers.pop_due(10000) == []
+
+
+def test_pause_cancels_steps() -> None:
+    yklocker = make_yklocker()
+    yklocker.dispatch(PresenceState.ABSENT, 0)
+    yklocker.pause(60, 1)
+    yklocker.dispatch(PresenceState.ABSENT, 2)
+    assert len(yklocker.timers) == 0
+
+
+def test_handle_escalation() -> None:
+    yklocker = make_yklocker()
+
+    # A removal only starts the chain
+    handle_dispatch_event(yklocker, DispatchEvent.REMOVED, 0)
+    assert "escalating: Lock after 5 s, Logout after 600 s" in (
+        yklocker.logger.call_args[0][0]
+    )
+    handle_dispatch_event(yklocker, DispatchEvent.REARMED, 60)
+    yklocker.lock.assert_not_called()
+    assert yklocker.metrics.removals == 1
+
+    handle_escalation_step(yklocker, ESCALATION[1], monotonic())
+    yklocker.act_on.assert_called_once_with(RemovalOption.LOGOUT)
+    assert yklocker.metrics.actions[RemovalOption.LOGOUT] == 1
+
+    with patch("sciber_yklocker.runtime.ACTIONS.run") as mock_run:
+        mock_run.return_value = ActionResult(("notify", "--page"), returncode=1)
+        handle_escalation_step(yklocker, ESCALATION[2], monotonic())
+        mock_run.assert_called_once_with(("notify", "--page"))
+    assert "Escalation command failed" in yklocker.logger.call_args[0][0]
+
+
+def test_runtime_sleeps_until_the_next_step() -> None:
+    yklocker = make_yklocker()
+    yklocker.set_escalation(
+        (
+            EscalationStep(0, removal_option=RemovalOption.LOCK),
+            EscalationStep(0.2, removal_option=RemovalOption.LOGOUT),
+            EscalationStep(60, command=("notify",)),
+        )
+    )
+    probes: list[float] = []
+
+    def probe() -> bool:
+        probes.append(monotonic())
+        return False
+
+    yklocker.is_yubikey_connected = probe
+
+    def keep_running(yklocker: YkLock) -> bool:
+        if not probes:
+            yklocker.get_waker().wake(WakeReason.PROBE)
+        return len(probes) < 2
+
+    # Without the steps the next probe would be 10 s later
+    with patch("platform.system", MagicMock(return_value=MyOS.LX)):
+        run_runtime(yklocker, keep_running)
+
+    assert [call[0][0] for call in yklocker.act_on.call_args_list] == [
+        RemovalOption.LOCK,
+        RemovalOption.LOGOUT,
+    ]
+    assert 0.2 <= probes[1] - probes[0] < 2
+    # The hook is still waiting
+    assert len(yklocker.timers) == 1
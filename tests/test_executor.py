@@ -0,0 +1,114 @@
+import os
+import platform
+import subprocess
+import sys
+import threading
+from unittest.mock import MagicMock
+
+import pytest
+
+from sciber_yklocker.executor import ActionExecutor, ActionResult
+from sciber_yklocker.models.myos import MyOS
+
+PYTHON = sys.executable
+
+
+def test_action_result() -> None:
+    assert ActionResult(("lock",), 0).ok
+    assert not ActionResult(("lock",), 1).ok
+    assert not ActionResult(("lock",), timed_out=True).ok
+    assert str(ActionResult(("lock",), 1)) == "lock: exit status 1"
+    assert str(ActionResult(("lock",), timed_out=True)) == "lock: timed out"
+    assert str(ActionResult(("lock",), error="missing")) == "lock: missing"
+
+
+def test_run_exit_status() -> None:
+    executor = ActionExecutor()
+    assert executor.run([PYTHON, "-c", "pass"]).returncode == 0
+    assert executor.run([PYTHON, "-c", "raise SystemExit(3)"]).returncode == 3
+
+
+def test_run_no_shell() -> None:
+    # Arguments are passed as they are, never through a shell
+    executor = ActionExecutor()
+    argv = [PYTHON, "-c", "import sys; sys.exit(sys.argv[1] != '$(id)')", "$(id)"]
+    assert executor.run(argv).ok
+
+
+def test_run_missing_command() -> None:
+    result = ActionExecutor().run(["/nonexistent/yklocker-lock"])
+    assert result.returncode is None
+    assert result.error
+
+
+def test_run_timeout() -> None:
+    executor = ActionExecutor(timeout=0.1)
+    result = executor.run([PYTHON, "-c", "import time; time.sleep(30)"])
+    assert result.timed_out
+    assert result.returncode is None
+    assert executor.orphans == []
+
+
+def test_run_reaps_unkillable_later() -> None:
+    process = MagicMock()
+    process.wait.side_effect = subprocess.TimeoutExpired("lock", 0)
+    process.poll.return_value = None
+    executor = ActionExecutor(spawn=lambda argv: process)
+
+    assert executor.run(["lock"], timeout=0).timed_out
+    process.kill.assert_called_once()
+    assert executor.orphans == [process]
+    process.close.assert_not_called()
+
+    # Still running, kept for later
+    executor.reap()
+    assert executor.orphans == [process]
+
+    process.poll.return_value = -9
+    executor.reap()
+    assert executor.orphans == []
+    process.close.assert_called_once()
+
+
+def test_run_bounded() -> None:
+    started = threading.Event()
+    release = threading.Event()
+    process = MagicMock()
+
+    def wait(timeout):
+        started.set()
+        release.wait(5)
+        return 0
+
+    process.wait.side_effect = wait
+    executor = ActionExecutor(max_running=1, spawn=lambda argv: process)
+    thread = threading.Thread(target=executor.run, args=(["lock"],))
+    thread.start()
+    started.wait(5)
+
+    # The only slot is taken
+    result = executor.run(["lock"], timeout=0.05)
+    assert result.error == "too many actions running"
+
+    release.set()
+    thread.join()
+    assert executor.run(["lock"]).ok
+
+
+def test_run_soak() -> None:
+    # Many actions leave neither file descriptors nor zombies behind
+    if platform.system() != MyOS.LX:
+        return
+    executor = ActionExecutor(timeout=5)
+    executor.run([PYTHON, "-c", "pass"])
+    fds = len(os.listdir("/proc/self/fd"))
+
+    for i in range(50):
+        argv = [PYTHON, "-c", f"raise SystemExit({i % 2})"]
+        assert executor.run(argv).returncode == i % 2
+    executor.run([PYTHON, "-c", "import time; time.sleep(30)"], timeout=0.05)
+
+    assert len(os.listdir("/proc/self/fd")) == fds
+    # Every child has been reaped already
+    with pytest.raises(ChildProcessError):
+        os.waitpid(-1, os.WNOHANG)
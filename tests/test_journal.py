@@ -0,0 +1,193 @@
+import json
+import os
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from sciber_yklocker.journal import (
+    BATCH_SIZE,
+    FLUSH_INTERVAL,
+    SYNC_INTERVAL,
+    Journal,
+    index_path,
+    journal_dir,
+    list_segments,
+    parse_when,
+    read_events,
+    run_query,
+    seek_offset,
+)
+from sciber_yklocker.models.dispatch import DispatchEvent
+from sciber_yklocker.models.myos import MyOS
+from sciber_yklocker.models.presence import PresenceState
+from sciber_yklocker.models.removaloption import RemovalOption
+from sciber_yklocker.models.yklock import YkLock
+from sciber_yklocker.runtime import handle_dispatch_event, run_runtime
+from sciber_yklocker.waker import WakeReason
+
+
+class Clock:
+    def __init__(self, now: float = 1700000000) -> None:
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_journal_dir() -> None:
+    with patch.dict(os.environ, {"XDG_STATE_HOME": "/home/user/.state"}):
+        assert journal_dir() == "/home/user/.state/sciber/yklocker"
+
+
+def test_batched_writes(tmp_path) -> None:
+    journal = Journal(str(tmp_path), clock=Clock())
+    journal.record("removed")
+    journal.update(0)
+    # Nothing written until the batch waited long enough
+    assert list_segments(str(tmp_path)) == []
+
+    journal.update(FLUSH_INTERVAL)
+    [(start, path)] = list_segments(str(tmp_path))
+    assert start == 1700000000
+    with open(path) as f:
+        assert json.loads(f.read()) == {"time": 1700000000, "event": "removed"}
+
+    # A full batch is written right away
+    for _ in range(BATCH_SIZE):
+        journal.record("action", removal_option=RemovalOption.LOCK)
+    with patch("os.fsync") as mock_fsync:
+        journal.update(FLUSH_INTERVAL + 1)
+        assert len(list(read_events(str(tmp_path)))) == BATCH_SIZE + 1
+        # Synced on the interval, not per write
+        mock_fsync.assert_not_called()
+        journal.update(SYNC_INTERVAL)
+        assert mock_fsync.call_count == 2
+    journal.close()
+
+
+def test_rotation(tmp_path) -> None:
+    clock = Clock()
+    journal = Journal(str(tmp_path), clock=clock, max_segment_size=200, max_segments=3)
+    for second in range(40):
+        clock.now = 1700000000 + second
+        journal.record("probe_error", reason="stalled", seconds=5)
+        journal.flush()
+    journal.close()
+
+    segments = list_segments(str(tmp_path))
+    assert len(segments) == 3
+    assert len(os.listdir(tmp_path)) == 6
+    # Only the oldest events are gone
+    events = list(read_events(str(tmp_path)))
+    assert events[-1]["time"] == 1700000039
+    assert events[0]["time"] == segments[0][0]
+
+
+def test_query_seeks(tmp_path) -> None:
+    clock = Clock()
+    journal = Journal(str(tmp_path), clock=clock)
+    for second in range(100):
+        clock.now = 1700000000 + second
+        journal.record("returned", absent_for=second)
+        journal.flush()
+    journal.close()
+
+    [(_, path)] = list_segments(str(tmp_path))
+    offset = seek_offset(path, 1700000050)
+    with open(path, "rb") as f:
+        f.seek(offset)
+        assert json.loads(f.readline())["time"] == 1700000050
+    assert seek_offset(path, 1600000000) == 0
+
+    events = list(read_events(str(tmp_path), 1700000090, 1700000095))
+    assert [event["absent_for"] for event in events] == [90, 91, 92, 93, 94]
+
+
+def test_restart_continues_segment(tmp_path) -> None:
+    journal = Journal(str(tmp_path), clock=Clock())
+    journal.record("started")
+    journal.close()
+    # Cut short by a crash
+    [(_, path)] = list_segments(str(tmp_path))
+    with open(path, "ab") as f:
+        f.write(b'{"time": 17000')
+
+    journal = Journal(str(tmp_path), clock=Clock(1700000100))
+    journal.record("started")
+    journal.close()
+    assert len(list_segments(str(tmp_path))) == 1
+    assert [event["time"] for event in read_events(str(tmp_path))] == [
+        1700000000,
+        1700000100,
+    ]
+    assert os.path.exists(index_path(path))
+
+
+def test_parse_when() -> None:
+    assert parse_when("30m", 10000) == 8200
+    assert parse_when("1d", 100000) == 13600
+    assert parse_when("2024-05-01T08:00:00+00:00", 0) == 1714550400
+    with pytest.raises(ValueError):
+        parse_when("last week", 0)
+
+
+def test_run_query(tmp_path, capsys) -> None:
+    journal = Journal(str(tmp_path), clock=Clock())
+    journal.record("removed")
+    journal.record("action", removal_option=RemovalOption.LOCK, latency=0.2)
+    journal.record("action", removal_option=RemovalOption.LOCK, latency=0.4)
+    journal.close()
+
+    with patch("time.time", return_value=1700000100):
+        assert run_query(["--since", "1h", "--dir", str(tmp_path)]) == 0
+        output = capsys.readouterr().out.splitlines()
+        assert len(output) == 3
+        assert output[1].endswith("action removal_option=Lock latency=0.2")
+
+        assert run_query(["--since", "1m", "--dir", str(tmp_path)]) == 0
+        assert capsys.readouterr().out == ""
+
+    assert run_query(["--summary", "--dir", str(tmp_path)]) == 0
+    output = capsys.readouterr().out
+    assert "action: 2\nremoved: 1" in output
+    assert "median 0.400 s, max 0.400 s" in output
+
+    assert run_query(["--event", "removed", "--json", "--dir", str(tmp_path)]) == 0
+    assert json.loads(capsys.readouterr().out)["event"] == "removed"
+
+    assert run_query(["--since", "yesterday", "--dir", str(tmp_path)]) == 1
+
+
+def test_runtime_records(tmp_path) -> None:
+    yklocker = YkLock()
+    yklocker.logger = MagicMock()
+    yklocker.lock = MagicMock()
+    yklocker.set_removal_option(RemovalOption.LOCK)
+    yklocker.set_journal(Journal(str(tmp_path)))
+    connected = iter([True, False])
+    yklocker.is_yubikey_connected = lambda: next(connected, True)
+    count = 0
+
+    def keep_running(yklocker: YkLock) -> bool:
+        nonlocal count
+        count += 1
+        yklocker.get_waker().wake(WakeReason.PROBE)
+        return count <= 3
+
+    with patch("platform.system", MagicMock(return_value=MyOS.LX)):
+        run_runtime(yklocker, keep_running)
+    yklocker.get_journal().close()
+
+    events = list(read_events(str(tmp_path)))
+    assert [event["event"] for event in events] == ["removed", "action", "returned"]
+    assert events[1]["removal_option"] == "Lock"
+    assert events[1]["repeated"] is False
+    assert yklocker.get_presence_state() == PresenceState.PRESENT
+
+
+def test_no_journal() -> None:
+    # Recording without a journal does nothing
+    yklocker = YkLock()
+    yklocker.logger = MagicMock()
+    yklocker.record("removed")
+    handle_dispatch_event(yklocker, DispatchEvent.RETURNED, 0)
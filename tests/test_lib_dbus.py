@@ -0,0 +1,184 @@
+import platform
+from time import sleep
+
+import pytest
+
+from sciber_yklocker.lib.dbus import (
+    METHOD_CALL,
+    BusClient,
+    DBusConnection,
+    DBusError,
+    Message,
+    Reader,
+    Writer,
+    decode_message,
+    message_length,
+    parse_address,
+    split_signature,
+)
+from sciber_yklocker.models.myos import MyOS
+
+
+def test_split_signature() -> None:
+    assert split_signature("") == []
+    assert split_signature("su") == ["s", "u"]
+    assert split_signature("a(susso)a{sv}v") == ["a(susso)", "a{sv}", "v"]
+    assert split_signature("(a{s(ii)}b)y") == ["(a{s(ii)}b)", "y"]
+
+
+def test_marshal_roundtrip() -> None:
+    signature = "ybnqiuxtdsogva(su)a{sv}"
+    values = [
+        7,
+        True,
+        -2,
+        3,
+        -4,
+        5,
+        -6,
+        7,
+        0.5,
+        "text",
+        "/org/x",
+        "a{sv}",
+        ("s", "variant"),
+        [("one", 1), ("two", 2)],
+        {"LockedHint": ("b", True), "Id": ("s", "3")},
+    ]
+    writer = Writer()
+    for type_code, value in zip(split_signature(signature), values):
+        writer.write(type_code, value)
+
+    reader = Reader(bytes(writer.buf))
+    decoded = [reader.read(type_code) for type_code in split_signature(signature)]
+    # Variants are read back as plain values
+    values[12] = "variant"
+    values[13] = [("one", 1), ("two", 2)]
+    values[14] = {"LockedHint": True, "Id": "3"}
+    assert decoded == values
+    assert reader.offset == len(writer.buf)
+
+
+def test_message_roundtrip() -> None:
+    message = Message(
+        METHOD_CALL,
+        42,
+        {1: "/org/gnome/SessionManager", 3: "Logout", 8: "u"},
+        [1],
+    )
+    data = message.encode()
+    assert message_length(data[:16]) == len(data)
+
+    decoded = decode_message(data)
+    assert decoded.serial == 42
+    assert decoded.path == "/org/gnome/SessionManager"
+    assert decoded.member == "Logout"
+    assert decoded.body == [1]
+
+    # A truncated or garbled message breaks the connection, not the caller
+    with pytest.raises(ConnectionError):
+        decode_message(data[:-2])
+    with pytest.raises(ConnectionError):
+        decode_message(data[:12] + b"\xff" * (len(data) - 12))
+
+
+def test_parse_address() -> None:
+    assert parse_address("unix:path=/run/user/1000/bus") == ["/run/user/1000/bus"]
+    assert parse_address("unix:abstract=/tmp/dbus-x,guid=01;tcp:host=a") == [
+        b"\0/tmp/dbus-x"
+    ]
+    assert parse_address("unix:path=/tmp/a%20b") == ["/tmp/a b"]
+    assert parse_address("tcp:host=localhost,port=1") == []
+
+
+def test_dbus_connection_call(stand_in_bus) -> None:
+    stand_in_bus.handlers[("org.test", "Echo")] = lambda m: ("s", [m.body[0] * 2])
+    connection = DBusConnection(stand_in_bus.address)
+    assert connection.unique_name == ":1.1"
+
+    assert connection.call("org.test", "/", "org.test", "Echo", "s", ("ab",)) == [
+        "abab"
+    ]
+    assert stand_in_bus.calls[0].signature == "s"
+
+    stand_in_bus.errors[("org.test", "Fail")] = "org.test.Error"
+    with pytest.raises(DBusError) as e:
+        connection.call("org.test", "/", "org.test", "Fail")
+    assert e.value.name == "org.test.Error"
+    connection.close()
+
+
+def test_dbus_connection_keeps_signals(stand_in_bus) -> None:
+    connection = DBusConnection(stand_in_bus.address)
+
+    def reply_after_signal(message):
+        stand_in_bus.emit("/org/test", "org.test", "Changed", "b", [True])
+        return "", []
+
+    stand_in_bus.handlers[("org.test", "Ping")] = reply_after_signal
+    connection.call("org.test", "/", "org.test", "Ping")
+    signal = connection.signals.popleft()
+    assert signal.member == "Changed"
+    assert signal.body == [True]
+    connection.close()
+
+
+def test_dbus_connection_refused(tmp_path) -> None:
+    if platform.system() != MyOS.WIN:
+        with pytest.raises(OSError):
+            DBusConnection("unix:path=" + str(tmp_path / "missing"))
+        with pytest.raises(ConnectionError):
+            DBusConnection("tcp:host=localhost,port=1")
+
+
+def test_bus_client_reconnects(stand_in_bus) -> None:
+    client = BusClient(lambda: stand_in_bus.address)
+    client.call("org.test", "/", "org.test", "First")
+    connection = client.connection
+
+    # The bus went away and came back, the call is retried on a new connection
+    stand_in_bus.disconnect_clients()
+    client.call("org.test", "/", "org.test", "Second")
+    assert client.connection is not connection
+    assert stand_in_bus.members() == ["First", "Second"]
+    client.close()
+    assert client.connection is None
+
+
+def test_bus_client_never_resends(stand_in_bus) -> None:
+    client = BusClient(lambda: stand_in_bus.address)
+
+    def drop_connection(message):
+        stand_in_bus.disconnect_clients()
+        return "", []
+
+    # The call was delivered but the reply was lost, it must not run twice
+    stand_in_bus.handlers[("org.test", "Lock")] = drop_connection
+    with pytest.raises(ConnectionError):
+        client.call("org.test", "/", "org.test", "Lock")
+    assert stand_in_bus.members() == ["Lock"]
+    assert client.connection is None
+
+
+def test_bus_client_no_address() -> None:
+    with pytest.raises(ConnectionError):
+        BusClient(lambda: None).call("org.test", "/", "org.test", "Call")
+
+
+def test_dbus_connection_receive_signals(stand_in_bus) -> None:
+    connection = DBusConnection(stand_in_bus.address)
+    connection.add_match("type='signal',interface='org.test'")
+    assert stand_in_bus.calls[0].body == ["type='signal',interface='org.test'"]
+    assert connection.receive_signals() == []
+
+    stand_in_bus.emit("/org/test", "org.test", "Changed", "b", [True])
+    signals = []
+    for _ in range(500):
+        signals = connection.receive_signals()
+        if signals:
+            break
+        sleep(0.01)
+    assert [signal.member for signal in signals] == ["Changed"]
+    # Still blocking for method calls
+    assert connection.sock.gettimeout() == connection.timeout
+    connection.close()
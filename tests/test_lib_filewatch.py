@@ -0,0 +1,92 @@
+import os
+import platform
+import select
+
+import pytest
+
+from sciber_yklocker.models.myos import MyOS
+
+if platform.system() != MyOS.WIN:
+    from sciber_yklocker.lib.filewatch import (
+        InotifyWatcher,
+        KqueueWatcher,
+        PollWatcher,
+        open_file_watcher,
+        watch_targets,
+    )
+
+    def wait_changed(watcher, timeout: float = 2) -> bool:
+        # Wait like the waker would, then drain
+        readable, _, _ = select.select([watcher], [], [], timeout)
+        return bool(readable) and watcher.drain()
+
+    @pytest.fixture(params=["native", "poll"])
+    def watcher_type(request):
+        if request.param == "poll":
+            return lambda paths: PollWatcher(paths, interval=0.01)
+        if platform.system() == MyOS.LX:
+            return InotifyWatcher
+        if platform.system() == MyOS.MAC:
+            return KqueueWatcher
+        pytest.skip("No native file watcher")
+
+    def test_watch_targets(tmp_path) -> None:
+        user = tmp_path / "config" / "sciber" / "yklocker.toml"
+        system = tmp_path / "yklocker.toml"
+        # The missing directories are waited for in their closest parent
+        assert watch_targets([str(user), str(system)]) == {
+            str(tmp_path): {"config", "yklocker.toml"}
+        }
+
+        user.parent.mkdir(parents=True)
+        assert watch_targets([str(user)]) == {str(user.parent): {"yklocker.toml"}}
+
+    def test_watcher_write(tmp_path, watcher_type) -> None:
+        path = tmp_path / "yklocker.toml"
+        watcher = watcher_type([str(path)])
+        try:
+            path.write_text("timeout = 10\n")
+            assert wait_changed(watcher)
+            assert not watcher.drain()
+
+            # Replaced like an editor does
+            (tmp_path / "yklocker.toml.new").write_text("timeout = 20\n")
+            os.replace(tmp_path / "yklocker.toml.new", path)
+            assert wait_changed(watcher)
+
+            path.unlink()
+            assert wait_changed(watcher)
+        finally:
+            watcher.close()
+
+    def test_watcher_ignores_other_files(tmp_path) -> None:
+        if platform.system() != MyOS.LX:
+            # kqueue only knows that the directory changed
+            return
+        watcher = InotifyWatcher([str(tmp_path / "yklocker.toml")])
+        try:
+            (tmp_path / "other.toml").write_text("")
+            assert not wait_changed(watcher, 0.1)
+        finally:
+            watcher.close()
+
+    def test_watcher_directory_created(tmp_path, watcher_type) -> None:
+        path = tmp_path / "sciber" / "yklocker.toml"
+        watcher = watcher_type([str(path)])
+        try:
+            path.parent.mkdir()
+            if not isinstance(watcher, PollWatcher):
+                # Polling only looks at the file itself
+                assert wait_changed(watcher)
+
+            # The new directory is watched from now on
+            path.write_text("timeout = 10\n")
+            assert wait_changed(watcher)
+        finally:
+            watcher.close()
+
+    def test_open_file_watcher(tmp_path) -> None:
+        watcher = open_file_watcher([str(tmp_path / "yklocker.toml")])
+        if platform.system() == MyOS.LX:
+            assert isinstance(watcher, InotifyWatcher)
+        watcher.close()
@@ -5,22 +5,140 @@ from sciber_yklocker.models.myos import MyOS
 if platform.system() == MyOS.LX:
     from unittest.mock import MagicMock, patch
 
-    from sciber_yklocker.lib.lx import lock_system, log_message, os
+    import pytest
+
+    from sciber_yklocker.actuator import ActuatorError
+    from sciber_yklocker.executor import ActionResult
+    from sciber_yklocker.lib import lx
+    from sciber_yklocker.lib.dbus import BUS_INTERFACE, BusClient
+    from sciber_yklocker.lib.lx import (
+        ACTIONS,
+        build_actuator,
+        lock_system,
+        log_message,
+        open_buses,
+    )
     from sciber_yklocker.models.removaloption import RemovalOption
 
-    def test_lock_system_lock() -> None:
+    @pytest.fixture
+    def no_buses():
+        # Neither bus is reachable, the dbus-send fallback is used
+        with patch.object(lx, "SESSION_BUS", BusClient(lambda: None)), patch.object(
+            lx, "SYSTEM_BUS", BusClient(lambda: None)
+        ):
+            yield
+
+    @pytest.fixture
+    def buses(stand_in_bus):
+        stand_in_bus.owners = {
+            "org.gnome.ScreenSaver",
+            "org.gnome.SessionManager",
+            "org.freedesktop.login1",
+        }
+        stand_in_bus.handlers[(BUS_INTERFACE, "NameHasOwner")] = lambda m: (
+            "b",
+            [m.body[0] in stand_in_bus.owners],
+        )
+        client = BusClient(lambda: stand_in_bus.address)
+        with patch.object(lx, "SESSION_BUS", client), patch.object(
+            lx, "SYSTEM_BUS", client
+        ):
+            yield stand_in_bus
+        client.close()
+
+    def test_lock_system_lock(no_buses) -> None:
         # Test Linux lock
-        with patch.object(os, "popen") as mock_popen:
+        with patch.object(ACTIONS, "run") as mock_run:
             lock_system(RemovalOption.LOCK)
-            mock_popen.assert_called_once()
-            assert "ScreenSaver.Lock" in mock_popen.call_args[0][0]
+            mock_run.assert_called_once()
+            assert "org.gnome.ScreenSaver.Lock" in mock_run.call_args[0][0]
 
-    def test_lock_system_logout() -> None:
+    def test_lock_system_logout(no_buses) -> None:
         # Test Linux logout
-        with patch.object(os, "popen") as mock_popen:
+        with patch.object(ACTIONS, "run") as mock_run:
             lock_system(RemovalOption.LOGOUT)
-            mock_popen.assert_called_once()
-            assert "SessionManager.Logout" in mock_popen.call_args[0][0]
+            mock_run.assert_called_once()
+            assert "org.gnome.SessionManager.Logout" in mock_run.call_args[0][0]
+
+    def test_lock_system_failed(no_buses) -> None:
+        result = ActionResult(("dbus-send",), error="No such file or directory")
+        with patch.object(ACTIONS, "run", return_value=result):
+            with patch.object(lx, "log_message") as mock_log:
+                lock_system(RemovalOption.LOCK)
+                assert "Lock action failed: dbus-send" in mock_log.call_args[0][0]
+
+    def test_actuator_lock_dbus(buses) -> None:
+        actuator = build_actuator(RemovalOption.LOCK)
+        actuator.validate()
+        buses.calls.clear()
+        with patch.object(ACTIONS, "run") as mock_run:
+            actuator.act()
+            actuator.act()
+            mock_run.assert_not_called()
+        assert buses.members() == ["Lock", "Lock"]
+        assert buses.calls[0].path == "/org/gnome/ScreenSaver"
+        # Both locks went over the same connection
+        assert len(buses.clients) == 1
+
+    def test_actuator_lock_logind(buses) -> None:
+        # Not GNOME, logind is asked first
+        buses.owners.remove("org.gnome.ScreenSaver")
+        actuator = build_actuator(RemovalOption.LOCK)
+        actuator.validate()
+        buses.calls.clear()
+        actuator.act()
+        assert buses.members() == ["Lock"]
+        assert buses.calls[0].interface == "org.freedesktop.login1.Session"
+        assert buses.calls[0].path == "/org/freedesktop/login1/session/auto"
+
+    def test_lock_system_lock_fallback(buses) -> None:
+        # The screensaver is running but refuses, logind locks instead
+        buses.errors[("org.gnome.ScreenSaver", "Lock")] = "org.Error.Failed"
+        with patch.object(ACTIONS, "run") as mock_run:
+            lock_system(RemovalOption.LOCK)
+            mock_run.assert_not_called()
+        assert buses.calls[-1].interface == "org.freedesktop.login1.Session"
+
+    def test_actuator_logout_dbus(buses) -> None:
+        actuator = build_actuator(RemovalOption.LOGOUT)
+        actuator.validate()
+        buses.calls.clear()
+        with patch.object(ACTIONS, "run") as mock_run:
+            actuator.act()
+            mock_run.assert_not_called()
+        assert buses.members() == ["Logout"]
+        assert buses.calls[0].body == [1]
+
+    def test_actuator_reconnects(buses) -> None:
+        actuator = build_actuator(RemovalOption.LOCK)
+        actuator.validate()
+        buses.calls.clear()
+        actuator.act()
+        buses.disconnect_clients()
+        with patch.object(ACTIONS, "run") as mock_run:
+            actuator.act()
+            mock_run.assert_not_called()
+        assert buses.members() == ["Lock", "Lock"]
+
+    def test_actuator_validate(no_buses) -> None:
+        actuator = build_actuator(RemovalOption.LOGOUT)
+        with patch.object(lx.shutil, "which", return_value="/usr/bin/dbus-send"):
+            actuator.validate()
+        assert actuator.argv[0] == "/usr/bin/dbus-send"
+
+        # No D-Bus and no dbus-send, locking can not work
+        actuator = build_actuator(RemovalOption.LOCK)
+        with patch.object(lx.shutil, "which", return_value=None):
+            with pytest.raises(ActuatorError):
+                actuator.validate()
+
+        build_actuator(RemovalOption.NOTHING).validate()
+
+    def test_open_buses(no_buses) -> None:
+        with patch.object(lx, "log_message") as mock_log:
+            open_buses()
+            assert mock_log.call_count == 2
+            assert "Could not connect to D-Bus" in mock_log.call_args[0][0]
 
     def test_log_message() -> None:
         with patch("sciber_yklocker.lib.lx.syslog", MagicMock()) as mock_print:
@@ -3,6 +3,7 @@ import platform
 from sciber_yklocker.models.myos import MyOS
 
 if platform.system() == MyOS.MAC:
+    import os
     from unittest.mock import MagicMock, patch
 
     from sciber_yklocker.lib.mac import lock_system, log_message
@@ -13,6 +14,13 @@ if platform.system() == MyOS.MAC:
         lock_system(RemovalOption.LOCK)
         mock_CDLL.assert_called_once()
 
+    @patch("sciber_yklocker.lib.mac.ACTIONS")
+    def test_lock_system_logout(mock_actions) -> None:
+        lock_system(RemovalOption.LOGOUT)
+        argv = mock_actions.run.call_args[0][0]
+        assert argv[:2] == ["/bin/launchctl", "bootout"]
+        assert argv[2] == f"user/{os.getuid()}"
+
     def test_log_message() -> None:
         with patch("sciber_yklocker.lib.mac.os_log", MagicMock()) as mock_print:
             log_message("testmessage")
@@ -0,0 +1,177 @@
+import threading
+from time import monotonic, sleep
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from sciber_yklocker.lib.dbus import DBusError
+from sciber_yklocker.lib.session import (
+    LOGIND_SESSION,
+    PROPERTIES,
+    SCREENSAVER,
+    SCREENSAVER_PATH,
+    LogindLockWatcher,
+    ScreenSaverLockWatcher,
+)
+from sciber_yklocker.main import watch_session_lock
+from sciber_yklocker.models.myos import MyOS
+from sciber_yklocker.models.presence import PresenceState
+from sciber_yklocker.models.yklock import YkLock
+from sciber_yklocker.runtime import LOCKED_INTERVAL, next_probe_interval, run_runtime
+from sciber_yklocker.waker import WakeReason
+
+SESSION = "/org/freedesktop/login1/session/_32"
+
+
+def logind(bus, locked: bool = False) -> LogindLockWatcher:
+    bus.handlers[("org.freedesktop.login1.Manager", "GetSession")] = lambda m: (
+        "o",
+        [SESSION],
+    )
+    bus.handlers[(PROPERTIES, "Get")] = lambda m: ("v", [("b", locked)])
+    return LogindLockWatcher(bus.address)
+
+
+def emit_locked_hint(bus, locked: bool, path: str = SESSION) -> None:
+    bus.emit(
+        path,
+        PROPERTIES,
+        "PropertiesChanged",
+        "sa{sv}as",
+        [LOGIND_SESSION, {"LockedHint": ("b", locked)}, []],
+    )
+
+
+def drain(watcher, timeout: float = 5) -> bool:
+    # Signals arrive on the bus's thread
+    deadline = monotonic() + timeout
+    while monotonic() < deadline:
+        if watcher.drain():
+            return True
+        sleep(0.01)
+    return False
+
+
+def test_logind_lock_watcher(stand_in_bus) -> None:
+    watcher = logind(stand_in_bus, locked=True)
+    assert watcher.locked
+    assert stand_in_bus.members() == ["GetSession", "AddMatch", "AddMatch", "Get"]
+    assert f"path='{SESSION}'" in stand_in_bus.calls[1].body[0]
+
+    # Another session, and other properties, change nothing
+    emit_locked_hint(stand_in_bus, False, "/org/freedesktop/login1/session/_1")
+    stand_in_bus.emit(
+        SESSION,
+        PROPERTIES,
+        "PropertiesChanged",
+        "sa{sv}as",
+        [LOGIND_SESSION, {"IdleHint": ("b", True)}, []],
+    )
+    assert not drain(watcher, 0.2)
+    assert watcher.locked
+
+    emit_locked_hint(stand_in_bus, False)
+    assert drain(watcher)
+    assert not watcher.locked
+
+    stand_in_bus.emit(SESSION, LOGIND_SESSION, "Lock")
+    assert drain(watcher)
+    assert watcher.locked
+    watcher.close()
+
+
+def test_screensaver_lock_watcher(stand_in_bus) -> None:
+    stand_in_bus.handlers[(SCREENSAVER, "GetActive")] = lambda m: ("b", [False])
+    watcher = ScreenSaverLockWatcher(stand_in_bus.address)
+    assert not watcher.locked
+
+    stand_in_bus.emit(SCREENSAVER_PATH, SCREENSAVER, "ActiveChanged", "b", [True])
+    assert drain(watcher)
+    assert watcher.locked
+    watcher.close()
+
+    # Not GNOME
+    stand_in_bus.errors[(SCREENSAVER, "GetActive")] = "org.freedesktop.DBus.Error"
+    with pytest.raises(DBusError):
+        ScreenSaverLockWatcher(stand_in_bus.address)
+
+
+def test_locked_probe_interval() -> None:
+    yklocker = YkLock()
+    yklocker.set_probe_interval(2)
+    yklocker.set_session_locked(True)
+    assert next_probe_interval(yklocker, PresenceState.PRESENT) == LOCKED_INTERVAL
+    assert next_probe_interval(yklocker, PresenceState.ABSENT) == LOCKED_INTERVAL
+    # A removal is still confirmed quickly
+    assert next_probe_interval(yklocker, PresenceState.SUSPECT) < 2
+
+
+def test_runtime_suspends_probes_while_locked(stand_in_bus) -> None:
+    yklocker = YkLock()
+    yklocker.logger = MagicMock()
+    yklocker.set_probe_interval(0.05)
+    watcher = logind(stand_in_bus)
+    watch_session_lock(yklocker, [watcher])
+    assert not yklocker.get_session_locked()
+
+    probes: list[float] = []
+    locked = threading.Event()
+    unlocked_at: list[float] = []
+
+    def probe() -> bool:
+        probes.append(monotonic())
+        if len(probes) == 3:
+            emit_locked_hint(stand_in_bus, True)
+        return True
+
+    def keep_running(yklocker: YkLock) -> bool:
+        if yklocker.get_session_locked() and not locked.is_set():
+            locked.set()
+            threading.Timer(0.3, unlock).start()
+        return not unlocked_at or len(probes) < 4
+
+    def unlock() -> None:
+        unlocked_at.append(monotonic())
+        stand_in_bus.emit(SESSION, LOGIND_SESSION, "Unlock")
+
+    yklocker.is_yubikey_connected = probe
+    with patch("platform.system", MagicMock(return_value=MyOS.LX)):
+        run_runtime(yklocker, keep_running)
+
+    # Nothing probed while locked, and probed right away on unlock
+    assert probes[3] >= unlocked_at[0]
+    assert probes[3] - unlocked_at[0] < LOCKED_INTERVAL / 10
+    messages = [call[0][0] for call in yklocker.logger.call_args_list]
+    assert "Session locked, probing suspended" in messages
+    assert "Session unlocked, probing resumed" in messages
+    watcher.close()
+
+
+def test_lock_signals_lost(stand_in_bus) -> None:
+    yklocker = YkLock()
+    yklocker.logger = MagicMock()
+    watcher = logind(stand_in_bus, locked=True)
+    watch_session_lock(yklocker, [watcher])
+    assert yklocker.get_session_locked()
+
+    # The bus went away, probing goes back to normal
+    stand_in_bus.disconnect_clients()
+    assert yklocker.get_waker().wait(5) == {WakeReason.PROBE}
+    assert not yklocker.get_session_locked()
+    assert "unavailable" in yklocker.logger.call_args_list[0][0][0]
+    assert len(yklocker.get_waker().keys()) == 1
+
+
+def test_lock_signals_failed(stand_in_bus) -> None:
+    yklocker = YkLock()
+    yklocker.logger = MagicMock()
+    watcher = logind(stand_in_bus, locked=True)
+    watch_session_lock(yklocker, [watcher])
+
+    # Any error from the bus client drops the watcher, not the loop
+    watcher.drain = MagicMock(side_effect=DBusError("org.test.Failed"))
+    emit_locked_hint(stand_in_bus, False)
+    assert yklocker.get_waker().wait(5) == {WakeReason.PROBE}
+    assert not yklocker.get_session_locked()
+    assert len(yklocker.get_waker().keys()) == 1
+    watcher.close()
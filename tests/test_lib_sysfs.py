@@ -0,0 +1,84 @@
+from sciber_yklocker.lib.sysfs import (
+    hidraw_usb_device,
+    list_yubico_devices,
+    on_battery,
+    read_hex_attribute,
+    usb_fingerprint,
+)
+
+
+def make_usb_device(root, name: str, vendor_id: str, product_id: str) -> None:
+    device = root / name
+    device.mkdir()
+    (device / "idVendor").write_text(vendor_id + "\n")
+    (device / "idProduct").write_text(product_id + "\n")
+
+
+def test_read_hex_attribute(tmp_path) -> None:
+    (tmp_path / "good").write_text("1050\n")
+    (tmp_path / "bad").write_text("not hex\n")
+
+    assert read_hex_attribute(str(tmp_path / "good")) == 0x1050
+    assert read_hex_attribute(str(tmp_path / "bad")) is None
+    assert read_hex_attribute(str(tmp_path / "missing")) is None
+
+
+def test_list_yubico_devices(tmp_path) -> None:
+    make_usb_device(tmp_path, "usb1", "1d6b", "0002")
+    make_usb_device(tmp_path, "1-2", "1050", "0407")
+    make_usb_device(tmp_path, "1-3", "046d", "c52b")
+    make_usb_device(tmp_path, "2-1.4", "1050", "0406")
+    # Interfaces carry no ids
+    (tmp_path / "1-2:1.0").mkdir()
+
+    assert list_yubico_devices(str(tmp_path)) == {"1-2": 0x0407, "2-1.4": 0x0406}
+
+
+def test_list_yubico_devices_empty(tmp_path) -> None:
+    make_usb_device(tmp_path, "usb1", "1d6b", "0002")
+    assert list_yubico_devices(str(tmp_path)) == {}
+
+
+def test_usb_fingerprint(tmp_path) -> None:
+    make_usb_device(tmp_path, "1-2", "1050", "0407")
+    (tmp_path / "1-2" / "devnum").write_text("5\n")
+
+    assert usb_fingerprint("1-2", str(tmp_path)) == "1-2@5"
+    # Without a device number fall back to the bus path
+    assert usb_fingerprint("1-3", str(tmp_path)) == "1-3"
+
+
+def test_hidraw_usb_device(tmp_path) -> None:
+    device = tmp_path / "devices" / "usb1" / "1-2" / "1-2:1.1"
+    hidraw = device / "0003:1050:0407.0005" / "hidraw" / "hidraw3"
+    hidraw.mkdir(parents=True)
+    (tmp_path / "class").mkdir()
+    (tmp_path / "class" / "hidraw3").symlink_to(hidraw)
+
+    class_root = str(tmp_path / "class")
+    assert hidraw_usb_device("/dev/hidraw3", class_root) == "1-2"
+    assert hidraw_usb_device("/dev/hidraw4", class_root) is None
+
+
+def make_power_supply(root, name: str, **attributes: str) -> None:
+    supply = root / name
+    supply.mkdir()
+    for attribute, value in attributes.items():
+        (supply / attribute).write_text(value + "\n")
+
+
+def test_on_battery(tmp_path) -> None:
+    make_power_supply(tmp_path, "BAT0", type="Battery", status="Discharging")
+    assert on_battery(str(tmp_path)) is True
+
+    make_power_supply(tmp_path, "AC", type="Mains", online="1")
+    assert on_battery(str(tmp_path)) is False
+
+
+def test_on_battery_desktop(tmp_path) -> None:
+    assert on_battery(str(tmp_path)) is False
+    assert on_battery(str(tmp_path / "missing")) is False
+
+    make_power_supply(tmp_path, "BAT0", type="Battery", status="Full")
+    make_power_supply(tmp_path, "AC", type="Mains", online="0")
+    assert on_battery(str(tmp_path)) is False
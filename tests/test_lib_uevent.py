@@ -0,0 +1,69 @@
+import platform
+
+from sciber_yklocker.models.myos import MyOS
+
+if platform.system() == MyOS.LX:
+    import errno
+    import socket
+    from unittest.mock import MagicMock
+
+    from sciber_yklocker.lib.uevent import UeventWatcher, is_yubico_event, parse_uevent
+
+    def make_uevent(action: str, product: str, devtype: str = "usb_device") -> bytes:
+        devpath = "/devices/pci0000:00/0000:00:14.0/usb1/1-2"
+        fields = [
+            f"{action}@{devpath}",
+            f"ACTION={action}",
+            f"DEVPATH={devpath}",
+            "SUBSYSTEM=usb",
+            f"DEVTYPE={devtype}",
+            f"PRODUCT={product}",
+        ]
+        return "\0".join(fields).encode() + b"\0"
+
+    def test_parse_uevent() -> None:
+        event = parse_uevent(make_uevent("remove", "1050/407/543"))
+        assert event["ACTION"] == "remove"
+        assert event["PRODUCT"] == "1050/407/543"
+        assert "remove@" not in "".join(event)
+
+    def test_is_yubico_event() -> None:
+        assert is_yubico_event(parse_uevent(make_uevent("add", "1050/407/543")))
+        assert is_yubico_event(parse_uevent(make_uevent("remove", "1050/406/543")))
+        # Other vendors, interfaces and actions are ignored
+        assert not is_yubico_event(parse_uevent(make_uevent("add", "46d/c52b/1211")))
+        assert not is_yubico_event(
+            parse_uevent(make_uevent("add", "1050/407/543", "usb_interface"))
+        )
+        assert not is_yubico_event(parse_uevent(make_uevent("bind", "1050/407/543")))
+        assert not is_yubico_event(parse_uevent(make_uevent("add", "zz/407/543")))
+
+    def test_uevent_watcher_drain() -> None:
+        kernel, local = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        watcher = UeventWatcher(local)
+        assert watcher.fileno() == local.fileno()
+
+        # Nothing queued
+        assert watcher.drain() is False
+
+        # Unrelated events are not of interest
+        kernel.send(make_uevent("add", "46d/c52b/1211"))
+        assert watcher.drain() is False
+
+        # A YubiKey removal is found, even behind other events
+        kernel.send(make_uevent("add", "46d/c52b/1211"))
+        kernel.send(make_uevent("remove", "1050/407/543"))
+        kernel.send(make_uevent("add", "46d/c52b/1211"))
+        assert watcher.drain() is True
+
+        # The queue was drained
+        assert watcher.drain() is False
+
+        watcher.close()
+        kernel.close()
+
+    def test_uevent_watcher_overflow() -> None:
+        sock = MagicMock()
+        sock.recv.side_effect = [OSError(errno.ENOBUFS, "overflow"), BlockingIOError]
+        # Lost events might have been a removal
+        assert UeventWatcher(sock).drain() is True
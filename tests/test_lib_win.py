@@ -6,12 +6,16 @@ if platform.system() == MyOS.WIN:
     from unittest.mock import MagicMock, patch
 
     import fake_winreg
+    import pywintypes
 
     from sciber_yklocker.lib.win import (
+        ACTIONS,
+        LOCK_ARGV,
         REG_PATH,
         REG_REMOVALOPTION,
         REG_TIMEOUT,
         AppServerSvc,
+        UserProcess,
         check_service_interruption,
         lock_system,
         log_message,
@@ -37,35 +41,59 @@ if platform.system() == MyOS.WIN:
         log_message("testmessage")
         m_servicemanager.LogInfoMsg.assert_called_once_with("testmessage")
 
+    @patch("sciber_yklocker.lib.win.win32api")
+    @patch("sciber_yklocker.lib.win.win32event")
     @patch("sciber_yklocker.lib.win.win32con")
     @patch("sciber_yklocker.lib.win.win32ts")
     @patch("sciber_yklocker.lib.win.win32process")
     @patch("sciber_yklocker.lib.win.win32profile")
     def test_lock_system_lock(
-        m_win32profile, m_win32process, m_win32ts, m_win32con
+        m_win32profile, m_win32process, m_win32ts, m_win32con, m_win32event, m_win32api
     ) -> None:
         m_win32con.NORMAL_PRIORITY_CLASS = 0
         m_win32ts.WTSQueryUserToken = MagicMock()
         m_win32profile.CreateEnvironmentBlock = MagicMock()
         m_win32process.CreateProcessAsUser = MagicMock(return_value=[0, 1, 2, 3])
+        m_win32process.GetExitCodeProcess = MagicMock(return_value=0)
+        m_win32event.WAIT_OBJECT_0 = 0
+        m_win32event.WaitForSingleObject = MagicMock(return_value=0)
 
         # Test Windows LOCK
         lock_system(RemovalOption.LOCK)
 
         m_win32process.CreateProcessAsUser.assert_called_once()
         assert "LockWorkStation" in m_win32process.CreateProcessAsUser.call_args[0][2]
+        # The process was waited for and both of its handles closed
+        m_win32event.WaitForSingleObject.assert_called_once()
+        assert m_win32api.CloseHandle.call_count == 2
 
+    @patch("sciber_yklocker.lib.win.win32ts")
+    def test_user_process_error(m_win32ts) -> None:
+        # Nobody is logged on to the console
+        m_win32ts.WTSQueryUserToken = MagicMock(
+            side_effect=pywintypes.error(1008, "WTSQueryUserToken", "No token")
+        )
+
+        result = ACTIONS.run(LOCK_ARGV, spawn=UserProcess)
+        assert not result.ok
+        assert result.error == "[Errno 1008] WTSQueryUserToken: No token"
+
+    @patch("sciber_yklocker.lib.win.win32api")
+    @patch("sciber_yklocker.lib.win.win32event")
     @patch("sciber_yklocker.lib.win.win32con")
     @patch("sciber_yklocker.lib.win.win32ts")
     @patch("sciber_yklocker.lib.win.win32process")
     @patch("sciber_yklocker.lib.win.win32profile")
     def test_lock_system_logout(
-        m_win32profile, m_win32process, m_win32ts, m_win32con
+        m_win32profile, m_win32process, m_win32ts, m_win32con, m_win32event, m_win32api
     ) -> None:
         m_win32con.NORMAL_PRIORITY_CLASS = 0
         m_win32ts.WTSQueryUserToken = MagicMock()
         m_win32profile.CreateEnvironmentBlock = MagicMock()
         m_win32process.CreateProcessAsUser = MagicMock(return_value=[0, 1, 2, 3])
+        m_win32process.GetExitCodeProcess = MagicMock(return_value=0)
+        m_win32event.WAIT_OBJECT_0 = 0
+        m_win32event.WaitForSingleObject = MagicMock(return_value=0)
 
         # Test Windows LOGOUT
         lock_system(RemovalOption.LOGOUT)
@@ -74,6 +102,26 @@ if platform.system() == MyOS.WIN:
         assert (
             "logoff.exe" in m_win32process.CreateProcessAsUser.call_args_list[0][0][2]
         )
+        assert m_win32api.CloseHandle.call_count == 2
+
+    @patch("sciber_yklocker.lib.win.win32api")
+    @patch("sciber_yklocker.lib.win.win32event")
+    @patch("sciber_yklocker.lib.win.win32ts")
+    @patch("sciber_yklocker.lib.win.win32process")
+    @patch("sciber_yklocker.lib.win.win32profile")
+    def test_lock_system_timeout(
+        m_win32profile, m_win32process, m_win32ts, m_win32event, m_win32api
+    ) -> None:
+        m_win32process.CreateProcessAsUser = MagicMock(return_value=[0, 1, 2, 3])
+        m_win32event.WAIT_OBJECT_0 = 0
+        # First wait times out, the wait after killing it succeeds
+        m_win32event.WaitForSingleObject = MagicMock(side_effect=[258, 0])
+
+        with patch("sciber_yklocker.lib.win.log_message", MagicMock()) as m:
+            lock_system(RemovalOption.LOCK)
+            assert "timed out" in m.call_args[0][0]
+        m_win32process.TerminateProcess.assert_called_once()
+        assert m_win32api.CloseHandle.call_count == 2
 
     def test_check_service_interruption_true() -> None:
         # Mock win32event constant and function
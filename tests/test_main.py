@@ -1,15 +1,30 @@
 import platform
+import socket
+import subprocess
+import sys
+import tracemalloc
 from unittest.mock import MagicMock, patch
 
+import pytest
+
+from sciber_yklocker.actuator import ActuatorError
+from sciber_yklocker.journal import JOURNAL_DIR, read_events
 from sciber_yklocker.main import (
     check_arguments,
     continue_looping,
     init_yklocker,
     loop_code,
+    main,
+    parse_seconds,
+    reload_config,
+    watch_hotplug,
 )
 from sciber_yklocker.models.myos import MyOS
 from sciber_yklocker.models.removaloption import RemovalOption
+from sciber_yklocker.models.settings import Settings
+from sciber_yklocker.models.watchdog import StallPolicy
 from sciber_yklocker.models.yklock import YkLock
+from sciber_yklocker.waker import WakeReason
 
 ##### Helper Functions ######
 
@@ -107,6 +122,64 @@ def test_loop_code_with_yubikey() -> None:
                 mock_lock.assert_not_called()
 
 
+def test_watch_hotplug() -> None:
+    yklocker = YkLock()
+    kernel, local = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    hotplug_watcher = MagicMock()
+    hotplug_watcher.fileno = local.fileno
+    watch_hotplug(yklocker, hotplug_watcher)
+    assert yklocker.get_hotplug_watcher() is hotplug_watcher
+
+    # Unrelated events keep waiting
+    hotplug_watcher.drain.return_value = False
+    kernel.send(b"event")
+    assert yklocker.get_waker().wait(0.05) == set()
+
+    # A YubiKey event interrupts the wait
+    hotplug_watcher.drain.return_value = True
+    assert yklocker.get_waker().wait(5) == {WakeReason.HOTPLUG}
+
+    yklocker.get_waker().close()
+    kernel.close()
+    local.close()
+
+
+def test_loop_code_stop() -> None:
+    yklocker = YkLock()
+    yklocker.is_yubikey_connected = MagicMock()
+
+    # A stop request during the wait ends the loop without probing
+    yklocker.get_waker().stop()
+    with patch("sciber_yklocker.main.YkLock.logger", MagicMock()) as mock_logger:
+        with patch("platform.system", MagicMock(return_value=MyOS.LX)):
+            with patch(
+                "sciber_yklocker.main.continue_looping", MagicMock(return_value=True)
+            ):
+                loop_code(yklocker)
+        mock_logger.assert_called_with("Stopped YubiKeyLocker")
+
+    yklocker.is_yubikey_connected.assert_not_called()
+    assert continue_looping(yklocker) is False
+
+
+def test_loop_code_hysteresis() -> None:
+    yklocker = YkLock()
+    yklocker.set_required_misses(3)
+    yklocker.get_timeout = lambda: 0
+    yklocker.is_yubikey_connected = lambda: False
+
+    # Three iterations
+    iterations = [True, True, True, False]
+    with patch("sciber_yklocker.main.continue_looping", side_effect=iterations):
+        with patch("platform.system", MagicMock(return_value=MyOS.LX)):
+            with patch("sciber_yklocker.main.YkLock.lock") as mock_lock:
+                with patch("sciber_yklocker.main.YkLock.logger", MagicMock()):
+                    loop_code(yklocker)
+
+                # Only the third miss confirms the removal
+                mock_lock.assert_called_once_with()
+
+
 def test_init_yklocker_win() -> None:
     if platform.system() == MyOS.WIN:
         # Call the function with non-default settings and verify them
@@ -116,7 +189,7 @@ def test_init_yklocker_win() -> None:
             with patch(
                 "sciber_yklocker.main.reg_check_removal_option", MagicMock()
             ) as mock_reg_check_removal_option:
-                yklocker = init_yklocker(RemovalOption.LOGOUT, 15)
+                yklocker = init_yklocker(Settings(RemovalOption.LOGOUT, 15))
 
                 # Make sure gets were called but dont enter the functions
                 mock_reg_check_removal_option.assert_called_once()
@@ -128,11 +201,45 @@ def test_init_yklocker_win() -> None:
 
 def test_init_yklocker_lx() -> None:
     if platform.system() == MyOS.LX or platform.system() == MyOS.MAC:
-        yklocker = init_yklocker(RemovalOption.LOGOUT, 15)
+        with patch("sciber_yklocker.main.YkLock.prepare_actuator") as mock_prepare:
+            yklocker = init_yklocker(Settings(RemovalOption.LOGOUT, 15))
+            mock_prepare.assert_called_once()
         assert yklocker.get_removal_option() == RemovalOption.LOGOUT
         assert yklocker.get_timeout() == 15
 
 
+def test_init_yklocker_actuator_error() -> None:
+    if platform.system() == MyOS.LX or platform.system() == MyOS.MAC:
+        # An action that can not work stops the locker at startup
+        error = ActuatorError("no dbus-send")
+        with patch("sciber_yklocker.main.YkLock.prepare_actuator", side_effect=error):
+            with patch("sciber_yklocker.main.YkLock.logger", MagicMock()) as m:
+                with pytest.raises(ActuatorError):
+                    init_yklocker(Settings(RemovalOption.LOCK, 15))
+                assert "Lock action Lock can not work" in m.call_args[0][0]
+
+            with patch("sys.argv", ["yklocker", "-l", "Lock"]):
+                with patch("builtins.print", MagicMock()) as mock_p:
+                    with pytest.raises(SystemExit):
+                        main()
+                    assert "no dbus-send" in mock_p.call_args[0][0]
+
+
+def test_init_yklocker_lx_no_hotplug() -> None:
+    if platform.system() == MyOS.LX:
+        # Fall back to polling if the netlink socket can not be opened
+        no_signals: tuple[list, list] = ([], [])
+        with patch("sciber_yklocker.main.UeventWatcher", side_effect=OSError("no")):
+            with patch(
+                "sciber_yklocker.main.open_lock_watchers", return_value=no_signals
+            ):
+                with patch("sciber_yklocker.main.YkLock.logger", MagicMock()) as m:
+                    yklocker = init_yklocker(Settings(RemovalOption.LOCK, 15))
+                    assert "polling only" in m.call_args[0][0]
+
+        assert yklocker.get_hotplug_watcher() is None
+
+
 def test_check_arguments_no_args() -> None:
     with patch("sys.argv", ["yklocker.exe"]):
         with patch("builtins.print", MagicMock()) as mock_p:
@@ -164,12 +271,413 @@ def test_check_arguments_with_lock() -> None:
 def test_check_arguments_with_wrong_removalOption() -> None:
     with patch("sys.argv", ["yklocker.exe", "-l", "wrong", "-t", "5"]):
         with patch("builtins.print", MagicMock()) as mock_p:
-            assert (None, 5) == check_arguments()
+            assert Settings(timeout=5) == check_arguments()
             assert "Invalid RemovalOption" in mock_p.call_args[0][0]
 
 
 def test_check_arguments_with_wrong_timout() -> None:
     with patch("sys.argv", ["yklocker.exe", "-l", "Lock", "-t", "notTime"]):
         with patch("builtins.print", MagicMock()) as mock_p:
-            assert (RemovalOption.LOCK, None) == check_arguments()
+            assert Settings(RemovalOption.LOCK) == check_arguments()
             assert "Invalid Timeout" in mock_p.call_args[0][0]
+
+
+def test_check_arguments_with_serials() -> None:
+    with patch("sys.argv", ["yklocker.exe", "-s", "12345678, 23456789"]):
+        with patch("builtins.print", MagicMock()) as mock_p:
+            settings = check_arguments()
+            assert settings.serials == frozenset({12345678, 23456789})
+            mock_p.assert_not_called()
+
+
+def test_check_arguments_with_wrong_serials() -> None:
+    with patch("sys.argv", ["yklocker.exe", "-s", "12345678,abc"]):
+        with patch("builtins.print", MagicMock()) as mock_p:
+            assert Settings() == check_arguments()
+            assert "Invalid serial numbers" in mock_p.call_args[0][0]
+
+
+def test_init_yklocker_serials() -> None:
+    if platform.system() == MyOS.LX or platform.system() == MyOS.MAC:
+        yklocker = init_yklocker(Settings(serials=frozenset({12345678})))
+        assert yklocker.get_serial_allowlist() == frozenset({12345678})
+
+
+def test_loop_code_acts_once_per_removal() -> None:
+    yklocker = YkLock()
+    yklocker.get_timeout = lambda: 0
+    yklocker.is_yubikey_connected = lambda: False
+
+    iterations = [True, True, True, False]
+    with patch("sciber_yklocker.main.continue_looping", side_effect=iterations):
+        with patch("platform.system", MagicMock(return_value=MyOS.LX)):
+            with patch("sciber_yklocker.main.YkLock.lock") as mock_lock:
+                with patch("sciber_yklocker.main.YkLock.logger") as mock_logger:
+                    loop_code(yklocker)
+
+                # Start message and a single removal message
+                assert mock_logger.call_count == 2
+                mock_lock.assert_called_once_with()
+
+
+def test_parse_seconds() -> None:
+    assert parse_seconds("0.25") == 0.25
+    assert parse_seconds("3") == 3
+    assert parse_seconds("-1") is None
+    assert parse_seconds("inf") is None
+    assert parse_seconds("nan") is None
+    assert parse_seconds("soon") is None
+
+
+def test_check_arguments_with_presence() -> None:
+    with patch("sys.argv", ["yklocker.exe", "-i", "0.25", "-g", "2", "-m", "3"]):
+        with patch("builtins.print", MagicMock()) as mock_p:
+            settings = check_arguments()
+            assert settings.probe_interval == 0.25
+            assert settings.grace_period == 2
+            assert settings.required_misses == 3
+            mock_p.assert_not_called()
+
+
+def test_check_arguments_with_wrong_presence() -> None:
+    for args, message in [
+        (["-i", "0"], "Invalid probe interval"),
+        (["-i", "x"], "Invalid probe interval"),
+        (["-g", "-2"], "Invalid grace period"),
+        (["-m", "0"], "Invalid number of misses"),
+    ]:
+        with patch("sys.argv", ["yklocker.exe"] + args):
+            with patch("builtins.print", MagicMock()) as mock_p:
+                assert Settings() == check_arguments()
+                assert message in mock_p.call_args[0][0]
+
+
+def test_check_arguments_with_rearm() -> None:
+    with patch("sys.argv", ["yklocker.exe", "-r", "60"]):
+        assert Settings(rearm_interval=60) == check_arguments()
+
+    with patch("sys.argv", ["yklocker.exe", "-r", "never"]):
+        with patch("builtins.print", MagicMock()) as mock_p:
+            assert Settings() == check_arguments()
+            assert "Invalid re-lock interval" in mock_p.call_args[0][0]
+
+
+def test_check_arguments_with_schedule() -> None:
+    with patch("sys.argv", ["yklocker.exe", "-b", "120", "-w", "60"]):
+        assert Settings(max_interval=120, max_wakeups_per_hour=60) == check_arguments()
+
+    for args, message in [
+        (["-b", "0"], "Invalid backoff interval"),
+        (["-w", "many"], "Invalid wakeups per hour"),
+    ]:
+        with patch("sys.argv", ["yklocker.exe"] + args):
+            with patch("builtins.print", MagicMock()) as mock_p:
+                assert Settings() == check_arguments()
+                assert message in mock_p.call_args[0][0]
+
+
+def test_check_arguments_with_watchdog() -> None:
+    with patch("sys.argv", ["yklocker.exe", "-d", "2", "-f", "present", "-n", "4"]):
+        settings = Settings(
+            probe_deadline=2, stall_policy=StallPolicy.PRESENT, stalls_to_lock=4
+        )
+        assert settings == check_arguments()
+
+    for args, message in [
+        (["-d", "0"], "Invalid probe deadline"),
+        (["-f", "panic"], "Invalid stall policy"),
+        (["-n", "-1"], "Invalid number of stalls"),
+    ]:
+        with patch("sys.argv", ["yklocker.exe"] + args):
+            with patch("builtins.print", MagicMock()) as mock_p:
+                assert Settings() == check_arguments()
+                assert message in mock_p.call_args[0][0]
+
+
+def test_check_arguments_with_probe_helper() -> None:
+    with patch("sys.argv", ["yklocker.exe", "-o"]):
+        assert Settings(probe_helper=True) == check_arguments()
+
+
+def test_check_arguments_with_metrics() -> None:
+    with patch("sys.argv", ["yklocker.exe", "-x", "/tmp/yk.prom", "-p", "9435"]):
+        settings = Settings(metrics_file="/tmp/yk.prom", metrics_port=9435)
+        assert settings == check_arguments()
+
+    with patch("sys.argv", ["yklocker.exe", "-p", "0"]):
+        with patch("builtins.print", MagicMock()) as mock_p:
+            assert Settings() == check_arguments()
+            assert "Invalid metrics port" in mock_p.call_args[0][0]
+
+
+def test_init_yklocker_metrics(tmp_path) -> None:
+    if platform.system() == MyOS.LX or platform.system() == MyOS.MAC:
+        path = tmp_path / "yklocker.prom"
+        yklocker = init_yklocker(Settings(metrics_file=str(path)))
+        exporter = yklocker.get_metrics_exporter()
+        assert exporter.path == str(path)
+        assert exporter.server is None
+
+        # Written once more when the locker stops
+        yklocker.get_waker().stop()
+        with patch("sciber_yklocker.main.YkLock.logger"):
+            loop_code(yklocker)
+        assert "yklocker_probes_total 0" in path.read_text()
+
+        assert init_yklocker(Settings()).get_metrics_exporter() is None
+
+
+def test_init_yklocker_metrics_port_in_use() -> None:
+    if platform.system() == MyOS.LX or platform.system() == MyOS.MAC:
+        with socket.socket() as taken:
+            taken.bind(("127.0.0.1", 0))
+            taken.listen()
+            port = taken.getsockname()[1]
+            with patch("sciber_yklocker.main.YkLock.logger") as mock_logger:
+                yklocker = init_yklocker(Settings(metrics_port=port))
+            messages = [call[0][0] for call in mock_logger.call_args_list]
+            assert any("Metrics endpoint unavailable" in m for m in messages)
+            assert yklocker.get_metrics_exporter().server is None
+
+
+def test_check_arguments_with_profile() -> None:
+    with patch("sys.argv", ["yklocker.exe", "-P", "/tmp/yk.txt:sample"]):
+        assert Settings(profile="/tmp/yk.txt:sample") == check_arguments()
+
+    with patch("sys.argv", ["yklocker.exe", "-P", "/tmp/yk.txt:sample:none"]):
+        with patch("builtins.print", MagicMock()) as mock_p:
+            assert Settings() == check_arguments()
+            assert "Invalid profile" in mock_p.call_args[0][0]
+
+
+def test_init_yklocker_profile(tmp_path) -> None:
+    if platform.system() == MyOS.LX or platform.system() == MyOS.MAC:
+        assert init_yklocker(Settings()).get_profiler() is None
+
+        path = tmp_path / "profile.txt"
+        with patch.dict("os.environ", {"YKLOCKER_PROFILE": f"{path}:cprofile:3"}):
+            yklocker = init_yklocker(Settings())
+        assert yklocker.get_profiler().iterations == 3
+
+        # Written when the locker stops
+        yklocker.get_waker().stop()
+        with patch("sciber_yklocker.main.YkLock.logger"):
+            loop_code(yklocker)
+        assert "YubiKeyLocker profile" in path.read_text()
+
+
+def test_check_arguments_with_trace_allocations() -> None:
+    with patch("sys.argv", ["yklocker.exe", "-T", "/tmp/yk-allocations.txt"]):
+        settings = Settings(trace_allocations="/tmp/yk-allocations.txt")
+        assert settings == check_arguments()
+
+
+def test_init_yklocker_trace_allocations(tmp_path) -> None:
+    if platform.system() == MyOS.LX or platform.system() == MyOS.MAC:
+        assert init_yklocker(Settings()).get_allocation_tracer() is None
+
+        path = tmp_path / "allocations.txt"
+        with patch.dict("os.environ", {"YKLOCKER_TRACEMALLOC": str(path)}):
+            yklocker = init_yklocker(Settings())
+        assert tracemalloc.is_tracing()
+
+        # Written when the locker stops, and tracing stops with it
+        yklocker.get_waker().stop()
+        with patch("sciber_yklocker.main.YkLock.logger"):
+            loop_code(yklocker)
+        assert "YubiKeyLocker allocations" in path.read_text()
+        assert not tracemalloc.is_tracing()
+
+
+def test_init_yklocker_probe_helper() -> None:
+    if platform.system() == MyOS.LX or platform.system() == MyOS.MAC:
+        settings = Settings(
+            serials=frozenset({123}), probe_deadline=2, probe_helper=True
+        )
+        yklocker = init_yklocker(settings)
+        probe_helper = yklocker.get_probe_helper()
+        assert probe_helper.command[-2:] == ["-s", "123"]
+        # Gives up just before the probe deadline
+        assert 1 < probe_helper.timeout < 2
+        # Not started before the first probe
+        assert probe_helper.process is None
+
+        assert init_yklocker(Settings()).get_probe_helper() is None
+
+
+def test_main_probe_helper() -> None:
+    with patch("sys.argv", ["yklocker", "--probe-helper", "-s", "123"]):
+        with patch("sciber_yklocker.main.run_helper") as mock_run_helper:
+            main()
+            mock_run_helper.assert_called_once_with(["-s", "123"])
+
+
+def test_main_control_command() -> None:
+    if platform.system() == MyOS.LX or platform.system() == MyOS.MAC:
+        with patch("sys.argv", ["yklocker", "pause", "15"]):
+            with patch("sciber_yklocker.main.run_client", return_value=0) as mock_c:
+                with pytest.raises(SystemExit) as e:
+                    main()
+        mock_c.assert_called_once_with(["pause", "15"])
+        assert e.value.code == 0
+
+
+def test_main_events() -> None:
+    if platform.system() == MyOS.LX or platform.system() == MyOS.MAC:
+        with patch("sys.argv", ["yklocker", "events", "--since", "7d"]):
+            with patch("sciber_yklocker.main.run_query", return_value=0) as mock_q:
+                with pytest.raises(SystemExit):
+                    main()
+        mock_q.assert_called_once_with(["--since", "7d"])
+
+
+def test_main_system() -> None:
+    if platform.system() == MyOS.LX:
+        with patch("sys.argv", ["yklocker", "system"]):
+            with patch("sciber_yklocker.system.run_system", return_value=0) as mock_s:
+                with pytest.raises(SystemExit):
+                    main()
+        mock_s.assert_called_once_with([])
+
+
+def test_init_yklocker_journal(tmp_path) -> None:
+    if platform.system() == MyOS.LX or platform.system() == MyOS.MAC:
+        assert init_yklocker(Settings()).get_journal() is None
+
+        with patch.dict("os.environ", {"XDG_STATE_HOME": str(tmp_path)}):
+            yklocker = init_yklocker(Settings(journal=True))
+        # Started and stopped, written when the locker stops
+        yklocker.get_waker().stop()
+        with patch("sciber_yklocker.main.YkLock.logger"):
+            loop_code(yklocker)
+        events = list(read_events(str(tmp_path / JOURNAL_DIR)))
+        assert [event["event"] for event in events] == ["started", "stopped"]
+
+        with patch("sys.argv", ["yklocker.exe", "-j"]):
+            assert Settings(journal=True) == check_arguments()
+
+
+def test_check_arguments_with_control_socket() -> None:
+    with patch("sys.argv", ["yklocker.exe", "-c", "/tmp/yk.sock"]):
+        assert Settings(control_socket="/tmp/yk.sock") == check_arguments()
+
+
+def test_loop_code_control_socket(tmp_path) -> None:
+    if platform.system() == MyOS.LX or platform.system() == MyOS.MAC:
+        with patch.dict("os.environ", {"XDG_RUNTIME_DIR": "/run/user/1000"}):
+            yklocker = init_yklocker(Settings())
+        assert yklocker.get_control_socket() == "/run/user/1000/yklocker.sock"
+
+        # The socket only exists while the loop runs
+        yklocker.set_control_socket(str(tmp_path / "missing" / "yklocker.sock"))
+        yklocker.get_waker().stop()
+        with patch("sciber_yklocker.main.YkLock.logger") as mock_logger:
+            loop_code(yklocker)
+        messages = [call[0][0] for call in mock_logger.call_args_list]
+        assert any("Control socket unavailable" in m for m in messages)
+
+
+def test_init_yklocker_presence() -> None:
+    if platform.system() == MyOS.LX or platform.system() == MyOS.MAC:
+        settings = Settings(
+            probe_interval=0.25,
+            grace_period=2,
+            required_misses=3,
+            rearm_interval=60,
+            max_interval=120,
+            max_wakeups_per_hour=60,
+            probe_deadline=2,
+            stall_policy=StallPolicy.ABSENT,
+            stalls_to_lock=4,
+        )
+        yklocker = init_yklocker(settings)
+        assert yklocker.get_probe_deadline() == 2
+        assert yklocker.get_stall_policy() == StallPolicy.ABSENT
+        assert yklocker.get_stalls_to_lock() == 4
+        assert yklocker.get_rearm_interval() == 60
+        assert yklocker.get_max_interval() == 120
+        assert yklocker.get_max_wakeups_per_hour() == 60
+        assert yklocker.get_probe_interval() == 0.25
+        assert yklocker.get_grace_period() == 2
+        assert yklocker.get_required_misses() == 3
+
+
+def test_init_yklocker_config(tmp_path) -> None:
+    if platform.system() == MyOS.LX or platform.system() == MyOS.MAC:
+        path = tmp_path / "yklocker.toml"
+        path.write_text('removal_option = "Lock"\ntimeout = 20\ngrace_period = 2\n')
+        with patch("sciber_yklocker.main.config_paths", return_value=[str(path)]):
+            with patch("sciber_yklocker.main.YkLock.prepare_actuator"):
+                # The command line wins over the config file
+                yklocker = init_yklocker(Settings(timeout=5))
+        assert yklocker.get_removal_option() == RemovalOption.LOCK
+        assert yklocker.get_timeout() == 5
+        assert yklocker.get_grace_period() == 2
+        assert yklocker.get_config().paths == [str(path)]
+
+
+def test_reload_config(tmp_path) -> None:
+    if platform.system() == MyOS.LX or platform.system() == MyOS.MAC:
+        path = tmp_path / "yklocker.toml"
+        path.write_text("timeout = 20\ngrace_period = 2\n")
+        with patch("sciber_yklocker.main.config_paths", return_value=[str(path)]):
+            yklocker = init_yklocker(Settings())
+        yklocker.set_probe_helper(MagicMock())
+        yklocker.set_journal(MagicMock())
+
+        with patch("sciber_yklocker.main.YkLock.logger", MagicMock()) as m:
+            # Nothing changed, nothing to do
+            reload_config(yklocker)
+            m.assert_not_called()
+
+            path.write_text("timeout = 30\nserials = [123]\n")
+            reload_config(yklocker)
+            assert "Reloaded settings" in m.call_args[0][0]
+            assert "after 30 seconds" in m.call_args[0][0]
+        assert yklocker.get_timeout() == 30
+        assert yklocker.get_grace_period() == 0
+        assert yklocker.get_serial_allowlist() == frozenset({123})
+        # What changed goes into the journal
+        event, fields = yklocker.get_journal().record.call_args
+        assert event == ("config",)
+        assert fields["changed"] == ["timeout", "serials", "grace_period"]
+        # The helper is restarted with the new allowlist
+        command = yklocker.get_probe_helper().set_command.call_args[0][0]
+        assert command[-2:] == ["-s", "123"]
+
+        # A broken edit keeps the current settings
+        with patch.object(yklocker.get_config(), "logger") as m:
+            path.write_text("timeout = thirty\n")
+            reload_config(yklocker)
+            assert "Invalid config file" in m.call_args[0][0]
+        assert yklocker.get_timeout() == 30
+
+
+def test_reload_config_file_change(tmp_path) -> None:
+    if platform.system() == MyOS.LX or platform.system() == MyOS.MAC:
+        path = tmp_path / "yklocker.toml"
+        with patch("sciber_yklocker.main.config_paths", return_value=[str(path)]):
+            yklocker = init_yklocker(Settings())
+
+        # Writing the file wakes the loop for a reload
+        path.write_text("timeout = 30\n")
+        assert WakeReason.RELOAD in yklocker.get_waker().wait(2)
+
+
+def test_reload_config_without_config() -> None:
+    yklocker = YkLock()
+    with patch("sciber_yklocker.main.YkLock.logger", MagicMock()) as m:
+        reload_config(yklocker)
+        m.assert_not_called()
+
+
+def test_import_main_without_ykman() -> None:
+    # ykman and asyncio are slow to import and only loaded once needed
+    code = (
+        "import sys, sciber_yklocker.main; "
+        "print(sorted({'ykman', 'yubikit', 'asyncio'} & set(sys.modules)))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == "[]"
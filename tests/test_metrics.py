@@ -0,0 +1,110 @@
+import os
+import urllib.request
+
+import pytest
+
+from sciber_yklocker.metrics import (
+    Histogram,
+    LockerMetrics,
+    MetricsExporter,
+    format_labels,
+)
+from sciber_yklocker.models.presence import PresenceState
+from sciber_yklocker.models.removaloption import RemovalOption
+
+
+def test_format_labels() -> None:
+    assert format_labels({}) == ""
+    assert format_labels({"a": "1", "b": 'say "hi"\n'}) == '{a="1",b="say \\"hi\\"\\n"}'
+
+
+def test_histogram() -> None:
+    histogram = Histogram((0.1, 1))
+    for value in (0.05, 0.1, 0.5, 3):
+        histogram.observe(value)
+
+    # Buckets are cumulative and include their upper bound
+    assert histogram.render("probe", {"x": "y"}) == [
+        'probe_bucket{x="y",le="0.1"} 2',
+        'probe_bucket{x="y",le="1"} 3',
+        'probe_bucket{x="y",le="+Inf"} 4',
+        'probe_sum{x="y"} 3.65',
+        'probe_count{x="y"} 4',
+    ]
+
+
+def test_locker_metrics_render() -> None:
+    metrics = LockerMetrics(rss=lambda: 1234, wakeups=lambda: 42)
+    metrics.probed(0.002)
+    metrics.probe_failed("stalled")
+    metrics.presence(PresenceState.ABSENT)
+    metrics.removed()
+    metrics.acted(RemovalOption.LOCK, 0.03)
+    lines = metrics.render().splitlines()
+
+    assert "yklocker_probes_total 2" in lines
+    assert 'yklocker_probe_duration_seconds_bucket{le="0.0025"} 1' in lines
+    assert "yklocker_probe_duration_seconds_count 1" in lines
+    assert 'yklocker_probe_errors_total{reason="stalled"} 1' in lines
+    assert 'yklocker_probe_errors_total{reason="helper"} 0' in lines
+    assert 'yklocker_presence_state{state="absent"} 1' in lines
+    assert 'yklocker_presence_state{state="present"} 0' in lines
+    assert "yklocker_removals_total 1" in lines
+    assert 'yklocker_actions_total{removal_option="Lock"} 1' in lines
+    assert 'yklocker_actions_total{removal_option="Logout"} 0' in lines
+    assert (
+        'yklocker_action_latency_seconds_bucket{removal_option="Lock",le="0.05"} 1'
+        in lines
+    )
+    assert "yklocker_resident_memory_bytes 1234" in lines
+    assert "yklocker_wakeups_last_hour 42" in lines
+    # Every sample belongs to a declared metric
+    declared = {line.split()[2] for line in lines if line.startswith("# TYPE")}
+    for line in lines:
+        if not line.startswith("#"):
+            name = line.split("{")[0].split()[0]
+            assert name in declared or name.rsplit("_", 1)[0] in declared
+
+
+def test_exporter_write(tmp_path) -> None:
+    path = tmp_path / "yklocker.prom"
+    metrics = LockerMetrics(rss=lambda: 0)
+    exporter = MetricsExporter(metrics, str(path), interval=15)
+
+    exporter.update(100)
+    assert "yklocker_probes_total 0" in path.read_text()
+    # Not again before the interval passed
+    metrics.probed(0.01)
+    exporter.update(110)
+    assert "yklocker_probes_total 0" in path.read_text()
+    exporter.update(115)
+    assert "yklocker_probes_total 1" in path.read_text()
+
+    # Replaced in one go, no temporary files left behind
+    assert os.listdir(tmp_path) == ["yklocker.prom"]
+    exporter.close()
+
+
+def test_exporter_write_failed(tmp_path) -> None:
+    exporter = MetricsExporter(LockerMetrics(), str(tmp_path / "missing" / "a.prom"))
+    with pytest.raises(OSError):
+        exporter.update(0)
+
+
+def test_exporter_http() -> None:
+    metrics = LockerMetrics(rss=lambda: 0)
+    metrics.probed(0.01)
+    # Port 0 picks a free one
+    exporter = MetricsExporter(metrics, port=0)
+    host, port = exporter.server.server_address
+    assert host == "127.0.0.1"
+
+    with urllib.request.urlopen(f"http://{host}:{port}/metrics", timeout=5) as r:
+        assert r.headers["Content-Type"].startswith("text/plain")
+        assert "yklocker_probes_total 1" in r.read().decode()
+    with pytest.raises(urllib.error.HTTPError):
+        urllib.request.urlopen(f"http://{host}:{port}/other", timeout=5)
+
+    # Nothing to write without a file
+    exporter.update(0)
+    exporter.close()
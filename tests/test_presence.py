@@ -0,0 +1,37 @@
+from sciber_yklocker.models.presence import PresenceState, PresenceTracker
+
+
+def test_presence_default_acts_on_first_miss() -> None:
+    tracker = PresenceTracker()
+    assert tracker.state == PresenceState.UNKNOWN
+    assert tracker.update(True, 0) == PresenceState.PRESENT
+    assert tracker.update(False, 10) == PresenceState.ABSENT
+    assert tracker.update(False, 20) == PresenceState.ABSENT
+    assert tracker.update(True, 30) == PresenceState.PRESENT
+
+
+def test_presence_required_misses() -> None:
+    tracker = PresenceTracker(required_misses=3)
+    tracker.update(True, 0)
+    assert tracker.update(False, 1) == PresenceState.SUSPECT
+    assert tracker.update(False, 2) == PresenceState.SUSPECT
+    assert tracker.update(False, 3) == PresenceState.ABSENT
+
+
+def test_presence_hub_reset_is_dismissed() -> None:
+    tracker = PresenceTracker(required_misses=2)
+    tracker.update(True, 0)
+    assert tracker.update(False, 1) == PresenceState.SUSPECT
+    # The YubiKey re-enumerated, misses start over
+    assert tracker.update(True, 1.25) == PresenceState.PRESENT
+    assert tracker.update(False, 2) == PresenceState.SUSPECT
+    assert tracker.misses == 1
+
+
+def test_presence_grace_period() -> None:
+    tracker = PresenceTracker(grace_period=1, required_misses=2)
+    tracker.update(True, 0)
+    assert tracker.update(False, 10) == PresenceState.SUSPECT
+    assert tracker.update(False, 10.25) == PresenceState.SUSPECT
+    assert tracker.update(False, 10.75) == PresenceState.SUSPECT
+    assert tracker.update(False, 11) == PresenceState.ABSENT
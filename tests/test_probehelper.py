@@ -0,0 +1,188 @@
+import asyncio
+import io
+import os
+import sys
+from unittest.mock import patch
+
+import pytest
+
+from sciber_yklocker.probehelper import (
+    HEADER,
+    HELPER_ARG,
+    MAX_MESSAGE_SIZE,
+    ProbeHelper,
+    ProbeHelperError,
+    current_rss,
+    helper_command,
+    helper_timeout,
+    read_message,
+    run_helper,
+    write_message,
+)
+
+# A stand-in helper, answers like the real one but misbehaves on request
+FAKE_HELPER = """
+import sys, time
+from sciber_yklocker.probehelper import read_message, write_message
+
+mode, rss = sys.argv[1], int(sys.argv[2])
+probes = 0
+while read_message(sys.stdin.buffer) is not None:
+    probes += 1
+    if mode == "crash" and probes == 2:
+        sys.exit(1)
+    if mode == "hang":
+        time.sleep(30)
+    if mode == "error":
+        write_message(sys.stdout.buffer, {"error": "OSError: busy", "rss": rss})
+    else:
+        write_message(sys.stdout.buffer, {"connected": probes % 2 == 1, "rss": rss})
+"""
+
+
+def fake_helper(mode: str = "ok", rss: int = 0, **kwargs) -> ProbeHelper:
+    command = [sys.executable, "-c", FAKE_HELPER, mode, str(rss)]
+    return ProbeHelper(command, **kwargs)
+
+
+def test_message_roundtrip() -> None:
+    stream = io.BytesIO()
+    write_message(stream, {"op": "probe"})
+    write_message(stream, {"connected": True, "rss": 1024})
+    stream.seek(0)
+    assert read_message(stream) == {"op": "probe"}
+    assert read_message(stream) == {"connected": True, "rss": 1024}
+    assert read_message(stream) is None
+
+
+def test_read_message_truncated() -> None:
+    assert read_message(io.BytesIO(HEADER.pack(10) + b"{}")) is None
+    with pytest.raises(ProbeHelperError):
+        read_message(io.BytesIO(HEADER.pack(MAX_MESSAGE_SIZE + 1)))
+
+
+def test_current_rss() -> None:
+    assert current_rss() >= 0
+
+
+def test_helper_command() -> None:
+    command = helper_command(frozenset({2, 1}))
+    assert command[:3] == [sys.executable, "-m", "sciber_yklocker.probehelper"]
+    assert command[3:] == ["-s", "1,2"]
+
+    with patch.object(sys, "frozen", True, create=True):
+        assert helper_command() == [sys.executable, HELPER_ARG]
+
+
+def test_run_helper() -> None:
+    stdin = io.BytesIO()
+    write_message(stdin, {"op": "probe"})
+    write_message(stdin, {"op": "probe"})
+    write_message(stdin, {"op": "exit"})
+    stdin.seek(0)
+    stdout = io.BytesIO()
+
+    probes = [True, OSError("busy")]
+    with patch("signal.signal"):
+        with patch(
+            "sciber_yklocker.models.yklock.YkLock.probe_devices", side_effect=probes
+        ):
+            run_helper(["-s", "123,456"], stdin, stdout)
+
+    stdout.seek(0)
+    assert read_message(stdout)["connected"] is True
+    assert read_message(stdout)["error"] == "OSError: busy"
+    assert read_message(stdout)["error"] == "Unknown request"
+    assert read_message(stdout) is None
+
+
+def test_probe_helper() -> None:
+    helper = fake_helper()
+    assert helper.probe() is True
+    assert helper.probe() is False
+    # The same helper answered both
+    assert helper.starts == 1
+    assert helper.probes == 2
+    helper.stop()
+    assert helper.process is None
+
+
+def test_probe_helper_restarts_after_crash() -> None:
+    helper = fake_helper("crash")
+    assert helper.probe() is True
+    with pytest.raises(ProbeHelperError):
+        helper.probe()
+    assert helper.process is None
+
+    # Started again by the next probe
+    assert helper.probe() is True
+    assert helper.starts == 2
+    helper.stop()
+
+
+def test_probe_helper_timeout() -> None:
+    helper = fake_helper("hang", timeout=0.5)
+    with pytest.raises(ProbeHelperError, match="did not answer"):
+        helper.probe()
+    assert helper.process is None
+
+
+def test_probe_helper_error() -> None:
+    helper = fake_helper("error")
+    with pytest.raises(ProbeHelperError, match="OSError: busy"):
+        helper.probe()
+    # A failed probe is not a failed helper
+    assert helper.process is not None
+    helper.stop()
+
+
+def test_probe_helper_recycled() -> None:
+    helper = fake_helper(max_probes=2)
+    helper.probe()
+    process = helper.process
+    helper.probe()
+    assert helper.process is None
+    assert process.returncode is not None
+
+    helper.probe()
+    assert helper.starts == 2
+    helper.stop()
+
+    # Too much memory used, replaced after answering
+    helper = fake_helper(rss=200, max_rss=100)
+    assert helper.probe() is True
+    assert helper.process is None
+    assert helper.probe() is True
+    assert helper.starts == 2
+    helper.stop()
+
+
+def test_probe_helper_real() -> None:
+    # The real helper, started as python -m sciber_yklocker.probehelper
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    with patch.dict(os.environ, env):
+        helper = ProbeHelper(helper_command(), timeout=30)
+        assert helper.probe() in (True, False)
+        helper.stop()
+
+
+def test_probe_helper_answers_before_deadline() -> None:
+    from sciber_yklocker.models.yklock import YkLock
+    from sciber_yklocker.runtime import Runtime
+
+    assert helper_timeout(5) == 4.5
+    assert 0 < helper_timeout(0.1) < 0.1
+
+    # A hung helper is reported once, by the helper, and not also as a stall
+    yklocker = YkLock()
+    yklocker.set_probe_deadline(1)
+    helper = fake_helper("hang", timeout=helper_timeout(1))
+    yklocker.set_probe_helper(helper)
+    runtime = Runtime(yklocker, lambda yklocker: True)
+
+    with patch("sciber_yklocker.runtime.YkLock.logger") as mock_logger:
+        asyncio.run(runtime.probe())
+        assert "Probe helper did not answer" in mock_logger.call_args[0][0]
+    assert yklocker.watchdog.stalls == 1
+    assert runtime.pending_probe is None
+    runtime.probe_executor.shutdown()
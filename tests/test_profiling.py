@@ -0,0 +1,215 @@
+import threading
+import tracemalloc
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from sciber_yklocker.models.myos import MyOS
+from sciber_yklocker.models.removaloption import RemovalOption
+from sciber_yklocker.models.yklock import YkLock
+from sciber_yklocker.profiling import (
+    PROFILE_ITERATIONS,
+    AllocationTracer,
+    ProfileMode,
+    Profiler,
+    Sampler,
+    parse_profile_spec,
+)
+from sciber_yklocker.runtime import Runtime, run_runtime
+from sciber_yklocker.waker import WakeReason
+
+
+def test_parse_profile_spec() -> None:
+    assert parse_profile_spec("/tmp/yk.txt") == (
+        "/tmp/yk.txt",
+        ProfileMode.TIMERS,
+        PROFILE_ITERATIONS,
+    )
+    assert parse_profile_spec("/tmp/yk.txt:sample") == (
+        "/tmp/yk.txt",
+        ProfileMode.SAMPLE,
+        PROFILE_ITERATIONS,
+    )
+    assert parse_profile_spec("/tmp/yk.txt:cprofile:5") == (
+        "/tmp/yk.txt",
+        ProfileMode.CPROFILE,
+        5,
+    )
+    # A colon in the path is no mode
+    assert parse_profile_spec("/tmp/a:b")[0] == "/tmp/a:b"
+
+    with pytest.raises(ValueError):
+        parse_profile_spec("/tmp/yk.txt:sample:0")
+    with pytest.raises(ValueError):
+        parse_profile_spec(":sample")
+
+
+def run_iterations(yklocker: YkLock, iterations: int) -> None:
+    # Probe right away every iteration, then stop
+    count = 0
+
+    def keep_running(yklocker: YkLock) -> bool:
+        nonlocal count
+        count += 1
+        yklocker.get_waker().wake(WakeReason.PROBE)
+        return count <= iterations
+
+    with patch("platform.system", MagicMock(return_value=MyOS.LX)):
+        run_runtime(yklocker, keep_running)
+
+
+def removing_yklocker() -> YkLock:
+    yklocker = YkLock()
+    yklocker.logger = MagicMock()
+    yklocker.set_removal_option(RemovalOption.LOCK)
+    yklocker.lock = MagicMock()
+    # Present, then removed
+    connected = iter([True, True, False])
+    yklocker.is_yubikey_connected = lambda: next(connected, False)
+    return yklocker
+
+
+def test_profiler_disabled() -> None:
+    # Nothing is wrapped without a profiler
+    runtime = Runtime(YkLock(), lambda yklocker: False)
+    assert runtime.probe.__func__ is Runtime.probe
+    assert runtime.act.__func__ is Runtime.act
+    runtime.probe_executor.shutdown()
+
+
+def test_profiler_timers(tmp_path) -> None:
+    path = tmp_path / "profile.txt"
+    yklocker = removing_yklocker()
+    profiler = Profiler(str(path))
+    yklocker.set_profiler(profiler)
+    run_iterations(yklocker, 5)
+
+    assert profiler.iteration == 5
+    assert profiler.phases["wait"].count == 5
+    assert profiler.phases["probe"].count == 5
+    assert profiler.phases["action"].count == 1
+    assert profiler.phases["logging"].count >= 1
+    yklocker.lock.assert_called_once_with()
+
+    profiler.dump()
+    summary = path.read_text()
+    assert "5 iterations" in summary
+    assert "\nprobe " in summary
+
+
+def test_profiler_cprofile(tmp_path) -> None:
+    yklocker = removing_yklocker()
+    profiler = Profiler(str(tmp_path / "profile.txt"), ProfileMode.CPROFILE, 2)
+    yklocker.set_profiler(profiler)
+    run_iterations(yklocker, 5)
+
+    # Only the first iterations were profiled, the action came later
+    assert not profiler.profiling
+    summary = profiler.summary()
+    assert "cProfile of probes and actions, first 2 iterations" in summary
+    assert "<lambda>" in summary
+    assert "handle_dispatch_event" not in summary
+
+
+def test_sampler() -> None:
+    sampler = Sampler(interval=0.001)
+    sampler.start()
+    busy = threading.Event()
+    worker = threading.Thread(target=busy.wait, args=(5,), name="busy-worker")
+    worker.start()
+    while sampler.samples < 5:
+        busy.wait(0.01)
+    busy.set()
+    worker.join()
+    sampler.stop()
+
+    # The sampler does not sample itself
+    assert any(stack.startswith("busy-worker;") for stack in sampler.stacks)
+    assert not any("yklocker-sampler" in stack for stack in sampler.stacks)
+
+
+def test_profiler_sample(tmp_path) -> None:
+    yklocker = removing_yklocker()
+    profiler = Profiler(str(tmp_path / "profile.txt"), ProfileMode.SAMPLE, 3)
+    yklocker.set_profiler(profiler)
+    run_iterations(yklocker, 5)
+
+    assert profiler.sampler.stopped.is_set()
+    assert "samples every 5 ms" in profiler.summary()
+
+
+def test_profiler_dump_on_signal(tmp_path) -> None:
+    path = tmp_path / "profile.txt"
+    yklocker = YkLock()
+    yklocker.logger = MagicMock()
+    yklocker.is_yubikey_connected = MagicMock(return_value=True)
+    yklocker.set_profiler(Profiler(str(path)))
+
+    def dump_then_stop(yklocker: YkLock) -> bool:
+        if path.exists():
+            return False
+        yklocker.get_waker().wake(WakeReason.DUMP)
+        return True
+
+    with patch("platform.system", MagicMock(return_value=MyOS.LX)):
+        run_runtime(yklocker, dump_then_stop)
+    assert "1 iterations" in path.read_text()
+
+
+def test_profiler_dump_failed(tmp_path) -> None:
+    yklocker = YkLock()
+    yklocker.set_profiler(Profiler(str(tmp_path / "missing" / "profile.txt")))
+    with patch("sciber_yklocker.runtime.YkLock.logger") as mock_logger:
+        # The profiler wraps the logger it finds
+        runtime = Runtime(yklocker, lambda yklocker: False)
+        runtime.dump()
+        assert "Could not write the profile" in mock_logger.call_args[0][0]
+    runtime.probe_executor.shutdown()
+
+
+def test_allocation_tracer(tmp_path) -> None:
+    path = tmp_path / "allocations.txt"
+    tracer = AllocationTracer(str(path))
+    try:
+        assert tracemalloc.is_tracing()
+        tracer.dump()
+        first = path.read_text()
+        assert "Largest allocation sites" in first
+        assert "Growth since the previous dump" not in first
+
+        kept = [str(number) * 100 for number in range(1000)]
+        tracer.dump()
+        assert "Growth since the previous dump" in path.read_text()
+        assert "test_profiling.py" in path.read_text()
+        del kept
+    finally:
+        tracer.stop()
+    assert not tracemalloc.is_tracing()
+
+
+def test_allocation_tracer_dump_on_signal(tmp_path) -> None:
+    path = tmp_path / "allocations.txt"
+    yklocker = YkLock()
+    yklocker.logger = MagicMock()
+    yklocker.is_yubikey_connected = MagicMock(return_value=True)
+    yklocker.set_allocation_tracer(AllocationTracer(str(path)))
+
+    def dump_then_stop(yklocker: YkLock) -> bool:
+        if path.exists():
+            return False
+        yklocker.get_waker().wake(WakeReason.DUMP)
+        return True
+
+    try:
+        with patch("platform.system", MagicMock(return_value=MyOS.LX)):
+            run_runtime(yklocker, dump_then_stop)
+        assert "YubiKeyLocker allocations" in path.read_text()
+
+        # Not writable, logged and the loop goes on
+        yklocker.get_allocation_tracer().path = str(tmp_path / "missing" / "a.txt")
+        runtime = Runtime(yklocker, lambda yklocker: False)
+        runtime.dump()
+        assert "Could not write the allocations" in yklocker.logger.call_args[0][0]
+        runtime.probe_executor.shutdown()
+    finally:
+        yklocker.get_allocation_tracer().stop()
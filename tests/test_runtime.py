@@ -0,0 +1,355 @@
+import asyncio
+import subprocess
+import sys
+import threading
+from time import monotonic, sleep
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from sciber_yklocker.models.dispatch import DispatchEvent
+from sciber_yklocker.models.myos import MyOS
+from sciber_yklocker.models.presence import CONFIRM_INTERVAL, PresenceState
+from sciber_yklocker.models.removaloption import RemovalOption
+from sciber_yklocker.models.watchdog import StallPolicy
+from sciber_yklocker.models.yklock import YkLock
+from sciber_yklocker.probehelper import ProbeHelperError
+from sciber_yklocker.runtime import (
+    HOTPLUG_SAFETY_INTERVAL,
+    Runtime,
+    handle_dispatch_event,
+    next_probe_interval,
+    run_runtime,
+)
+from sciber_yklocker.waker import WakeReason
+
+
+def keep_running(yklocker: YkLock) -> bool:
+    return not yklocker.get_waker().stopped
+
+
+def test_next_probe_interval() -> None:
+    yklocker = YkLock()
+    yklocker.set_probe_interval(2)
+
+    assert next_probe_interval(yklocker, PresenceState.UNKNOWN) == 2
+    assert next_probe_interval(yklocker, PresenceState.PRESENT) == 2
+    assert next_probe_interval(yklocker, PresenceState.SUSPECT) == CONFIRM_INTERVAL
+    assert next_probe_interval(yklocker, PresenceState.ABSENT) == 2
+
+    # With hotplug events polling while present is only a safety net
+    yklocker.set_hotplug_watcher(MagicMock())
+    interval = next_probe_interval(yklocker, PresenceState.PRESENT)
+    assert interval == HOTPLUG_SAFETY_INTERVAL
+    assert next_probe_interval(yklocker, PresenceState.ABSENT) == 2
+
+
+@patch("sciber_yklocker.runtime.monotonic", lambda: 100.0)
+def test_wait_for_next_probe_timeout() -> None:
+    yklocker = YkLock()
+    runtime = Runtime(yklocker, keep_running)
+    runtime.wait = AsyncMock(return_value=set())
+
+    reasons = asyncio.run(runtime.wait_for_next_probe(PresenceState.PRESENT))
+    assert reasons == set()
+    runtime.wait.assert_called_once_with(yklocker.get_timeout())
+    assert yklocker.schedule.wakeups_last_hour() == 1
+
+
+@patch("sciber_yklocker.runtime.monotonic", lambda: 100.0)
+def test_wait_for_next_probe_hotplug() -> None:
+    yklocker = YkLock()
+    yklocker.set_hotplug_watcher(MagicMock())
+    runtime = Runtime(yklocker, keep_running)
+    runtime.wait = AsyncMock(return_value=set())
+
+    # YubiKey present, only poll as a safety net
+    asyncio.run(runtime.wait_for_next_probe(PresenceState.PRESENT))
+    runtime.wait.assert_called_once_with(HOTPLUG_SAFETY_INTERVAL)
+
+    # YubiKey missing, keep the regular interval
+    runtime.wait.reset_mock()
+    asyncio.run(runtime.wait_for_next_probe(PresenceState.ABSENT))
+    runtime.wait.assert_called_once_with(yklocker.get_timeout())
+
+
+@patch("sciber_yklocker.runtime.monotonic", lambda: 100.0)
+def test_wait_for_next_probe_backoff() -> None:
+    yklocker = YkLock()
+    yklocker.set_max_interval(40)
+    runtime = Runtime(yklocker, keep_running)
+    runtime.wait = AsyncMock(return_value=set())
+
+    for _ in range(4):
+        asyncio.run(runtime.wait_for_next_probe(PresenceState.PRESENT))
+    delays = [call[0][0] for call in runtime.wait.call_args_list]
+    assert delays == [10, 20, 40, 40]
+
+    # A hotplug event resets the backoff
+    runtime.wait.return_value = {WakeReason.HOTPLUG}
+    asyncio.run(runtime.wait_for_next_probe(PresenceState.PRESENT))
+    assert yklocker.schedule.backoff == 1
+
+
+def test_handle_dispatch_event() -> None:
+    yklocker = YkLock()
+    yklocker.set_removal_option(RemovalOption.LOCK)
+    yklocker.dispatcher.absent_since = 0
+    with patch("sciber_yklocker.runtime.YkLock.lock") as mock_lock:
+        with patch("sciber_yklocker.runtime.YkLock.logger") as mock_logger:
+            handle_dispatch_event(yklocker, DispatchEvent.NONE, 5)
+            mock_logger.assert_not_called()
+
+            handle_dispatch_event(yklocker, DispatchEvent.REMOVED, 0)
+            assert "action to take: Lock" in mock_logger.call_args[0][0]
+            mock_lock.assert_called_once_with()
+
+            handle_dispatch_event(yklocker, DispatchEvent.REARMED, 60)
+            assert "repeating action: Lock" in mock_logger.call_args[0][0]
+            assert mock_lock.call_count == 2
+
+            handle_dispatch_event(yklocker, DispatchEvent.STILL_ABSENT, 300)
+            mock_logger.assert_called_with("YubiKey still absent for 300 s")
+
+            yklocker.dispatcher.last_absence = 320
+            handle_dispatch_event(yklocker, DispatchEvent.RETURNED, 320)
+            mock_logger.assert_called_with("YubiKey found again after 320 s")
+            assert mock_lock.call_count == 2
+
+    # One removal, acted on twice
+    assert yklocker.metrics.removals == 1
+    assert yklocker.metrics.actions[RemovalOption.LOCK] == 2
+
+
+def test_runtime_stop_interrupts_wait() -> None:
+    yklocker = YkLock()
+    yklocker.is_yubikey_connected = MagicMock(return_value=True)
+    timer = threading.Timer(0.1, yklocker.get_waker().stop)
+    timer.start()
+
+    # The 10 second wait is cut short by the stop request
+    start = monotonic()
+    with patch("platform.system", MagicMock(return_value=MyOS.LX)):
+        with patch("sciber_yklocker.runtime.YkLock.logger") as mock_logger:
+            run_runtime(yklocker, keep_running)
+    assert monotonic() - start < 5
+    mock_logger.assert_called_with("Stopped YubiKeyLocker")
+    yklocker.is_yubikey_connected.assert_not_called()
+    timer.join()
+
+
+def test_runtime_probe_now() -> None:
+    yklocker = YkLock()
+    probes = []
+
+    def probe() -> bool:
+        probes.append(monotonic())
+        if len(probes) == 2:
+            yklocker.get_waker().stop()
+        return True
+
+    yklocker.is_yubikey_connected = probe
+    # Wake twice from another thread instead of waiting the 10 seconds
+    for delay in (0.05, 0.2):
+        threading.Timer(delay, yklocker.get_waker().wake, [WakeReason.PROBE]).start()
+
+    start = monotonic()
+    with patch("platform.system", MagicMock(return_value=MyOS.LX)):
+        with patch("sciber_yklocker.runtime.YkLock.logger"):
+            run_runtime(yklocker, keep_running)
+    assert len(probes) == 2
+    assert monotonic() - start < 5
+
+
+def test_runtime_slow_action_does_not_block_probes() -> None:
+    yklocker = YkLock()
+    yklocker.get_timeout = lambda: 0
+    connected = iter([False, True, True, True, True])
+    probed_during_action = threading.Event()
+
+    def probe() -> bool:
+        try:
+            return next(connected)
+        except StopIteration:
+            probed_during_action.set()
+            yklocker.get_waker().stop()
+            return True
+
+    def slow_lock() -> None:
+        # Still running while the probe loop continues
+        probed_during_action.wait(5)
+        sleep(0.05)
+
+    yklocker.is_yubikey_connected = probe
+    yklocker.lock = slow_lock
+    with patch("platform.system", MagicMock(return_value=MyOS.LX)):
+        with patch("sciber_yklocker.runtime.YkLock.logger") as mock_logger:
+            run_runtime(yklocker, keep_running)
+
+    assert probed_during_action.is_set()
+    # The action was not abandoned at shutdown
+    messages = [call[0][0] for call in mock_logger.call_args_list]
+    assert "YubiKey not found, action to take: doNothing" in messages
+
+
+def test_runtime_failed_action_keeps_acting() -> None:
+    yklocker = YkLock()
+    yklocker.set_removal_option(RemovalOption.LOCK)
+    # Removed, back, removed again
+    connected = iter([False, True, False])
+    locks = []
+
+    def probe() -> bool:
+        state = next(connected, None)
+        if state is None:
+            yklocker.get_waker().stop()
+            return False
+        yklocker.get_waker().wake(WakeReason.PROBE)
+        return state
+
+    def lock() -> None:
+        locks.append(monotonic())
+        if len(locks) == 1:
+            raise RuntimeError("D-Bus reply could not be decoded")
+
+    yklocker.is_yubikey_connected = probe
+    yklocker.lock = lock
+    yklocker.get_waker().wake(WakeReason.PROBE)
+    with patch("platform.system", MagicMock(return_value=MyOS.LX)):
+        with patch("sciber_yklocker.runtime.YkLock.logger") as mock_logger:
+            run_runtime(yklocker, keep_running)
+
+    assert len(locks) == 2
+    messages = [call[0][0] for call in mock_logger.call_args_list]
+    assert any(m.startswith("Lock action failed: RuntimeError") for m in messages)
+
+
+def test_runtime_probe_deadline() -> None:
+    yklocker = YkLock()
+    yklocker.set_probe_deadline(0.05)
+    yklocker.set_stalls_to_lock(2)
+    release = threading.Event()
+
+    def hung_probe() -> bool:
+        release.wait(5)
+        return True
+
+    yklocker.is_yubikey_connected = MagicMock(side_effect=hung_probe)
+    runtime = Runtime(yklocker, keep_running)
+
+    async def probes() -> list[bool]:
+        results = [await runtime.probe(), await runtime.probe()]
+        release.set()
+        results.append(await runtime.probe())
+        return results
+
+    with patch("sciber_yklocker.runtime.YkLock.logger") as mock_logger:
+        # Present after one stall, absent after the second one in a row
+        assert asyncio.run(probes()) == [True, False, True]
+        assert "probe stalled" in mock_logger.call_args_list[0][0][0]
+        assert "1 in a row, treating the YubiKey as present" in (
+            mock_logger.call_args_list[0][0][0]
+        )
+        assert "as absent" in mock_logger.call_args_list[1][0][0]
+
+    # The stuck probe was waited for, not started again behind itself
+    yklocker.is_yubikey_connected.assert_called_once()
+    assert yklocker.watchdog.stalls == 0
+    assert yklocker.watchdog.total_stalls == 2
+    assert yklocker.watchdog.max_duration >= 0.1
+    assert yklocker.metrics.probe_errors["stalled"] == 2
+    assert yklocker.metrics.probes == 3
+    runtime.probe_executor.shutdown()
+
+
+def test_runtime_probe_durations() -> None:
+    yklocker = YkLock()
+    yklocker.is_yubikey_connected = MagicMock(return_value=False)
+    runtime = Runtime(yklocker, keep_running)
+
+    async def probes() -> list[bool]:
+        return [await runtime.probe(), await runtime.probe()]
+
+    assert asyncio.run(probes()) == [False, False]
+    assert len(yklocker.watchdog.durations) == 2
+    assert yklocker.watchdog.total_stalls == 0
+    assert yklocker.metrics.probe_duration.counts[-1] == 0
+    assert sum(yklocker.metrics.probe_duration.counts) == 2
+    runtime.probe_executor.shutdown()
+
+
+def test_runtime_probe_helper_failed() -> None:
+    yklocker = YkLock()
+    yklocker.set_stall_policy(StallPolicy.ABSENT)
+    yklocker.is_yubikey_connected = MagicMock(
+        side_effect=[ProbeHelperError("Probe helper exited"), True]
+    )
+    runtime = Runtime(yklocker, keep_running)
+
+    async def probes() -> list[bool]:
+        return [await runtime.probe(), await runtime.probe()]
+
+    with patch("sciber_yklocker.runtime.YkLock.logger") as mock_logger:
+        # A crashed helper counts as a stall, the next probe starts over
+        assert asyncio.run(probes()) == [False, True]
+        message = mock_logger.call_args[0][0]
+        assert message.startswith("YubiKey probe failed, Probe helper exited")
+        assert message.endswith("treating the YubiKey as absent")
+    assert yklocker.is_yubikey_connected.call_count == 2
+    runtime.probe_executor.shutdown()
+
+
+def test_runtime_reload() -> None:
+    yklocker = YkLock()
+    yklocker.is_yubikey_connected = MagicMock(return_value=True)
+    reload = MagicMock(side_effect=lambda yklocker: yklocker.get_waker().stop())
+    yklocker.get_waker().wake(WakeReason.RELOAD)
+
+    with patch("platform.system", MagicMock(return_value=MyOS.LX)):
+        with patch("sciber_yklocker.runtime.YkLock.logger"):
+            run_runtime(yklocker, keep_running, reload)
+    reload.assert_called_once_with(yklocker)
+
+
+def test_runtime_export_metrics() -> None:
+    yklocker = YkLock()
+    yklocker.is_yubikey_connected = MagicMock(return_value=True)
+    exporter = MagicMock()
+    yklocker.set_metrics_exporter(exporter)
+    runtime = Runtime(yklocker, keep_running)
+
+    # Every probe gives the exporter a chance to write
+    runtime.export_metrics(5)
+    exporter.update.assert_called_once_with(5)
+
+    exporter.update.side_effect = PermissionError("Permission denied")
+    with patch("sciber_yklocker.runtime.YkLock.logger") as mock_logger:
+        runtime.export_metrics(6)
+        mock_logger.assert_called_once_with(
+            "Could not write the metrics file: Permission denied"
+        )
+    runtime.probe_executor.shutdown()
+
+
+# Exits once the runtime returned, while its only probe is still stuck
+HUNG_PROBE = """
+import threading
+from unittest.mock import MagicMock, patch
+from sciber_yklocker.models.yklock import YkLock
+from sciber_yklocker.runtime import run_runtime
+
+yklocker = YkLock()
+yklocker.logger = lambda msg: None
+yklocker.set_probe_deadline(0.1)
+yklocker.set_probe_interval(0.05)
+yklocker.is_yubikey_connected = threading.Event().wait
+with patch("platform.system", MagicMock(return_value="Linux")):
+    run_runtime(yklocker, lambda yklocker: yklocker.watchdog.total_stalls < 2)
+print("runtime returned")
+"""
+
+
+def test_runtime_exits_with_hung_probe() -> None:
+    result = subprocess.run(
+        [sys.executable, "-c", HUNG_PROBE], capture_output=True, text=True, timeout=30
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout == "runtime returned\n"
@@ -0,0 +1,68 @@
+from unittest.mock import MagicMock
+
+from sciber_yklocker.models.presence import PresenceState
+from sciber_yklocker.models.schedule import BATTERY_FACTOR, PollSchedule
+
+
+def test_schedule_default_keeps_interval() -> None:
+    schedule = PollSchedule()
+    for _ in range(5):
+        assert schedule.next_delay(10, PresenceState.PRESENT, 100.0) == 10
+
+
+def test_schedule_backoff_while_stable() -> None:
+    schedule = PollSchedule(max_interval=40)
+    delays = [schedule.next_delay(10, PresenceState.PRESENT, 100.0) for _ in range(5)]
+    assert delays == [10, 20, 40, 40, 40]
+
+    # A state change or activity starts over at the fast interval
+    assert schedule.next_delay(10, PresenceState.SUSPECT, 100.0) == 10
+    assert schedule.next_delay(10, PresenceState.PRESENT, 100.0) == 10
+    schedule.next_delay(10, PresenceState.PRESENT, 100.0)
+    schedule.note_activity()
+    assert schedule.next_delay(10, PresenceState.PRESENT, 100.0) == 10
+
+
+def test_schedule_no_backoff_while_absent() -> None:
+    schedule = PollSchedule(max_interval=40)
+    for _ in range(3):
+        assert schedule.next_delay(10, PresenceState.ABSENT, 100.0) == 10
+
+
+def test_schedule_battery() -> None:
+    on_battery = MagicMock(return_value=True)
+    schedule = PollSchedule(max_interval=20, on_battery=on_battery)
+    delays = [schedule.next_delay(10, PresenceState.PRESENT, 100.0) for _ in range(5)]
+    assert delays == [10, 20, 40, 40, 40]
+    assert max(delays) == 20 * BATTERY_FACTOR
+    # The power source is not read on every probe
+    on_battery.assert_called_once()
+
+
+def test_schedule_battery_no_max_interval() -> None:
+    schedule = PollSchedule(on_battery=lambda: True)
+    delays = [schedule.next_delay(10, PresenceState.PRESENT, 100.0) for _ in range(4)]
+    assert delays == [10, 10 * BATTERY_FACTOR, 10 * BATTERY_FACTOR, 10 * BATTERY_FACTOR]
+    # Never while absent
+    assert schedule.next_delay(10, PresenceState.ABSENT, 100.0) == 10
+
+
+def test_schedule_wakeup_cap() -> None:
+    schedule = PollSchedule(max_wakeups_per_hour=60)
+    assert schedule.next_delay(10, PresenceState.PRESENT, 100.0) == 60
+    # Confirming a removal is never capped
+    assert schedule.next_delay(0.25, PresenceState.SUSPECT, 100.0) == 0.25
+
+
+def test_schedule_align() -> None:
+    schedule = PollSchedule()
+    # Long delays end on whole seconds, short ones are left alone
+    assert schedule.align(10, 100.5) == 10.5
+    assert schedule.align(0.25, 100.4) == 0.25
+
+
+def test_schedule_wakeups_last_hour() -> None:
+    schedule = PollSchedule()
+    for now in range(0, 7200, 60):
+        schedule.note_wakeup(now)
+    assert schedule.wakeups_last_hour() == 61
@@ -0,0 +1,28 @@
+from sciber_yklocker.models.removaloption import RemovalOption
+from sciber_yklocker.models.settings import DEFAULT_SETTINGS, Settings, merge_settings
+
+
+def test_merge_settings() -> None:
+    cli = Settings(timeout=5)
+    user = Settings(timeout=20, grace_period=2)
+    system = Settings(removal_option=RemovalOption.LOCK, grace_period=1)
+
+    assert merge_settings(cli, user, system) == Settings(
+        removal_option=RemovalOption.LOCK, timeout=5, grace_period=2
+    )
+    assert merge_settings() == Settings()
+
+
+def test_default_settings() -> None:
+    # Everything that can be set has a default, None only where it means off
+    defaults = DEFAULT_SETTINGS._asdict()
+    assert {field for field, value in defaults.items() if value is None} == {
+        "probe_interval",
+        "max_interval",
+        "max_wakeups_per_hour",
+        "metrics_file",
+        "metrics_port",
+        "profile",
+        "trace_allocations",
+        "control_socket",
+    }
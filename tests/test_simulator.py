@@ -0,0 +1,202 @@
+import json
+import random
+
+import pytest
+
+from sciber_yklocker.config import ConfigError
+from sciber_yklocker.models.escalation import EscalationStep
+from sciber_yklocker.models.presence import CONFIRM_INTERVAL
+from sciber_yklocker.models.removaloption import RemovalOption
+from sciber_yklocker.models.settings import Settings
+from sciber_yklocker.simulator import (
+    TRACES,
+    Policy,
+    Timeline,
+    Trace,
+    TraceEvent,
+    TraceKind,
+    main,
+    parse_policy,
+    simulate,
+)
+
+INSERT = TraceEvent(0, TraceKind.INSERT)
+
+
+def test_timeline_visibility() -> None:
+    timeline = Timeline(
+        Trace(
+            "test",
+            100,
+            (
+                INSERT,
+                TraceEvent(10, TraceKind.GLITCH, 1),
+                TraceEvent(20, TraceKind.REMOVE),
+                # Removed already, the glitch changes nothing
+                TraceEvent(25, TraceKind.GLITCH, 1),
+                TraceEvent(30, TraceKind.INSERT),
+            ),
+        )
+    )
+
+    assert timeline.changes == [0, 10, 11, 20, 30]
+    assert timeline.visible(5)
+    assert not timeline.visible(10.5)
+    assert timeline.visible(11)
+    assert not timeline.visible(25.5)
+    assert timeline.visible(30)
+
+    # Only the removal counts as one
+    assert timeline.removals == [(20, 30)]
+    assert timeline.removal_at(10.5) is None
+    assert timeline.removal_at(25) == 0
+    assert timeline.removal_at(30) is None
+
+
+def test_timeline_suspend() -> None:
+    timeline = Timeline(
+        Trace("test", 100, (INSERT, TraceEvent(10, TraceKind.SUSPEND, 20)))
+    )
+
+    # The monotonic clock stops while suspended
+    assert timeline.to_monotonic(5) == 5
+    assert timeline.to_monotonic(20) == 10
+    assert timeline.to_monotonic(40) == 20
+    # A timer due during the sleep fires the remaining time after it
+    assert timeline.to_wall(5) == 5
+    assert timeline.to_wall(12) == 32
+    # Events during the sleep arrive on wake up
+    assert timeline.awake(15) == 30
+    assert timeline.awake(35) == 35
+
+
+def test_simulate_removal() -> None:
+    trace = Trace(
+        "test",
+        3600,
+        (INSERT, TraceEvent(95, TraceKind.REMOVE), TraceEvent(200, TraceKind.INSERT)),
+    )
+    # Probes every 10 seconds, the removal is seen by the probe at 100 s
+    result = simulate(trace, Policy("test", Settings(probe_interval=10)))
+
+    assert result.probes == 360
+    assert result.locks == 1
+    assert result.false_locks == 0
+    assert result.removals == 1
+    assert result.missed_removals == 0
+    assert result.latencies == (5,)
+
+
+def test_simulate_hotplug() -> None:
+    trace = Trace(
+        "test",
+        3600,
+        (INSERT, TraceEvent(95, TraceKind.REMOVE), TraceEvent(200, TraceKind.INSERT)),
+    )
+    result = simulate(trace, Policy("test", Settings(probe_interval=10), True))
+
+    # Woken by the removal itself, and probing less while present
+    assert result.latencies == (0,)
+    assert result.probes < 360
+
+
+def test_simulate_grace_period() -> None:
+    trace = Trace("test", 3600, (INSERT, TraceEvent(100, TraceKind.GLITCH, 1)))
+
+    # Without grace the hub reset locks, with it the YubiKey is back in time
+    result = simulate(trace, Policy("test", Settings(probe_interval=10), True))
+    assert result.false_locks == 1
+    settings = Settings(probe_interval=10, grace_period=2, required_misses=2)
+    result = simulate(trace, Policy("test", settings, True))
+    assert result.false_locks == 0
+
+    # The removal is confirmed quickly once suspected
+    trace = Trace("test", 3600, (INSERT, TraceEvent(100, TraceKind.REMOVE)))
+    result = simulate(trace, Policy("test", settings, True))
+    assert result.latencies[0] <= 2 + CONFIRM_INTERVAL
+
+
+def test_simulate_escalation() -> None:
+    trace = Trace(
+        "test",
+        3600,
+        (
+            INSERT,
+            TraceEvent(95, TraceKind.REMOVE),
+            TraceEvent(400, TraceKind.INSERT),
+            TraceEvent(995, TraceKind.REMOVE),
+        ),
+    )
+    escalation = (
+        EscalationStep(30, RemovalOption.LOCK),
+        EscalationStep(600, command=("notify-send", "YubiKey")),
+    )
+    settings = Settings(probe_interval=10, escalation=escalation)
+    result = simulate(trace, Policy("test", settings))
+
+    # Locked 30 s after each removal was seen, the command only ran for the
+    # removal that lasted long enough
+    assert result.locks == 2
+    assert result.escalations == 3
+    assert result.latencies == (35, 35)
+    assert result.false_locks == 0
+
+
+def test_simulate_suspend() -> None:
+    trace = Trace(
+        "test",
+        3600,
+        (
+            INSERT,
+            TraceEvent(100, TraceKind.SUSPEND, 600),
+            TraceEvent(300, TraceKind.REMOVE),
+            TraceEvent(1000, TraceKind.INSERT),
+            # Put back before waking up, nothing to lock
+            TraceEvent(1500, TraceKind.SUSPEND, 600),
+            TraceEvent(1600, TraceKind.REMOVE),
+            TraceEvent(1700, TraceKind.INSERT),
+        ),
+    )
+    result = simulate(trace, Policy("test", Settings(probe_interval=10), True))
+
+    # Locked right when waking up, the time asleep does not count
+    assert result.locks == 1
+    assert result.latencies == (0,)
+    assert result.removals == 2
+    assert result.missed_removals == 0
+
+
+@pytest.mark.parametrize("name", TRACES)
+def test_traces_are_deterministic(name) -> None:
+    policy = parse_policy("hotplug=true")
+    first = simulate(TRACES[name](2, random.Random(1)), policy)
+    again = simulate(TRACES[name](2, random.Random(1)), policy)
+
+    assert first == again
+    assert first.probes > 0
+    assert first.missed_removals == 0
+
+
+def test_parse_policy() -> None:
+    policy = parse_policy("probe_interval=5,grace_period=2.5,hotplug=true")
+    assert policy.settings.probe_interval == 5
+    assert policy.settings.grace_period == 2.5
+    assert policy.hotplug
+    assert parse_policy("default") == Policy("default")
+
+    with pytest.raises(ConfigError):
+        parse_policy("probe_interval=-1")
+    with pytest.raises(ConfigError):
+        parse_policy("probe_interval")
+
+
+def test_main(capsys) -> None:
+    main(["--hours", "1", "--trace", "removal", "--policy", "probe_interval=5"])
+    output = json.loads(capsys.readouterr().out)
+
+    policy = output["policies"]["probe_interval=5"]
+    assert policy["total"]["removals"] == policy["traces"]["removal"]["removals"]
+    assert policy["total"]["latency"]["max"] <= 5
+
+    with pytest.raises(SystemExit):
+        main(["--policy", "unknown=1"])
@@ -0,0 +1,251 @@
+import os
+import platform
+from time import monotonic, sleep
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from sciber_yklocker.config import ConfigError
+from sciber_yklocker.lib.dbus import BusClient, DBusConnection
+from sciber_yklocker.lib.session import LOGIND_MANAGER, LOGIND_SESSION, PROPERTIES
+from sciber_yklocker.lib.sysfs import device_seat
+from sciber_yklocker.models.myos import MyOS
+from sciber_yklocker.models.presence import PresenceState
+from sciber_yklocker.models.removaloption import RemovalOption
+from sciber_yklocker.runtime import HOTPLUG_SAFETY_INTERVAL
+from sciber_yklocker.waker import WakeReason
+
+if platform.system() != MyOS.LX:
+    pytest.skip("System mode is only for Linux", allow_module_level=True)
+
+from sciber_yklocker.system import (  # noqa: E402
+    LOGIND_SEAT,
+    SystemLocker,
+    read_user_config,
+    run_system,
+)
+
+# alice is the user running the tests
+ALICE = os.getuid()
+BOB = ALICE + 1
+SESSIONS = [
+    ("2", ALICE, "alice", "seat0", "/org/freedesktop/login1/session/_32"),
+    ("5", BOB, "bob", "seat1", "/org/freedesktop/login1/session/_35"),
+    # Remote, and the greeter
+    ("7", BOB + 1, "carol", "", "/org/freedesktop/login1/session/_37"),
+    ("c1", BOB + 2, "gdm", "seat0", "/org/freedesktop/login1/session/c1"),
+]
+
+
+def make_usb(root, path: str, dev: str, vendor_id: str = "1d6b") -> None:
+    # /sys/devices/.../usb1/1-3/1-3.1, linked from /sys/bus/usb/devices
+    device = root / "devices" / path
+    device.mkdir(parents=True)
+    (device / "dev").write_text(dev + "\n")
+    (device / "idVendor").write_text(vendor_id + "\n")
+    (device / "idProduct").write_text("0407\n")
+    (device / "devnum").write_text(dev.split(":")[1] + "\n")
+    (root / "bus").mkdir(exist_ok=True)
+    (root / "bus" / os.path.basename(path)).symlink_to(device)
+
+
+@pytest.fixture
+def sysfs(tmp_path):
+    make_usb(tmp_path, "usb1", "189:0")
+    # A hub that belongs to the second seat
+    make_usb(tmp_path, "usb1/1-3", "189:2")
+    (tmp_path / "udev").mkdir()
+    (tmp_path / "udev" / "c189:2").write_text("E:ID_SEAT=seat1\nG:seat\n")
+    return tmp_path
+
+
+def logind(bus, active: dict[str, str]) -> None:
+    def get(message):
+        interface, name = message.body
+        if name == "Class":
+            return "v", [("s", "greeter" if message.path.endswith("c1") else "user")]
+        seat = message.path.rsplit("/", 1)[1]
+        session = active[seat]
+        return "v", [("(so)", (session, f"/session/{session}"))]
+
+    bus.handlers[(LOGIND_MANAGER, "ListSessions")] = lambda m: ("a(susso)", [SESSIONS])
+    bus.handlers[(PROPERTIES, "Get")] = get
+
+
+def make_locker(bus, sysfs) -> SystemLocker:
+    (sysfs / "yklocker.toml").write_text('removal_option = "Lock"\n')
+    locker = SystemLocker(
+        DBusConnection(bus.address),
+        BusClient(lambda: bus.address),
+        system_config=str(sysfs / "yklocker.toml"),
+        sysfs_root=str(sysfs / "bus"),
+        udev_root=str(sysfs / "udev"),
+        user_config=lambda uid: str(sysfs / f"user-{uid}.toml"),
+    )
+    locker.logger = MagicMock()
+    return locker
+
+
+def lock_calls(bus) -> list[tuple[str, str]]:
+    return [
+        (message.path, message.member)
+        for message in bus.calls
+        if message.interface == LOGIND_SESSION
+    ]
+
+
+def test_device_seat(sysfs) -> None:
+    make_usb(sysfs, "usb1/1-2", "189:1", "1050")
+    make_usb(sysfs, "usb1/1-3/1-3.1", "189:3", "1050")
+    root, udev = str(sysfs / "bus"), str(sysfs / "udev")
+
+    assert device_seat("1-2", root, udev) == "seat0"
+    # Inherited from the hub
+    assert device_seat("1-3.1", root, udev) == "seat1"
+
+
+def test_read_user_config(tmp_path) -> None:
+    path = tmp_path / "yklocker.toml"
+    path.write_text('removal_option = "Logout"\n')
+    uid = os.getuid()
+    assert read_user_config(str(path), uid).removal_option == RemovalOption.LOGOUT
+    assert read_user_config(str(tmp_path / "missing"), uid).removal_option is None
+
+    # Not the user's file, or a link to another file
+    with pytest.raises(ConfigError, match="not a file owned by"):
+        read_user_config(str(path), uid + 1)
+    (tmp_path / "link.toml").symlink_to(path)
+    with pytest.raises(ConfigError):
+        read_user_config(str(tmp_path / "link.toml"), uid)
+
+
+def test_sessions_and_seats(stand_in_bus, sysfs) -> None:
+    logind(stand_in_bus, {"seat0": "2", "seat1": "5"})
+    locker = make_locker(stand_in_bus, sysfs)
+    (sysfs / f"user-{ALICE}.toml").write_text('removal_option = "Logout"\n')
+    # Written by alice, so not bob's choice
+    (sysfs / f"user-{BOB}.toml").write_text('removal_option = "doNothing"\n')
+    locker.reload()
+
+    # Seated user sessions only
+    assert sorted(locker.sessions) == ["2", "5"]
+    assert sorted(locker.seats) == ["seat0", "seat1"]
+    assert locker.sessions["2"].removal_option == RemovalOption.LOGOUT
+    assert locker.sessions["5"].removal_option == RemovalOption.LOCK
+    members = stand_in_bus.members()
+    assert members.count("Get") == 3
+
+    # Known sessions are not asked for their class again
+    locker.refresh_sessions()
+    assert stand_in_bus.members().count("Get") == 4
+
+
+def test_removal_per_seat(stand_in_bus, sysfs) -> None:
+    logind(stand_in_bus, {"seat0": "2", "seat1": "5"})
+    locker = make_locker(stand_in_bus, sysfs)
+    locker.reload()
+    make_usb(sysfs, "usb1/1-2", "189:1", "1050")
+    make_usb(sysfs, "usb1/1-3/1-3.1", "189:3", "1050")
+
+    locker.probe(0)
+    assert locker.device_seats == {"1-2@1": "seat0", "1-3.1@3": "seat1"}
+    assert lock_calls(stand_in_bus) == []
+
+    # bob's YubiKey is pulled, only bob's session is locked
+    (sysfs / "bus" / "1-3.1").unlink()
+    locker.probe(1)
+    locker.action_executor.shutdown(wait=True)
+    assert lock_calls(stand_in_bus) == [("/org/freedesktop/login1/session/_35", "Lock")]
+    assert "action to take for bob: Lock" in locker.logger.call_args[0][0]
+    assert locker.seats["seat0"].presence.state == PresenceState.PRESENT
+
+
+def test_session_switch_on_absent_seat(stand_in_bus, sysfs) -> None:
+    # dave is also logged in on alice's seat, switched to while she is away
+    active = {"seat0": "2", "seat1": "5"}
+    logind(stand_in_bus, active)
+    dave = ("8", BOB + 3, "dave", "seat0", "/org/freedesktop/login1/session/_38")
+    listed = ("a(susso)", [SESSIONS + [dave]])
+    stand_in_bus.handlers[(LOGIND_MANAGER, "ListSessions")] = lambda m: listed
+    locker = make_locker(stand_in_bus, sysfs)
+    with patch("sciber_yklocker.system.UeventWatcher", side_effect=OSError("no")):
+        locker.watch()
+    locker.reload()
+    # Only bob's YubiKey is in
+    make_usb(sysfs, "usb1/1-3/1-3.1", "189:3", "1050")
+    locker.probe(0)
+    locker.probe(1)
+
+    def switch(seat: str, session: str) -> None:
+        active[seat] = session
+        changed = {"ActiveSession": ("(so)", (session, f"/session/{session}"))}
+        stand_in_bus.emit(
+            f"/org/freedesktop/login1/seat/{seat}",
+            PROPERTIES,
+            "PropertiesChanged",
+            "sa{sv}as",
+            [LOGIND_SEAT, changed, []],
+        )
+
+    # A switch on a seat with its YubiKey changes nothing
+    switch("seat1", "5")
+    switch("seat0", "8")
+    deadline = monotonic() + 5
+    while (reason := locker.handle_signals()) is None and monotonic() < deadline:
+        sleep(0.01)
+    assert reason == WakeReason.PROBE
+    locker.probe(2)
+    locker.action_executor.shutdown(wait=True)
+    assert lock_calls(stand_in_bus) == [
+        ("/org/freedesktop/login1/session/_32", "Lock"),
+        ("/org/freedesktop/login1/session/_38", "Lock"),
+    ]
+
+
+def test_next_interval(stand_in_bus, sysfs) -> None:
+    logind(stand_in_bus, {"seat0": "2", "seat1": "5"})
+    locker = make_locker(stand_in_bus, sysfs)
+    locker.reload()
+    locker.hotplug_watcher = MagicMock()
+    make_usb(sysfs, "usb1/1-2", "189:1", "1050")
+    make_usb(sysfs, "usb1/1-3/1-3.1", "189:3", "1050")
+    locker.probe(0)
+
+    # Every seat has its YubiKey, polling is only a safety net
+    assert locker.next_interval() == HOTPLUG_SAFETY_INTERVAL
+    # bob's is missing, so keep polling
+    (sysfs / "bus" / "1-3.1").unlink()
+    locker.probe(1)
+    locker.action_executor.shutdown(wait=True)
+    assert locker.next_interval() == locker.settings.timeout
+
+
+def test_run(stand_in_bus, sysfs) -> None:
+    logind(stand_in_bus, {"seat0": "2", "seat1": "5"})
+    locker = make_locker(stand_in_bus, sysfs)
+    probes = []
+    locker.probe = lambda now: probes.append(now)
+
+    def keep_running() -> bool:
+        if len(probes) == 1:
+            # A new session, listed again before the next probe
+            stand_in_bus.emit("/org/freedesktop/login1", LOGIND_MANAGER, "SessionNew")
+        if len(probes) == 2:
+            locker.waker.stop()
+        return True
+
+    start = monotonic()
+    with patch("sciber_yklocker.system.UeventWatcher", side_effect=OSError("no")):
+        locker.watch()
+        locker.waker.wake(WakeReason.PROBE)
+        locker.run(keep_running)
+    assert monotonic() - start < HOTPLUG_SAFETY_INTERVAL
+    assert stand_in_bus.members().count("ListSessions") == 2
+    assert "Stopped YubiKeyLocker" in locker.logger.call_args[0][0]
+
+
+def test_run_system_needs_root(capsys) -> None:
+    assert run_system(["extra"]) == 1
+    with patch("os.geteuid", return_value=1000):
+        assert run_system([]) == 1
+    assert "run it as root" in capsys.readouterr().out
@@ -0,0 +1,39 @@
+from sciber_yklocker.models.timers import TimerHeap
+
+
+def test_pop_due() -> None:
+    timers = TimerHeap()
+    assert timers.next_deadline() is None
+    assert timers.pop_due(100) == []
+
+    timers.schedule(30, "c")
+    timers.schedule(10, "a")
+    timers.schedule(10, "b")
+    assert len(timers) == 3
+    assert timers.next_deadline() == 10
+
+    # Same deadline, in the order they were scheduled
+    assert timers.pop_due(9) == []
+    assert timers.pop_due(10) == ["a", "b"]
+    assert timers.next_deadline() == 30
+    assert timers.pop_due(100) == ["c"]
+    assert len(timers) == 0
+
+
+def test_cancel() -> None:
+    timers = TimerHeap()
+    first = timers.schedule(10, "a")
+    second = timers.schedule(20, "b")
+    timers.schedule(30, "c")
+
+    timers.cancel(first)
+    timers.cancel(first)
+    assert len(timers) == 2
+    assert timers.next_deadline() == 20
+
+    timers.cancel(second)
+    assert timers.pop_due(100) == ["c"]
+    # Cancelling a timer that already fired changes nothing
+    timers.cancel(second)
+    assert len(timers) == 0
+    assert timers.heap == []
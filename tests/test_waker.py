@@ -0,0 +1,93 @@
+import os
+import platform
+import signal
+import socket
+import threading
+from time import monotonic
+
+from sciber_yklocker.models.myos import MyOS
+from sciber_yklocker.waker import Waker, WakeReason, install_signal_handlers
+
+
+def test_waker_timeout() -> None:
+    waker = Waker()
+    start = monotonic()
+    assert waker.wait(0.05) == set()
+    assert monotonic() - start >= 0.05
+    waker.close()
+
+
+def test_waker_wake_from_thread() -> None:
+    waker = Waker()
+    timer = threading.Timer(0.05, waker.wake, [WakeReason.PROBE])
+    timer.start()
+
+    # Interrupted long before the timeout
+    start = monotonic()
+    assert waker.wait(10) == {WakeReason.PROBE}
+    assert monotonic() - start < 5
+    timer.join()
+
+    # Reasons are only reported once
+    assert waker.wait(0) == set()
+    waker.close()
+
+
+def test_waker_stop() -> None:
+    waker = Waker()
+    waker.stop()
+    assert waker.stopped is True
+    assert waker.wait(10) == {WakeReason.STOP}
+    waker.close()
+
+
+def test_waker_sources() -> None:
+    waker = Waker()
+    remote, local = socket.socketpair()
+    local.setblocking(False)
+
+    def handler() -> WakeReason | None:
+        data = local.recv(16)
+        if data == b"yes":
+            return WakeReason.HOTPLUG
+        return None
+
+    waker.add_source(local, handler)
+    remote.send(b"no")
+    assert waker.wait(0.05) == set()
+    remote.send(b"yes")
+    assert waker.wait(5) == {WakeReason.HOTPLUG}
+
+    waker.remove_source(local)
+    remote.send(b"yes")
+    assert waker.wait(0.05) == set()
+
+    waker.close()
+    remote.close()
+    local.close()
+
+
+def test_install_signal_handlers() -> None:
+    if platform.system() == MyOS.LX or platform.system() == MyOS.MAC:
+        waker = Waker()
+        previous = {
+            signum: signal.getsignal(signum)
+            for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGUSR1)
+        }
+        try:
+            install_signal_handlers(waker)
+
+            os.kill(os.getpid(), signal.SIGHUP)
+            assert waker.wait(5) == {WakeReason.RELOAD}
+            assert waker.stopped is False
+
+            os.kill(os.getpid(), signal.SIGUSR1)
+            assert waker.wait(5) == {WakeReason.DUMP}
+
+            os.kill(os.getpid(), signal.SIGTERM)
+            assert waker.wait(5) == {WakeReason.STOP}
+            assert waker.stopped is True
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+            waker.close()
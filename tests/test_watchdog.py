@@ -0,0 +1,51 @@
+from sciber_yklocker.models.watchdog import (
+    PROBE_DEADLINE,
+    STALLS_TO_LOCK,
+    ProbeWatchdog,
+    StallPolicy,
+)
+
+
+def test_watchdog_defaults() -> None:
+    watchdog = ProbeWatchdog()
+    assert watchdog.deadline == PROBE_DEADLINE
+    assert watchdog.policy == StallPolicy.LOCK
+    assert watchdog.stalls_to_lock == STALLS_TO_LOCK
+    assert watchdog.percentile(0.5) == 0
+
+
+def test_watchdog_absent() -> None:
+    watchdog = ProbeWatchdog(policy=StallPolicy.ABSENT)
+    assert watchdog.stalled() is False
+    assert watchdog.stalled() is False
+
+
+def test_watchdog_present() -> None:
+    watchdog = ProbeWatchdog(policy=StallPolicy.PRESENT)
+    for _ in range(10):
+        assert watchdog.stalled() is True
+    assert watchdog.total_stalls == 10
+
+
+def test_watchdog_lock_after_stalls() -> None:
+    watchdog = ProbeWatchdog(policy=StallPolicy.LOCK, stalls_to_lock=3)
+    assert [watchdog.stalled() for _ in range(4)] == [True, True, False, False]
+
+    # A probe that finishes in time starts the count over
+    watchdog.completed(0.1)
+    assert watchdog.stalls == 0
+    assert watchdog.stalled() is True
+    assert watchdog.total_stalls == 5
+
+
+def test_watchdog_durations() -> None:
+    watchdog = ProbeWatchdog()
+    for duration in range(1, 101):
+        watchdog.completed(duration / 100)
+    watchdog.completed(7)
+
+    # Only the latest durations are kept, the maximum is not forgotten
+    assert len(watchdog.durations) == 100
+    assert watchdog.max_duration == 7
+    assert watchdog.percentile(0.5) == 0.52
+    assert watchdog.percentile(1) == 7
@@ -1,6 +1,13 @@
 from unittest.mock import MagicMock, patch
 
+import pytest
+
+from sciber_yklocker.actuator import ActuatorError
+from sciber_yklocker.models.dispatch import DispatchEvent
+from sciber_yklocker.models.presence import PresenceState
 from sciber_yklocker.models.removaloption import RemovalOption
+from sciber_yklocker.models.settings import Settings
+from sciber_yklocker.models.watchdog import PROBE_DEADLINE, StallPolicy
 from sciber_yklocker.models.yklock import YkLock
 
 
@@ -43,21 +50,57 @@ def test_yklock_getset_removal_option() -> None:
 
 def test_yklock_lock_default() -> None:
     with patch(
-        "sciber_yklocker.models.yklock.lock_system", MagicMock()
-    ) as mock_lock_system:
+        "sciber_yklocker.models.yklock.build_actuator", MagicMock()
+    ) as mock_build_actuator:
         yklocker = YkLock()
         yklocker.lock()
-    mock_lock_system.assert_not_called()
+    mock_build_actuator.assert_not_called()
 
 
 def test_yklock_lock_lock() -> None:
     with patch(
-        "sciber_yklocker.models.yklock.lock_system", MagicMock()
-    ) as mock_lock_system:
+        "sciber_yklocker.models.yklock.build_actuator", MagicMock()
+    ) as mock_build_actuator:
+        mock_build_actuator.return_value.removal_option = RemovalOption.LOCK
+        yklocker = YkLock()
+        yklocker.set_removal_option(RemovalOption.LOCK)
+        yklocker.prepare_actuator()
+        yklocker.lock()
+        yklocker.lock()
+    # Built and validated once, both locks only act
+    mock_build_actuator.assert_called_once_with(RemovalOption.LOCK)
+    mock_build_actuator.return_value.validate.assert_called_once()
+    assert mock_build_actuator.return_value.act.call_count == 2
+
+
+def test_yklock_lock_rebuilds_actuator() -> None:
+    with patch("sciber_yklocker.models.yklock.build_actuator") as mock_build_actuator:
+        mock_build_actuator.side_effect = lambda option: MagicMock(
+            removal_option=option
+        )
         yklocker = YkLock()
         yklocker.set_removal_option(RemovalOption.LOCK)
+        yklocker.prepare_actuator()
+        yklocker.set_removal_option(RemovalOption.LOGOUT)
         yklocker.lock()
-    mock_lock_system.assert_called_once()
+        assert mock_build_actuator.call_args[0][0] == RemovalOption.LOGOUT
+        yklocker.actuator.act.assert_called_once()
+
+
+def test_yklock_lock_invalid_actuator() -> None:
+    actuator = MagicMock(removal_option=RemovalOption.LOCK)
+    actuator.validate.side_effect = ActuatorError("no screensaver")
+    with patch("sciber_yklocker.models.yklock.build_actuator", return_value=actuator):
+        yklocker = YkLock()
+        yklocker.set_removal_option(RemovalOption.LOCK)
+        with pytest.raises(ActuatorError):
+            yklocker.prepare_actuator()
+
+        # Still tried when the YubiKey is removed
+        with patch.object(yklocker, "logger") as mock_logger:
+            yklocker.lock()
+            assert "may fail: no screensaver" in mock_logger.call_args[0][0]
+        actuator.act.assert_called_once()
 
 
 def test_yklock_logger() -> None:
@@ -72,6 +115,7 @@ def test_yklock_logger() -> None:
 
 def test_YkLock_is_yubikey_connected_false() -> None:
     yklocker = YkLock()
+    yklocker.set_sysfs_root(None)
     # Make sure no YubiKeys are found by return an empty array
     with patch("sciber_yklocker.models.yklock.list_all_devices", lambda: []):
         assert yklocker.is_yubikey_connected() is False
@@ -79,7 +123,214 @@ def test_YkLock_is_yubikey_connected_false() -> None:
 
 def test_YkLock_is_yubikey_connected_true() -> None:
     yklocker = YkLock()
+    yklocker.set_sysfs_root(None)
 
     # Make sure one "YubiKey" is found
     with patch("sciber_yklocker.models.yklock.list_all_devices", mock_list_one_device):
         assert yklocker.is_yubikey_connected() is True
+
+
+def test_YkLock_is_yubikey_connected_sysfs(tmp_path) -> None:
+    yklocker = YkLock()
+    yklocker.set_sysfs_root(str(tmp_path))
+
+    # The sysfs tier answers on its own, ykman is never asked
+    with patch("sciber_yklocker.models.yklock.list_all_devices") as mock_list:
+        assert yklocker.is_yubikey_connected() is False
+
+        device = tmp_path / "1-2"
+        device.mkdir()
+        (device / "idVendor").write_text("1050\n")
+        (device / "idProduct").write_text("0407\n")
+        assert yklocker.is_yubikey_connected() is True
+
+        mock_list.assert_not_called()
+
+
+def test_YkLock_is_yubikey_connected_no_sysfs(tmp_path) -> None:
+    yklocker = YkLock()
+    # A missing sysfs tree falls back to ykman
+    yklocker.set_sysfs_root(str(tmp_path / "missing"))
+    with patch("sciber_yklocker.models.yklock.list_all_devices", lambda: []):
+        assert yklocker.is_yubikey_connected() is False
+
+
+def test_yklock_getset_serial_allowlist() -> None:
+    yklocker = YkLock()
+    yklocker.set_serial_allowlist({12345678})
+    yklocker.set_serial_allowlist(["a"])
+    assert yklocker.get_serial_allowlist() == frozenset({12345678})
+
+
+def mock_ctap_device(fingerprint: str) -> MagicMock:
+    device = MagicMock()
+    device.fingerprint = fingerprint
+    return device
+
+
+def test_YkLock_read_serials() -> None:
+    yklocker = YkLock()
+    yklocker.set_sysfs_root(None)
+
+    devices = [mock_ctap_device("/dev/hidraw3"), mock_ctap_device("/dev/hidraw4")]
+    info = MagicMock()
+    info.serial = 12345678
+    with patch("sciber_yklocker.models.yklock.list_ctap_devices", lambda: devices):
+        with patch(
+            "sciber_yklocker.models.yklock.read_info",
+            MagicMock(side_effect=[info, OSError("busy")]),
+        ):
+            with patch("sciber_yklocker.models.yklock.YkLock.logger") as mock_logger:
+                assert yklocker.read_serials() == {"/dev/hidraw3": 12345678}
+                assert "busy" in mock_logger.call_args[0][0]
+
+
+def test_YkLock_read_serials_sysfs(tmp_path) -> None:
+    yklocker = YkLock()
+    yklocker.set_sysfs_root(str(tmp_path))
+
+    info = MagicMock()
+    info.serial = 12345678
+    devices = [mock_ctap_device("/dev/hidraw3"), mock_ctap_device("/dev/hidraw9")]
+    with patch("sciber_yklocker.models.yklock.list_ctap_devices", lambda: devices):
+        with patch("sciber_yklocker.models.yklock.read_info", lambda c, p: info):
+            with patch(
+                "sciber_yklocker.models.yklock.hidraw_usb_device",
+                lambda devnode: "1-2" if devnode == "/dev/hidraw3" else None,
+            ):
+                # Keyed the same way as the sysfs probe
+                assert yklocker.read_serials() == {"1-2": 12345678}
+
+
+def test_YkLock_is_yubikey_connected_allowlist() -> None:
+    yklocker = YkLock()
+    yklocker.set_serial_allowlist({12345678})
+
+    yklocker.list_device_fingerprints = lambda: ["1-2@5"]
+    yklocker.read_serials = MagicMock(return_value={"1-2@5": 23456789})
+    # A YubiKey that is not ours does not count
+    assert yklocker.is_yubikey_connected() is False
+
+    # Ours is inserted, its identity is read once
+    yklocker.list_device_fingerprints = lambda: ["1-2@5", "1-3@6"]
+    yklocker.read_serials.return_value = {"1-3@6": 12345678}
+    assert yklocker.is_yubikey_connected() is True
+    assert yklocker.is_yubikey_connected() is True
+    assert yklocker.read_serials.call_count == 2
+
+
+def test_YkLock_list_device_fingerprints(tmp_path) -> None:
+    yklocker = YkLock()
+    yklocker.set_sysfs_root(str(tmp_path))
+    device = tmp_path / "1-2"
+    device.mkdir()
+    (device / "idVendor").write_text("1050\n")
+    (device / "idProduct").write_text("0407\n")
+    (device / "devnum").write_text("5\n")
+    assert yklocker.list_device_fingerprints() == ["1-2@5"]
+
+    yklocker.set_sysfs_root(None)
+    devices = [mock_ctap_device("/dev/hidraw3")]
+    with patch("sciber_yklocker.models.yklock.list_ctap_devices", lambda: devices):
+        assert yklocker.list_device_fingerprints() == ["/dev/hidraw3"]
+
+
+def test_yklock_getset_presence() -> None:
+    yklocker = YkLock()
+    # The probe interval follows the timeout until set
+    assert yklocker.get_probe_interval() == yklocker.get_timeout()
+    yklocker.set_probe_interval(0.25)
+    yklocker.set_probe_interval(0)
+    yklocker.set_probe_interval("a")
+    assert yklocker.get_probe_interval() == 0.25
+
+    yklocker.set_grace_period(2)
+    yklocker.set_grace_period(-1)
+    assert yklocker.get_grace_period() == 2
+
+    yklocker.set_required_misses(3)
+    yklocker.set_required_misses(0)
+    yklocker.set_required_misses(1.5)
+    assert yklocker.get_required_misses() == 3
+
+
+def test_yklock_update_presence() -> None:
+    yklocker = YkLock()
+    assert yklocker.get_presence_state() == PresenceState.UNKNOWN
+    assert yklocker.update_presence(True, 0) == PresenceState.PRESENT
+    assert yklocker.get_presence_state() == PresenceState.PRESENT
+
+
+def test_yklock_getset_rearm_interval() -> None:
+    yklocker = YkLock()
+    assert yklocker.get_rearm_interval() == 0
+    yklocker.set_rearm_interval(60)
+    yklocker.set_rearm_interval(-1)
+    assert yklocker.get_rearm_interval() == 60
+    assert yklocker.dispatch(PresenceState.ABSENT, 0) == DispatchEvent.REMOVED
+
+
+def test_yklock_getset_schedule() -> None:
+    yklocker = YkLock()
+    assert yklocker.get_max_interval() is None
+    yklocker.set_max_interval(120)
+    yklocker.set_max_interval(0)
+    assert yklocker.get_max_interval() == 120
+
+    assert yklocker.get_max_wakeups_per_hour() is None
+    yklocker.set_max_wakeups_per_hour(60)
+    yklocker.set_max_wakeups_per_hour(0.5)
+    assert yklocker.get_max_wakeups_per_hour() == 60
+
+
+def test_yklock_getset_watchdog() -> None:
+    yklocker = YkLock()
+    assert yklocker.get_probe_deadline() == PROBE_DEADLINE
+    yklocker.set_probe_deadline(1.5)
+    yklocker.set_probe_deadline(0)
+    assert yklocker.get_probe_deadline() == 1.5
+
+    assert yklocker.get_stall_policy() == StallPolicy.LOCK
+    yklocker.set_stall_policy("absent")
+    yklocker.set_stall_policy("hello")
+    assert yklocker.get_stall_policy() == StallPolicy.ABSENT
+
+    yklocker.set_stalls_to_lock(5)
+    yklocker.set_stalls_to_lock(0)
+    assert yklocker.get_stalls_to_lock() == 5
+
+
+def test_yklock_probe_helper() -> None:
+    yklocker = YkLock()
+    assert yklocker.get_probe_helper() is None
+    probe_helper = MagicMock()
+    probe_helper.probe.return_value = True
+    yklocker.set_probe_helper(probe_helper)
+
+    # The helper probes, ykman is not used in this process
+    with patch("sciber_yklocker.models.yklock.list_all_devices") as mock_list:
+        assert yklocker.is_yubikey_connected() is True
+        mock_list.assert_not_called()
+    probe_helper.probe.assert_called_once()
+
+
+def test_yklock_apply_settings() -> None:
+    yklocker = YkLock()
+    yklocker.apply_settings(Settings(timeout=20, probe_interval=1, max_interval=60))
+    assert yklocker.get_timeout() == 20
+    assert yklocker.get_probe_interval() == 1
+    # Not set, left alone
+    assert yklocker.get_removal_option() == RemovalOption.NOTHING
+
+    # Only what changed is applied, removed settings go back to the default
+    previous = Settings(timeout=20, probe_interval=1, max_interval=60)
+    yklocker.set_grace_period(3)
+    yklocker.apply_settings(Settings(timeout=30, max_interval=60), previous)
+    assert yklocker.get_timeout() == 30
+    assert yklocker.get_probe_interval() == 30
+    assert yklocker.get_max_interval() == 60
+    assert yklocker.get_grace_period() == 3
+
+    yklocker.apply_settings(Settings(), Settings(timeout=30, max_interval=60))
+    assert yklocker.get_timeout() == 10
+    assert yklocker.get_max_interval() is None